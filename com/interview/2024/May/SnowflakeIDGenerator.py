@@ -2,34 +2,219 @@ import threading
 import time
 
 
+def millis():
+    return time.time_ns() // 1000000
+
+
+class ClockMovedBackwardsError(RuntimeError):
+    pass
+
+
 class SnowflakeIDGenerator:
-    def __init__(self, machine_id, epoch=1288834974657):
+    """
+    64-bit time-ordered ids: 41 bits of milliseconds since `epoch`, 10 bits
+    of machine id and a 12-bit sequence within the millisecond.
+
+    The sequence restarts at 0 whenever the millisecond changes. When it
+    runs out, the generator waits until the clock has really moved past
+    the millisecond instead of sleeping and hoping. If the clock steps back
+    by up to `max_backward_ms` (e.g. an NTP adjustment), ids keep coming
+    from the last millisecond seen, so they stay unique and increasing;
+    a bigger step back raises ClockMovedBackwardsError.
+
+    generate_batch(n) reserves whole sequence ranges under one lock
+    acquisition and builds the ids outside it. local_id() hands every thread
+    its own block of ids, so threads only meet on the lock once per block.
+    """
+
+    timestamp_bits = 41
+    machine_id_bits = 10
+    sequence_bits = 12
+    max_sequence = -1 ^ (-1 << sequence_bits)
+    max_machine_id = -1 ^ (-1 << machine_id_bits)
+
+    def __init__(self, machine_id, epoch=1288834974657, clock=millis, max_backward_ms=10, block_size=256):
+        if not 0 <= machine_id <= self.max_machine_id:
+            raise ValueError("machine_id must be between 0 and {}".format(self.max_machine_id))
+
         self.machine_id = machine_id
         self.epoch = epoch
-        self.sequence = 0
+        self.clock = clock
+        self.max_backward_ms = max_backward_ms
+        self.block_size = block_size
+
+        self.last_timestamp = -1
+        self.sequence = 0  # Next free sequence number in last_timestamp
         self.lock = threading.Lock()
+        self.local = threading.local()
 
-        self.timestamp_bits = 41
-        self.machine_id_bits = 10
-        self.sequence_bits = 12
-        self.max_sequence = -1 ^ (-1 << self.sequence_bits)
+    def _now(self):
+        return self.clock() - self.epoch
 
-    def generate_id(self):
+    def _next_timestamp(self):
+        """Called with the lock held, at the start of a reservation."""
+        now = self._now()
+        if now > self.last_timestamp:
+            self.last_timestamp = now
+            self.sequence = 0
+        elif self.last_timestamp - now > self.max_backward_ms:
+            raise ClockMovedBackwardsError("clock moved back {} ms".format(self.last_timestamp - now))
+
+    def _wait_next_millisecond(self):
+        """Called with the lock held once the sequence of last_timestamp is used up."""
+        now = self._now()
+        while now <= self.last_timestamp:
+            time.sleep(0.0001)
+            now = self._now()
+        self.last_timestamp = now
+        self.sequence = 0
+
+    def _reserve(self, n):
+        """Returns (timestamp, first sequence, count) ranges covering n ids."""
+        ranges = []
         with self.lock:
-            current_timestamp = int(time.time() * 1000) - self.epoch
-            if self.sequence >= self.max_sequence:
-                self.sequence = 0
-                time.sleep(0.001)  # Wait for next millisecond.
-                current_timestamp = int(time.time() * 1000) - self.epoch
+            self._next_timestamp()
+            while n:
+                if self.sequence > self.max_sequence:
+                    self._wait_next_millisecond()
+                count = min(n, self.max_sequence + 1 - self.sequence)
+                ranges.append((self.last_timestamp, self.sequence, count))
+                self.sequence += count
+                n -= count
+        return ranges
 
+    def generate_id(self):
+        with self.lock:
+            self._next_timestamp()
+            if self.sequence > self.max_sequence:
+                self._wait_next_millisecond()
+            timestamp, sequence = self.last_timestamp, self.sequence
             self.sequence += 1
-            snowflake_id = (current_timestamp << (self.machine_id_bits + self.sequence_bits)) | \
-                           (self.machine_id << self.sequence_bits) | \
-                           self.sequence
-            return snowflake_id
 
+        return (timestamp << (self.machine_id_bits + self.sequence_bits)) | \
+               (self.machine_id << self.sequence_bits) | \
+               sequence
+
+    def generate_batch(self, n):
+        """n increasing ids; ids in the same millisecond are consecutive integers."""
+        ids = []
+        for timestamp, sequence, count in self._reserve(n):
+            base = (timestamp << (self.machine_id_bits + self.sequence_bits)) | (self.machine_id << self.sequence_bits)
+            ids.extend(range(base + sequence, base + sequence + count))
+        return ids
+
+    def local_id(self):
+        """
+        Next id from the calling thread's block. Unique across threads and
+        increasing within a thread, but across threads only ordered to within
+        one block, since a thread may still be handing out an older block.
+        """
+        allocator = getattr(self.local, "allocator", None)
+        if allocator is None:
+            allocator = self.local.allocator = IDAllocator(self, self.block_size)
+        return allocator.next_id()
+
+
+class IDAllocator:
+    """Hands out ids from blocks reserved with generate_batch; use one per thread."""
+
+    def __init__(self, generator, block_size=256):
+        self.generator = generator
+        self.block_size = block_size
+        self.ids = iter(())
+
+    def next_id(self):
+        snowflake_id = next(self.ids, None)
+        if snowflake_id is None:
+            self.ids = iter(self.generator.generate_batch(self.block_size))
+            snowflake_id = next(self.ids)
+        return snowflake_id
+
+
+def fake_clock(times):
+    """Clock returning the given milliseconds in turn, then the last one forever."""
+    times = list(times)
+
+    def clock():
+        return times.pop(0) if len(times) > 1 else times[0]
+
+    return clock
+
+
+def run_tests():
+    results = []
+
+    generator = SnowflakeIDGenerator(1, epoch=0, clock=fake_clock([5, 5, 6]))
+    ids = [generator.generate_id() for _ in range(3)]
+    results.append(("sequence resets each millisecond", [i & 0xFFF for i in ids] == [0, 1, 0]))
+
+    generator = SnowflakeIDGenerator(1, epoch=0, clock=fake_clock([5, 5, 5, 6]))
+    ids = generator.generate_batch(5000)
+    results.append(("batch spills into the next millisecond",
+                    len(set(ids)) == 5000 and ids == sorted(ids) and ids[-1] >> 22 == 6))
+
+    generator = SnowflakeIDGenerator(1, epoch=0, clock=fake_clock([100, 97, 101]))
+    ids = [generator.generate_id() for _ in range(3)]
+    results.append(("small clock regression stays increasing", ids == sorted(ids) and len(set(ids)) == 3))
+
+    generator = SnowflakeIDGenerator(1, epoch=0, clock=fake_clock([100, 50]), max_backward_ms=10)
+    generator.generate_id()
+    try:
+        generator.generate_id()
+        results.append(("large clock regression raises", False))
+    except ClockMovedBackwardsError:
+        results.append(("large clock regression raises", True))
+
+    generator = SnowflakeIDGenerator(2)
+    per_thread = [[] for _ in range(8)]
+
+    def work(out):
+        for _ in range(20000):
+            out.append(generator.local_id())
+
+    threads = [threading.Thread(target=work, args=(out,)) for out in per_thread]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    all_ids = [i for out in per_thread for i in out]
+    results.append(("threads never collide", len(set(all_ids)) == len(all_ids) and
+                    all(out == sorted(out) for out in per_thread)))
+
+    for name, passed in results:
+        print("{}: {}".format(name, "Pass" if passed else "Fail"))
+
+
+def benchmark(n=2000000, num_threads=4):
+    generator = SnowflakeIDGenerator(1)
+    start = time.perf_counter()
+    for _ in range(n // 10):
+        generator.generate_id()
+    print("generate_id:   {:,.0f} ids/s".format(n // 10 / (time.perf_counter() - start)))
+
+    start = time.perf_counter()
+    for _ in range(n // 4096):
+        generator.generate_batch(4096)
+    print("generate_batch: {:,.0f} ids/s".format(n // 4096 * 4096 / (time.perf_counter() - start)))
+
+    def work():
+        for _ in range(n // num_threads):
+            generator.local_id()
+
+    threads = [threading.Thread(target=work) for _ in range(num_threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print("local_id x{}:   {:,.0f} ids/s".format(num_threads, n // num_threads * num_threads / (time.perf_counter() - start)))
+
+
+if __name__ == "__main__":
+    # Example usage
+    machine_id = 1
+    generator = SnowflakeIDGenerator(machine_id)
+    print(generator.generate_id())
 
-# Example usage
-machine_id = 1
-generator = SnowflakeIDGenerator(machine_id)
-print(generator.generate_id())
+    run_tests()
+    benchmark()
@@ -0,0 +1,279 @@
+"""
+Tokenizer and recursive-descent parser for the SQL dialect of MicroDB.
+
+parse() turns statement text into a tree of the named tuples below, once;
+MicroDB compiles that tree against its tables and caches the result.
+
+    CREATE TABLE t (column TYPE, ...)
+    CREATE INDEX name ON t (column) [USING HASH | SORTED]
+    INSERT INTO t (column, ...) VALUES (value, ...)[, (value, ...) ...]
+    SELECT * | item, ... FROM t [WHERE condition] [GROUP BY column, ...]
+        [ORDER BY item [ASC | DESC], ...] [LIMIT count]
+    UPDATE t SET column = value, ... [WHERE condition]
+    DELETE FROM t [WHERE condition]
+
+A condition combines `column op value` comparisons with AND, OR and
+parentheses; a value is a number, a quoted string or a `?` parameter.
+A select item is a column or an aggregate: COUNT(*), or COUNT, SUM, AVG,
+MIN or MAX of a column.
+"""
+
+import re
+from collections import namedtuple
+
+CreateTable = namedtuple('CreateTable', 'table columns')  # columns: [(name, type)]
+CreateIndex = namedtuple('CreateIndex', 'name table column kind')
+Insert = namedtuple('Insert', 'table columns rows')  # rows: [tuple of values]
+Select = namedtuple('Select', 'fields table where group_by order_by limit')  # fields: ['*'] or items
+Aggregate = namedtuple('Aggregate', 'function column')  # column is '*' for COUNT(*)
+Update = namedtuple('Update', 'table assignments where')  # assignments: [(column, value)]
+Delete = namedtuple('Delete', 'table where')
+Compare = namedtuple('Compare', 'column op value')
+And = namedtuple('And', 'terms')
+Or = namedtuple('Or', 'terms')
+Param = namedtuple('Param', 'index')
+
+AGGREGATES = ('COUNT', 'SUM', 'AVG', 'MIN', 'MAX')
+OPERATORS = {'=': '=', '==': '=', '!=': '!=', '<>': '!=', '<': '<', '<=': '<=', '>': '>', '>=': '>='}
+
+TOKEN = re.compile(r"""\s*(?:
+    (?P<number>-?\d+)
+  | (?P<string>'(?:[^']|'')*'|"[^"]*")
+  | (?P<op><=|>=|!=|<>|==|[=<>(),*?;])
+  | (?P<word>\w+)
+)""", re.VERBOSE)
+
+
+class SQLSyntaxError(ValueError):
+    pass
+
+
+def tokenize(text):
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        match = TOKEN.match(text, pos)
+        if match is None or match.end() == pos:
+            raise SQLSyntaxError('Unexpected character at {}: {!r}'.format(pos, text[pos:pos + 10]))
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'number':
+            value = int(value)
+        elif kind == 'string':
+            value = value[1:-1].replace("''", "'") if value[0] == "'" else value[1:-1]
+        tokens.append((kind, value))
+        pos = match.end()
+    return tokens
+
+
+class Parser:
+    def __init__(self, text):
+        self.tokens = tokenize(text)
+        self.pos = 0
+        self.param_count = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def accept(self, *words):
+        """Consumes the next token if it is one of the keywords or symbols."""
+        kind, value = self.peek()
+        if kind in ('word', 'op') and str(value).upper() in words:
+            self.pos += 1
+            return str(value).upper()
+        return None
+
+    def expect(self, *words):
+        found = self.accept(*words)
+        if found is None:
+            raise SQLSyntaxError('Expected {} but found {!r}'.format(' or '.join(words), self.peek()[1]))
+        return found
+
+    def identifier(self):
+        kind, value = self.peek()
+        if kind != 'word':
+            raise SQLSyntaxError('Expected a name but found {!r}'.format(value))
+        self.pos += 1
+        return value
+
+    def identifiers(self):
+        names = [self.identifier()]
+        while self.accept(','):
+            names.append(self.identifier())
+        return names
+
+    def value(self):
+        kind, value = self.peek()
+        if kind in ('number', 'string'):
+            self.pos += 1
+            return value
+        if self.accept('?'):
+            self.param_count += 1
+            return Param(self.param_count - 1)
+        raise SQLSyntaxError('Expected a value but found {!r}'.format(value))
+
+    def statement(self):
+        if self.accept('CREATE'):
+            if self.accept('TABLE'):
+                node = self.create_table()
+            else:
+                self.expect('INDEX')
+                node = self.create_index()
+        elif self.accept('INSERT'):
+            node = self.insert()
+        elif self.accept('UPDATE'):
+            node = self.update()
+        elif self.accept('DELETE'):
+            node = self.delete()
+        else:
+            self.expect('SELECT')
+            node = self.select()
+        self.accept(';')
+        if self.pos != len(self.tokens):
+            raise SQLSyntaxError('Unexpected {!r} after the statement'.format(self.peek()[1]))
+        return node
+
+    def create_table(self):
+        table = self.identifier()
+        self.expect('(')
+        columns = [(self.identifier(), self.identifier().upper())]
+        while self.accept(','):
+            columns.append((self.identifier(), self.identifier().upper()))
+        self.expect(')')
+        return CreateTable(table, columns)
+
+    def create_index(self):
+        name = self.identifier()
+        self.expect('ON')
+        table = self.identifier()
+        self.expect('(')
+        column = self.identifier()
+        self.expect(')')
+        kind = self.identifier().upper() if self.accept('USING') else 'SORTED'
+        return CreateIndex(name, table, column, kind)
+
+    def insert(self):
+        self.expect('INTO')
+        table = self.identifier()
+        self.expect('(')
+        columns = self.identifiers()
+        self.expect(')')
+        self.expect('VALUES')
+        rows = [self.row()]
+        while self.accept(','):
+            rows.append(self.row())
+        for values in rows:
+            if len(values) != len(columns):
+                raise SQLSyntaxError('INSERT has {} columns but {} values'.format(len(columns), len(values)))
+        return Insert(table, columns, rows)
+
+    def row(self):
+        self.expect('(')
+        values = [self.value()]
+        while self.accept(','):
+            values.append(self.value())
+        self.expect(')')
+        return tuple(values)
+
+    def select(self):
+        if self.accept('*'):
+            fields = ['*']
+        else:
+            fields = [self.select_item()]
+            while self.accept(','):
+                fields.append(self.select_item())
+        self.expect('FROM')
+        table = self.identifier()
+        where = self.condition() if self.accept('WHERE') else None
+
+        group_by = []
+        if self.accept('GROUP'):
+            self.expect('BY')
+            group_by = self.identifiers()
+
+        order_by = []  # [(item, descending)]
+        if self.accept('ORDER'):
+            self.expect('BY')
+            while True:
+                item = self.select_item()
+                order_by.append((item, self.accept('ASC', 'DESC') == 'DESC'))
+                if not self.accept(','):
+                    break
+
+        limit = self.value() if self.accept('LIMIT') else None
+        if limit is not None and not isinstance(limit, Param) and (not isinstance(limit, int) or limit < 0):
+            raise SQLSyntaxError('LIMIT must be a non-negative integer, not {!r}'.format(limit))
+        return Select(fields, table, where, group_by, order_by, limit)
+
+    def select_item(self):
+        kind, value = self.peek()
+        following = self.tokens[self.pos + 1] if self.pos + 1 < len(self.tokens) else (None, None)
+        if kind != 'word' or value.upper() not in AGGREGATES or following != ('op', '('):
+            return self.identifier()
+        self.pos += 2
+        function = value.upper()
+        column = '*' if function == 'COUNT' and self.accept('*') else self.identifier()
+        self.expect(')')
+        return Aggregate(function, column)
+
+    def update(self):
+        table = self.identifier()
+        self.expect('SET')
+        assignments = []
+        while True:
+            column = self.identifier()
+            self.expect('=')
+            assignments.append((column, self.value()))
+            if not self.accept(','):
+                break
+        where = self.condition() if self.accept('WHERE') else None
+        return Update(table, assignments, where)
+
+    def delete(self):
+        self.expect('FROM')
+        table = self.identifier()
+        where = self.condition() if self.accept('WHERE') else None
+        return Delete(table, where)
+
+    def condition(self):
+        terms = [self.conjunction()]
+        while self.accept('OR'):
+            terms.append(self.conjunction())
+        return terms[0] if len(terms) == 1 else Or(terms)
+
+    def conjunction(self):
+        terms = [self.comparison()]
+        while self.accept('AND'):
+            terms.append(self.comparison())
+        return terms[0] if len(terms) == 1 else And(terms)
+
+    def comparison(self):
+        if self.accept('('):
+            node = self.condition()
+            self.expect(')')
+            return node
+        column = self.identifier()
+        kind, op = self.peek()
+        if op not in OPERATORS:
+            raise SQLSyntaxError('Expected a comparison after {} but found {!r}'.format(column, op))
+        self.pos += 1
+        return Compare(column, OPERATORS[op], self.value())
+
+
+def parse(text):
+    """Returns (statement tree, number of ? parameters)."""
+    parser = Parser(text)
+    return parser.statement(), parser.param_count
+
+
+def to_dnf(node):
+    """Flattens a condition into OR branches of AND-ed comparisons."""
+    if isinstance(node, Compare):
+        return [[node]]
+    if isinstance(node, Or):
+        return [branch for term in node.terms for branch in to_dnf(term)]
+    branches = [[]]
+    for term in node.terms:
+        branches = [left + right for left in branches for right in to_dnf(term)]
+    return branches
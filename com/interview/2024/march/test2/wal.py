@@ -0,0 +1,249 @@
+"""
+Durable storage for MicroDB: a write-ahead log plus binary snapshots.
+
+WAL record:  payload length (uint32) | crc32 of payload (uint32) | lsn (int64) | payload
+payload:     kind byte | body, where kind is
+             T  CREATE TABLE, body is JSON {"table", "columns"}
+             X  CREATE INDEX, body is JSON {"name", "table", "column", "kind"}
+             R  inserted rows, body is the table name and the rows column by column (see encode_batch)
+             S  UPDATE or DELETE, body is JSON {"sql", "params"}, replayed by executing it again
+
+Records are buffered and written with one fsync per `group_commit` records
+(or on commit()), so a crash loses at most the records of the open group.
+A torn or corrupt tail is detected by length and checksum and cut off on
+recovery.
+
+Snapshot:    MDB1 | lsn | tables | crc32 of everything before it
+A snapshot holds every table's columns as raw arrays (native byte order)
+and its index definitions, and records the LSN of the last WAL record it
+includes, so recovery loads it and replays only newer WAL records.
+"""
+
+import json
+import os
+import struct
+import zlib
+from array import array
+
+RECORD_HEADER = struct.Struct('<IIq')
+SNAPSHOT_MAGIC = b'MDB1'
+
+CREATE_TABLE = b'T'
+CREATE_INDEX = b'X'
+ROWS = b'R'
+STATEMENT = b'S'
+
+
+class Writer:
+    def __init__(self):
+        self.parts = []
+
+    def bytes(self, data):
+        self.parts.append(data)
+
+    def uint(self, value):
+        self.parts.append(struct.pack('<Q', value))
+
+    def text(self, value):
+        data = value.encode()
+        self.uint(len(data))
+        self.parts.append(data)
+
+    def strings(self, values):
+        encoded = [value.encode() for value in values]
+        self.uint(len(encoded))
+        self.parts.append(array('I', map(len, encoded)).tobytes())
+        self.parts.append(b''.join(encoded))
+
+    def array(self, values):
+        self.uint(len(values))
+        self.parts.append(values.tobytes())
+
+    def getvalue(self):
+        return b''.join(self.parts)
+
+
+class Reader:
+    def __init__(self, data, pos=0):
+        self.data = memoryview(data)
+        self.pos = pos
+
+    def bytes(self, size):
+        data = self.data[self.pos:self.pos + size]
+        self.pos += size
+        return data
+
+    def uint(self):
+        return struct.unpack('<Q', self.bytes(8))[0]
+
+    def text(self):
+        return str(self.bytes(self.uint()), 'utf-8')
+
+    def strings(self):
+        count = self.uint()
+        lengths = array('I')
+        lengths.frombytes(self.bytes(4 * count))
+        blob = bytes(self.bytes(sum(lengths)))
+        values = []
+        start = 0
+        for length in lengths:
+            values.append(blob[start:start + length].decode())
+            start += length
+        return values
+
+    def array(self, typecode):
+        values = array(typecode)
+        values.frombytes(self.bytes(self.uint() * values.itemsize))
+        return values
+
+
+def encode_batch(table_name, schema, columns):
+    """Rows of one INSERT, column by column: INT columns as int64 arrays, STRING columns as length-prefixed UTF-8."""
+    writer = Writer()
+    writer.text(table_name)
+    for data_type, values in zip(schema.values(), columns):
+        if data_type == 'INT':
+            writer.array(array('q', values))
+        else:
+            writer.strings(values)
+    return writer.getvalue()
+
+
+def decode_batch(body, schema_of):
+    """Returns (table name, list of column values) for a ROWS record; schema_of(table name) gives its schema."""
+    reader = Reader(body)
+    table_name = reader.text()
+    columns = [reader.array('q') if data_type == 'INT' else reader.strings()
+               for data_type in schema_of(table_name).values()]
+    return table_name, columns
+
+
+class WriteAheadLog:
+    def __init__(self, path, lsn=0, group_commit=64, fsync=True):
+        self.path = path
+        self.file = open(path, 'ab')
+        self.lsn = lsn  # LSN of the last record appended
+        self.group_commit = group_commit
+        self.fsync = fsync
+        self.buffer = []
+        self.buffered_bytes = 0
+        self.commits = 0
+
+    def append(self, kind, body):
+        """Buffers a record and returns its LSN; the record is durable once its group is committed."""
+        self.lsn += 1
+        payload = kind + body
+        record = RECORD_HEADER.pack(len(payload), zlib.crc32(payload), self.lsn) + payload
+        self.buffer.append(record)
+        self.buffered_bytes += len(record)
+        if len(self.buffer) >= self.group_commit:
+            self.commit()
+        return self.lsn
+
+    def commit(self):
+        """Writes every buffered record with a single write and fsync."""
+        if not self.buffer:
+            return
+        self.file.write(b''.join(self.buffer))
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+        self.buffer.clear()
+        self.buffered_bytes = 0
+        self.commits += 1
+
+    def size(self):
+        return self.file.tell() + self.buffered_bytes
+
+    def truncate(self):
+        """Empties the log once a snapshot covers all of it."""
+        self.commit()
+        self.file.truncate(0)
+        self.file.seek(0)
+        if self.fsync:
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        self.commit()
+        self.file.close()
+
+
+def read_log(path):
+    """
+    Yields (lsn, kind, body) for every intact record, then truncates the
+    file after the last one, dropping a record torn by a crash.
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as file:
+        data = file.read()
+
+    pos = 0
+    while pos + RECORD_HEADER.size <= len(data):
+        length, checksum, lsn = RECORD_HEADER.unpack_from(data, pos)
+        start = pos + RECORD_HEADER.size
+        payload = data[start:start + length]
+        if len(payload) < length or zlib.crc32(payload) != checksum:
+            break
+        yield lsn, payload[:1], payload[1:]
+        pos = start + length
+
+    if pos < len(data):
+        with open(path, 'r+b') as file:
+            file.truncate(pos)
+
+
+def write_snapshot(path, lsn, tables):
+    """
+    Atomically replaces the snapshot at `path`. `tables` is a list of
+    (name, schema, row_count, column payloads, index definitions) where a
+    column payload is its int64 array, or (strings, int32 codes) for STRING.
+    """
+    writer = Writer()
+    writer.bytes(SNAPSHOT_MAGIC)
+    writer.uint(lsn)
+    writer.uint(len(tables))
+    for name, schema, row_count, payloads, indexes in tables:
+        writer.text(name)
+        writer.uint(row_count)
+        writer.text(json.dumps(list(schema.items())))
+        for data_type, payload in zip(schema.values(), payloads):
+            if data_type == 'INT':
+                writer.array(payload)
+            else:
+                strings, codes = payload
+                writer.strings(strings)
+                writer.array(codes)
+        writer.text(json.dumps(indexes))
+    data = writer.getvalue()
+
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as file:
+        file.write(data)
+        file.write(struct.pack('<I', zlib.crc32(data)))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+
+
+def read_snapshot(path):
+    """Returns (lsn, tables) in the shape write_snapshot takes, or (0, []) when there is no snapshot."""
+    if not os.path.exists(path):
+        return 0, []
+    with open(path, 'rb') as file:
+        data = file.read()
+    if data[:4] != SNAPSHOT_MAGIC or zlib.crc32(data[:-4]) != struct.unpack('<I', data[-4:])[0]:
+        raise ValueError('Corrupt snapshot {}'.format(path))
+
+    reader = Reader(data, 4)
+    lsn = reader.uint()
+    tables = []
+    for _ in range(reader.uint()):
+        name = reader.text()
+        row_count = reader.uint()
+        schema = dict(json.loads(reader.text()))
+        payloads = [reader.array('q') if data_type == 'INT' else (reader.strings(), reader.array('i'))
+                    for data_type in schema.values()]
+        indexes = [tuple(index) for index in json.loads(reader.text())]
+        tables.append((name, schema, row_count, payloads, indexes))
+    return lsn, tables
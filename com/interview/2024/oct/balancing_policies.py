@@ -0,0 +1,212 @@
+import bisect
+import hashlib
+import heapq
+import random
+from abc import ABC, abstractmethod
+
+from load_balancer import LoadBalancer
+
+
+class BalancingPolicy(ABC):
+    """
+    The interface every load-balancing policy implements.
+
+    pick() chooses a server for a request (None when no server is active),
+    started()/finished() tell the policy a request began or completed on a
+    server, and fail_server()/recover_server() take servers out and back in.
+    """
+
+    def __init__(self, serversPowers):
+        self.powers = list(serversPowers)
+        self.n = len(self.powers)
+
+    @abstractmethod
+    def pick(self, key):
+        pass
+
+    def started(self, server):
+        pass
+
+    def finished(self, server):
+        pass
+
+    @abstractmethod
+    def fail_server(self, index):
+        pass
+
+    @abstractmethod
+    def recover_server(self, index):
+        pass
+
+
+class RoundRobinCapacity(BalancingPolicy):
+    """Round robin over servers with capacity left, as in process_request.py (see load_balancer.LoadBalancer)."""
+
+    def __init__(self, serversPowers):
+        super().__init__(serversPowers)
+        self.balancer = LoadBalancer(serversPowers)
+
+    def pick(self, key):
+        return self.balancer.process_request()
+
+    def fail_server(self, index):
+        self.balancer.fail_server(index)
+
+    def recover_server(self, index):
+        self.balancer.recover_server(index)
+
+
+class ActiveSet:
+    """Active server indexes with O(1) add, remove and uniform random choice."""
+
+    def __init__(self, n):
+        self.items = list(range(n))
+        self.position = list(range(n))
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, index):
+        return self.position[index] is not None
+
+    def add(self, index):
+        if self.position[index] is None:
+            self.position[index] = len(self.items)
+            self.items.append(index)
+
+    def remove(self, index):
+        pos = self.position[index]
+        if pos is None:
+            return
+        last = self.items.pop()
+        if last != index:
+            self.items[pos] = last
+            self.position[last] = pos
+        self.position[index] = None
+
+
+class LeastConnections(BalancingPolicy):
+    """
+    Sends each request to the active server with the fewest requests in
+    flight, relative to its power. A heap with lazily discarded stale
+    entries keeps every operation O(log n) amortized.
+    """
+
+    def __init__(self, serversPowers):
+        super().__init__(serversPowers)
+        self.connections = [0] * self.n
+        self.active = ActiveSet(self.n)
+        self.heap = [(0.0, i) for i in range(self.n)]
+
+    def load(self, server):
+        return self.connections[server] / (self.powers[server] or 1)
+
+    def pick(self, key):
+        while self.heap:
+            load, server = self.heap[0]
+            if server in self.active and load == self.load(server):
+                return server
+            heapq.heappop(self.heap)
+        return None
+
+    def push(self, server):
+        heapq.heappush(self.heap, (self.load(server), server))
+
+        # Stale entries below the top are only dropped when they surface, so rebuild once they dominate
+        if len(self.heap) > 4 * self.n + 64:
+            self.heap = [(self.load(i), i) for i in self.active.items]
+            heapq.heapify(self.heap)
+
+    def started(self, server):
+        self.connections[server] += 1
+        self.push(server)
+
+    def finished(self, server):
+        self.connections[server] -= 1
+        self.push(server)
+
+    def fail_server(self, index):
+        self.active.remove(index)
+
+    def recover_server(self, index):
+        self.active.add(index)
+        self.push(index)
+
+
+class PowerOfTwoChoices(BalancingPolicy):
+    """Samples two active servers at random and keeps the one with fewer connections per unit of power."""
+
+    def __init__(self, serversPowers, seed=0):
+        super().__init__(serversPowers)
+        self.connections = [0] * self.n
+        self.active = ActiveSet(self.n)
+        self.random = random.Random(seed)
+
+    def pick(self, key):
+        if not self.active:
+            return None
+        first = self.active.items[self.random.randrange(len(self.active))]
+        second = self.active.items[self.random.randrange(len(self.active))]
+        if self.connections[second] * (self.powers[first] or 1) < self.connections[first] * (self.powers[second] or 1):
+            return second
+        return first
+
+    def started(self, server):
+        self.connections[server] += 1
+
+    def finished(self, server):
+        self.connections[server] -= 1
+
+    def fail_server(self, index):
+        self.active.remove(index)
+
+    def recover_server(self, index):
+        self.active.add(index)
+
+
+def stable_hash(value):
+    return int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), "big")
+
+
+class ConsistentHashing(BalancingPolicy):
+    """
+    Hash ring with virtual nodes; a server's share of the ring is proportional
+    to its power. A request key always maps to the same server while that
+    server is up, and failing a server only moves the keys it owned.
+    """
+
+    def __init__(self, serversPowers, replicas=64):
+        super().__init__(serversPowers)
+        self.replicas = replicas
+        self.up = set(range(self.n))
+        self.ring = sorted(node for server in range(self.n) for node in self.virtual_nodes(server))  # (hash, server)
+
+    def virtual_nodes(self, server):
+        return [(stable_hash("{}#{}".format(server, replica)), server)
+                for replica in range(self.replicas * max(self.powers[server], 1))]
+
+    def pick(self, key):
+        if not self.ring:
+            return None
+        i = bisect.bisect(self.ring, (stable_hash(key), self.n))
+        return self.ring[i % len(self.ring)][1]
+
+    def fail_server(self, index):
+        if index in self.up:
+            self.up.remove(index)
+            self.ring = [node for node in self.ring if node[1] != index]
+
+    def recover_server(self, index):
+        if index in self.up:
+            return
+        self.up.add(index)
+        for node in self.virtual_nodes(index):
+            bisect.insort(self.ring, node)
+
+
+POLICIES = {
+    "round-robin": RoundRobinCapacity,
+    "least-connections": LeastConnections,
+    "power-of-two": PowerOfTwoChoices,
+    "consistent-hashing": ConsistentHashing,
+}
@@ -0,0 +1,164 @@
+import heapq
+import math
+import random
+import sys
+from collections import deque
+
+from balancing_policies import POLICIES
+
+# Service-time distributions: each returns a sampler taking a random.Random
+
+
+def constant(seconds):
+    return lambda rand: seconds
+
+
+def exponential(mean):
+    return lambda rand: rand.expovariate(1 / mean)
+
+
+def lognormal(mean, sigma):
+    mu = math.log(mean) - sigma * sigma / 2
+    return lambda rand: rand.lognormvariate(mu, sigma)
+
+
+class Server:
+    def __init__(self, slots, speed):
+        self.slots = slots
+        self.speed = speed
+        self.busy = 0
+        self.queue = deque()
+        self.busy_time = 0.0
+        self.served = 0
+
+
+class SimulationReport:
+    def __init__(self, policy_name, servers, latencies, dropped, duration):
+        self.policy_name = policy_name
+        self.dropped = dropped
+        self.duration = duration
+        self.served = [server.served for server in servers]
+        self.utilization = [server.busy_time / (server.slots * duration) if duration else 0.0 for server in servers]
+        self.latencies = sorted(latencies)
+
+    def percentile(self, p):
+        if not self.latencies:
+            return 0.0
+        return self.latencies[min(len(self.latencies) - 1, int(p / 100 * len(self.latencies)))]
+
+    def summary(self):
+        return ("{:<20} served {:>7}  dropped {:>5}  p50 {:7.3f}  p95 {:7.3f}  p99 {:7.3f}  max {:7.3f}  "
+                "util mean {:.2f} max {:.2f}").format(
+            self.policy_name, len(self.latencies), self.dropped, self.percentile(50), self.percentile(95),
+            self.percentile(99),
+            self.latencies[-1] if self.latencies else 0.0,
+            sum(self.utilization) / len(self.utilization), max(self.utilization))
+
+
+class Simulator:
+    """
+    Discrete-event simulation of a load balancer in front of servers.
+
+    The trace is (time, event, value) tuples sorted by time: ("REQUEST", key),
+    ("FAIL", server) or ("RECOVER", server). A routed request queues at its
+    server, which works on up to `slots` requests at a time; the service
+    time is drawn from `service_time` and divided by the server's power, so
+    stronger servers finish sooner. A failed server takes no new requests
+    but drains what it already has.
+    """
+
+    def __init__(self, policy_name, serversPowers, service_time=exponential(1.0), slots=1, seed=0):
+        self.policy_name = policy_name
+        self.policy = POLICIES[policy_name](serversPowers)
+        self.servers = [Server(slots, power or 1) for power in serversPowers]
+        self.service_time = service_time
+        self.random = random.Random(seed)
+
+    def run(self, trace):
+        completions = []  # (finish time, sequence, server, arrival time)
+        latencies = []
+        dropped = 0
+        sequence = 0
+        now = 0.0
+
+        def start(server_index, arrival):
+            nonlocal sequence
+            server = self.servers[server_index]
+            server.busy += 1
+            duration = self.service_time(self.random) / server.speed
+            server.busy_time += duration
+            heapq.heappush(completions, (now + duration, sequence, server_index, arrival))
+            sequence += 1
+
+        def complete_until(time):
+            nonlocal now
+            while completions and completions[0][0] <= time:
+                now, _, server_index, arrival = heapq.heappop(completions)
+                server = self.servers[server_index]
+                server.busy -= 1
+                server.served += 1
+                latencies.append(now - arrival)
+                self.policy.finished(server_index)
+                if server.queue:
+                    start(server_index, server.queue.popleft())
+
+        for time, event, value in trace:
+            complete_until(time)
+            now = time
+            if event == "REQUEST":
+                server_index = self.policy.pick(value)
+                if server_index is None:
+                    dropped += 1
+                    continue
+                self.policy.started(server_index)
+                server = self.servers[server_index]
+                if server.busy < server.slots:
+                    start(server_index, now)
+                else:
+                    server.queue.append(now)
+            elif event == "FAIL":
+                self.policy.fail_server(value)
+            elif event == "RECOVER":
+                self.policy.recover_server(value)
+
+        complete_until(math.inf)
+        return SimulationReport(self.policy_name, self.servers, latencies, dropped, now)
+
+
+def poisson_trace(rate, duration, num_keys=10000, num_servers=0, fail_rate=0.0, seed=0):
+    """Poisson request arrivals with random keys, plus optional server failures that recover after a while."""
+    rand = random.Random(seed)
+    trace = []
+    time = 0.0
+    while True:
+        time += rand.expovariate(rate)
+        if time >= duration:
+            break
+        trace.append((time, "REQUEST", "key-{}".format(rand.randrange(num_keys))))
+        if num_servers and rand.random() < fail_rate:
+            server = rand.randrange(num_servers)
+            trace.append((time, "FAIL", server))
+            trace.append((time + rand.uniform(5, 50), "RECOVER", server))
+    trace.sort(key=lambda item: item[0])
+    return trace
+
+
+def main():
+    num_servers = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    rand = random.Random(3)
+    powers = [rand.choice([1, 2, 4]) for _ in range(num_servers)]
+
+    # Offered load of about 80% of total capacity, with occasional failures
+    rate = 0.8 * sum(powers)
+    trace = poisson_trace(rate, duration=200, num_servers=num_servers, fail_rate=0.001)
+    print("{} servers, {} trace events".format(num_servers, len(trace)))
+
+    for distribution_name, service_time in (("exponential", exponential(1.0)), ("lognormal", lognormal(1.0, 1.0))):
+        print("service time: {}".format(distribution_name))
+        for policy_name in POLICIES:
+            report = Simulator(policy_name, powers, service_time=service_time).run(trace)
+            print("  " + report.summary())
+
+
+if __name__ == "__main__":
+    main()
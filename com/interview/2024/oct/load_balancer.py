@@ -0,0 +1,252 @@
+import random
+import sys
+import time
+
+
+class LoadBalancer:
+    """
+    Round-robin load balancer over servers with a capacity (power) each.
+
+    A request goes to the next server, cyclically from the one after the
+    last server used, that is active and has capacity left. When no active
+    server has capacity left, every active server gets its power back.
+
+    Instead of walking over failed or exhausted servers, two Fenwick trees
+    count per index how many servers are active and how many active servers
+    are exhausted. Finding the next available server is a binary-lifting
+    search on their difference, so REQUEST, FAIL and RECOVER cost O(log n).
+    The exhausted tree and the capacities are stamped with an epoch, so the
+    capacity reset is just starting a new epoch: O(1).
+    """
+
+    def __init__(self, serversPowers):
+        self.powers = list(serversPowers)
+        self.n = len(self.powers)
+        self.requests_served = [0] * self.n
+        self.current_server = 0
+        self.dropped = 0
+        self.most_served = (0, self.n - 1)  # (requests, index) of the most served server
+
+        # Servers with no power can never take a request, so they are never active
+        self.active = [power > 0 for power in self.powers]
+        self.active_count = sum(self.active)
+        self.active_tree = [0] * (self.n + 1)
+        for i, is_active in enumerate(self.active):
+            self.active_tree[i + 1] += is_active
+            parent = i + 1 + ((i + 1) & -(i + 1))
+            if parent <= self.n:
+                self.active_tree[parent] += self.active_tree[i + 1]
+
+        # Exhausted servers and capacities are only valid while their stamp matches the epoch
+        self.epoch = 0
+        self.exhausted_tree = [0] * (self.n + 1)
+        self.exhausted_stamp = [0] * (self.n + 1)
+        self.exhausted_count = 0
+        self.capacities = self.powers[:]
+        self.capacity_stamp = [0] * self.n
+
+        self.top_bit = 1 << (self.n.bit_length() - 1) if self.n else 0
+
+    def _add(self, tree, i, delta):
+        i += 1
+        while i <= self.n:
+            tree[i] += delta
+            i += i & -i
+
+    def _add_exhausted(self, i, delta):
+        tree, stamp, epoch = self.exhausted_tree, self.exhausted_stamp, self.epoch
+        i += 1
+        while i <= self.n:
+            if stamp[i] != epoch:
+                stamp[i] = epoch
+                tree[i] = 0
+            tree[i] += delta
+            i += i & -i
+        self.exhausted_count += delta
+
+    def _is_exhausted(self, i):
+        return self.capacity_stamp[i] == self.epoch and self.capacities[i] == 0
+
+    def _available_before(self, i):
+        """Number of available servers with an index below i."""
+        active, exhausted, stamp, epoch = self.active_tree, self.exhausted_tree, self.exhausted_stamp, self.epoch
+        count = 0
+        while i > 0:
+            count += active[i] - (exhausted[i] if stamp[i] == epoch else 0)
+            i -= i & -i
+        return count
+
+    def _kth_available(self, k):
+        """Index of the k-th (1-based) available server."""
+        active, exhausted, stamp, epoch = self.active_tree, self.exhausted_tree, self.exhausted_stamp, self.epoch
+        pos = 0
+        step = self.top_bit
+        while step:
+            node = pos + step
+            if node <= self.n:
+                available = active[node] - (exhausted[node] if stamp[node] == epoch else 0)
+                if available < k:
+                    pos = node
+                    k -= available
+            step >>= 1
+        return pos
+
+    def _reset_if_exhausted(self):
+        if self.active_count and self.exhausted_count == self.active_count:
+            self.epoch += 1
+            self.exhausted_count = 0
+
+    def process_request(self):
+        """Serves one request and returns the server index, or None if every server has failed."""
+        available = self.active_count - self.exhausted_count
+        if available == 0:
+            self.dropped += 1
+            return None
+
+        before = self._available_before(self.current_server)
+        server = self._kth_available(before + 1 if before < available else 1)
+
+        if self.capacity_stamp[server] != self.epoch:
+            self.capacity_stamp[server] = self.epoch
+            self.capacities[server] = self.powers[server]
+        self.capacities[server] -= 1
+        if self.capacities[server] == 0:
+            self._add_exhausted(server, 1)
+
+        served = self.requests_served[server] + 1
+        self.requests_served[server] = served
+        if (served, server) > self.most_served:
+            self.most_served = (served, server)
+
+        self.current_server = (server + 1) % self.n
+        self._reset_if_exhausted()
+        return server
+
+    def fail_server(self, index):
+        if not self.active[index]:
+            return
+        self.active[index] = False
+        self.active_count -= 1
+        self._add(self.active_tree, index, -1)
+        if self._is_exhausted(index):
+            self._add_exhausted(index, -1)
+        self._reset_if_exhausted()
+
+    def recover_server(self, index):
+        """Brings a failed server back with its full power for the current round."""
+        if self.active[index] or self.powers[index] == 0:
+            return
+        self.active[index] = True
+        self.active_count += 1
+        self._add(self.active_tree, index, 1)
+        self.capacity_stamp[index] = self.epoch
+        self.capacities[index] = self.powers[index]
+
+    def get_most_served_server(self):
+        """Server with the most requests served, the highest index on ties."""
+        return self.most_served[1]
+
+    def replay(self, events):
+        """Applies REQUEST, FAIL i and RECOVER i events, e.g. the lines of a trace file."""
+        for event in events:
+            if event.startswith("REQUEST"):
+                self.process_request()
+            elif event.startswith("FAIL"):
+                self.fail_server(int(event.split()[1]))
+            elif event.startswith("RECOVER"):
+                self.recover_server(int(event.split()[1]))
+        return self
+
+
+def solution(serversPowers, events):
+    return LoadBalancer(serversPowers).replay(events).get_most_served_server()
+
+
+def reference_solution(serversPowers, events):
+    """The linear scan from LoadBalancer2.py, used to check the indexed version."""
+    num_servers = len(serversPowers)
+    requests_count = [0] * num_servers
+    capacity_left = serversPowers[:]
+    failed_servers = set()
+    current_server = 0
+
+    for event in events:
+        if event.startswith("REQUEST"):
+            while current_server in failed_servers or capacity_left[current_server] == 0:
+                current_server = (current_server + 1) % num_servers
+            requests_count[current_server] += 1
+            capacity_left[current_server] -= 1
+            current_server = (current_server + 1) % num_servers
+        elif event.startswith("FAIL"):
+            failed_servers.add(int(event.split()[1]))
+
+        if all(capacity_left[i] == 0 or i in failed_servers for i in range(num_servers)):
+            for i in range(num_servers):
+                if i not in failed_servers:
+                    capacity_left[i] = serversPowers[i]
+
+    max_requests = max(requests_count)
+    return max(i for i, count in enumerate(requests_count) if count == max_requests)
+
+
+def random_trace(num_servers, num_events, fail_rate=0.001, recover=True, seed=0):
+    """REQUEST-heavy trace that never fails the last active server."""
+    rand = random.Random(seed)
+    failed = set()
+    events = []
+    for _ in range(num_events):
+        roll = rand.random()
+        if roll < fail_rate and len(failed) < num_servers - 1:
+            server = rand.randrange(num_servers)
+            failed.add(server)
+            events.append("FAIL {}".format(server))
+        elif recover and roll < 2 * fail_rate and failed:
+            server = failed.pop()
+            events.append("RECOVER {}".format(server))
+        else:
+            events.append("REQUEST")
+    return events
+
+
+def benchmark(num_servers=100000, num_events=10000000):
+    rand = random.Random(1)
+    powers = [rand.randint(1, 10) for _ in range(num_servers)]
+    events = random_trace(num_servers, num_events)
+    start = time.perf_counter()
+    result = solution(powers, events)
+    elapsed = time.perf_counter() - start
+    print("{:,} events on {:,} servers: {:.1f}s ({:,.0f} events/s), most served {}".format(
+        num_events, num_servers, elapsed, num_events / elapsed, result))
+
+
+def main():
+    test_cases = [
+        ([1, 2, 1, 2, 1], ["REQUEST", "REQUEST", "FAIL 2", "REQUEST", "FAIL 3", "REQUEST", "REQUEST"], 1),
+        ([5, 5, 5], ["REQUEST", "REQUEST", "REQUEST", "REQUEST", "REQUEST", "REQUEST"], 2),
+        ([1, 1, 1, 1], ["REQUEST", "FAIL 0", "FAIL 1", "REQUEST", "FAIL 2", "REQUEST"], 3),
+        ([3, 3, 3], ["REQUEST", "REQUEST", "FAIL 0", "REQUEST", "REQUEST", "FAIL 1", "REQUEST"], 2),
+        ([2, 3], ["REQUEST", "REQUEST"], 1),
+        ([1, 1], ["FAIL 0", "REQUEST", "RECOVER 0", "REQUEST", "REQUEST"], 1),
+    ]
+    for i, (serversPowers, events, expected) in enumerate(test_cases, 1):
+        result = solution(serversPowers, events)
+        print("Test case {}: {}".format(i, "Pass" if result == expected else "Fail (got {}, expected {})".format(
+            result, expected)))
+
+    # Cross-check against the linear scan on random traces without recoveries
+    rand = random.Random(5)
+    mismatches = 0
+    for seed in range(300):
+        powers = [rand.randint(1, 4) for _ in range(rand.randint(1, 12))]
+        events = random_trace(len(powers), 60, fail_rate=0.08, recover=False, seed=seed)
+        mismatches += solution(powers, events) != reference_solution(powers, events)
+    print("Random traces: {}".format("Pass" if mismatches == 0 else "Fail ({} mismatches)".format(mismatches)))
+
+    if len(sys.argv) > 2:
+        benchmark(int(sys.argv[1]), int(sys.argv[2]))
+    else:
+        benchmark(100000, 1000000)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,85 +1,137 @@
 import time
-from threading import Thread, Lock, Event
+from threading import Thread, Lock
 
 
 class RateLimiter:
-    def __init__(self, rate_per_second):
+    def __init__(self, rate_per_second, capacity=None, shards=64, clock=time.monotonic, sweep_every=1024):
         """
-        rate_per_second: number of tokens (requests) allowed per second.
+        rate_per_second: number of tokens (requests) allowed per second, per key.
+        capacity: most tokens a bucket can hold (defaults to one second's worth).
+        shards: number of lock stripes the per-key buckets are spread over.
+
+        There is no refill thread: a bucket is topped up lazily from the
+        monotonic time elapsed since it was last checked. Buckets live in
+        `shards` dicts, each with its own lock, so threads checking
+        different keys rarely wait on the same lock.
+
+        A bucket that has been idle long enough to refill completely is the
+        same as a missing one, so each shard drops those buckets once it has
+        seen as many checks as it holds buckets (at least `sweep_every`).
+        Memory then follows the keys active in the last refill period, not
+        every key ever seen.
         """
         self.rate = rate_per_second
+        self.capacity = float(rate_per_second if capacity is None else capacity)
+        self.clock = clock
+        self.sweep_every = sweep_every
 
-        # Start with a 'full' bucket (float to allow fractional increments)
-        self.tokens = float(rate_per_second)
-
-        # Track the last time we refilled tokens
-        self.last_refill = time.time()
-
-        # A lock to protect concurrent access to 'self.tokens'
-        # (Fixes the race condition problem)
-        self.lock = Lock()
-
-        # An event to signal the background thread to stop gracefully
-        self.stop_event = Event()
-
-        # We'll store the refill thread here once we start it
-        self.refill_thread = None
+        # Each shard is (buckets, lock); a bucket is [tokens, last refill time]
+        self.shards = [({}, Lock()) for _ in range(shards)]
+        # Checks per shard since its last sweep, updated under the shard's lock
+        self.checks = [0] * shards
 
     def start(self):
         """
-        Start the background thread that continuously refills tokens.
+        Kept for existing callers; refills happen lazily, so there is nothing to start.
         """
-        self.refill_thread = Thread(target=self._add_tokens, daemon=True)
-        self.refill_thread.start()
 
     def stop(self):
         """
-        Signal the background thread to stop and wait for it to finish.
+        Kept for existing callers; there is no background thread to stop.
         """
-        self.stop_event.set()
-        if self.refill_thread is not None:
-            self.refill_thread.join()
 
-    def _add_tokens(self):
+    def _take(self, buckets, key, now):
         """
-        Continuously add tokens according to how much time has passed,
-        until 'stop_event' is set.
-
-        This implements the 'token bucket' approach by calculating how
-        many tokens to add based on elapsed time, rather than resetting
-        them all at once every second.
+        Refills one bucket for the time elapsed and takes a token if there is one.
+        Must be called with the shard's lock held.
         """
-        while not self.stop_event.is_set():
-            # Sleep briefly to avoid busy looping. This also helps
-            # distribute token refills more smoothly (rather than
-            # waiting a full second).
-            time.sleep(0.01)
-
-            now = time.time()
-            with self.lock:
-                # Calculate how much time has passed since we last refilled
-                elapsed = now - self.last_refill
-                self.last_refill = now
-
-                # Tokens to add is rate * elapsed_time
-                tokens_to_add = elapsed * self.rate
-
-                # Increase tokens but do not exceed the max (self.rate)
-                self.tokens = min(self.rate, self.tokens + tokens_to_add)
-
-    def check(self):
+        bucket = buckets.get(key)
+        if bucket is None:
+            # Start with a 'full' bucket
+            bucket = buckets[key] = [self.capacity, now]
+
+        # Tokens to add is rate * elapsed_time, but do not exceed the capacity
+        # A clock that steps back adds nothing and never moves the bucket's time backwards
+        if now > bucket[1]:
+            tokens = min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        else:
+            tokens = bucket[0]
+
+        # Only allow if we have at least 1 token
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            return True
+        bucket[0] = tokens
+        return False
+
+    def _sweep(self, shard, buckets, now):
+        """
+        Counts a check against the shard and, every so often, drops its buckets that are full again.
+        Must be called with the shard's lock held.
         """
-        Check if a request is allowed:
+        self.checks[shard] += 1
+        if self.checks[shard] < max(self.sweep_every, len(buckets)):
+            return
+        self.checks[shard] = 0
+        capacity, rate = self.capacity, self.rate
+        idle = [key for key, (tokens, last) in buckets.items() if tokens + (now - last) * rate >= capacity]
+        for key in idle:
+            del buckets[key]
+
+    def check(self, key=None):
+        """
+        Check if a request for `key` is allowed:
         - Returns True (and decrements a token) if allowed.
         - Returns False if no tokens are available.
         """
-        with self.lock:
-            # Only allow if we have at least 1 token
-            if self.tokens >= 1:
-                self.tokens -= 1
-                return True
-            else:
-                return False
+        shard = hash(key) % len(self.shards)
+        buckets, lock = self.shards[shard]
+        with lock:
+            # Read under the lock, so the times applied to a bucket never go backwards
+            now = self.clock()
+            self._sweep(shard, buckets, now)
+            return self._take(buckets, key, now)
+
+    def check_many(self, keys):
+        """
+        Checks a batch of keys, taking each shard's lock once for all of its keys.
+        Returns the results in the order of `keys`.
+        """
+        by_shard = {}
+        for i, key in enumerate(keys):
+            by_shard.setdefault(hash(key) % len(self.shards), []).append(i)
+
+        results = [False] * len(keys)
+        for shard, positions in by_shard.items():
+            buckets, lock = self.shards[shard]
+            with lock:
+                now = self.clock()
+                for i in positions:
+                    self._sweep(shard, buckets, now)
+                    results[i] = self._take(buckets, keys[i], now)
+        return results
+
+
+def benchmark(threads=8, checks_per_thread=200000, keys=10000):
+    """
+    Compares a single lock (shards=1) with striped shards while many
+    threads check different keys at the same time.
+    """
+    def worker(rate_limiter, offset):
+        for i in range(checks_per_thread):
+            rate_limiter.check((offset + i) % keys)
+
+    for shards in (1, 64):
+        rate_limiter = RateLimiter(rate_per_second=1000, shards=shards)
+        workers = [Thread(target=worker, args=(rate_limiter, t * 7919)) for t in range(threads)]
+        start = time.perf_counter()
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        elapsed = time.perf_counter() - start
+        print(f"shards={shards:<3} {threads * checks_per_thread / elapsed:,.0f} checks/s")
 
 
 def send_request(rate_limiter, idx):
@@ -115,5 +167,8 @@ if __name__ == "__main__":
     for t in threads:
         t.join()
 
-    # Gracefully stop the rate limiter's refill thread
+    # Gracefully stop the rate limiter (a no-op without a refill thread)
     rate_limiter.stop()
+
+    # Contention benchmark: one global lock against lock-striped shards
+    benchmark()
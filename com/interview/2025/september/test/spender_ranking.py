@@ -0,0 +1,148 @@
+import random
+import time
+from bisect import bisect_left, insort
+from itertools import chain, islice
+from typing import Dict, List, Tuple
+
+
+class SpenderRanking:
+    """
+    Accounts ordered by outgoing amount (descending), then account id
+    (ascending), maintained incrementally as amounts change.
+
+    The keys (-outgoing, account_id) live in sorted buckets of at most
+    2 * `load` keys, with the last key of every bucket in `maxes`. Finding a
+    key is a binary search over `maxes` and then inside one bucket, so
+    add/update cost O(log N) comparisons plus a memmove of one bucket, and
+    top(n) walks the buckets from the front in O(n + log N).
+    """
+
+    def __init__(self, load: int = 512):
+        self.load = load
+        self.buckets: List[List[Tuple[int, str]]] = []
+        self.maxes: List[Tuple[int, str]] = []
+        self.outgoing: Dict[str, int] = {}
+
+    def __len__(self):
+        return len(self.outgoing)
+
+    def _insert(self, key):
+        if not self.buckets:
+            self.buckets.append([key])
+            self.maxes.append(key)
+            return
+        i = bisect_left(self.maxes, key)
+        if i == len(self.maxes):
+            i -= 1
+        bucket = self.buckets[i]
+        insort(bucket, key)
+        self.maxes[i] = bucket[-1]
+        if len(bucket) > 2 * self.load:
+            # Split an oversized bucket in two so the memmove stays bounded
+            self.buckets.insert(i + 1, bucket[self.load:])
+            del bucket[self.load:]
+            self.maxes.insert(i, bucket[-1])
+
+    def _remove(self, key):
+        i = bisect_left(self.maxes, key)
+        bucket = self.buckets[i]
+        del bucket[bisect_left(bucket, key)]
+        if bucket:
+            self.maxes[i] = bucket[-1]
+        else:
+            del self.buckets[i]
+            del self.maxes[i]
+
+    def add(self, account_id: str, outgoing: int = 0):
+        self.outgoing[account_id] = outgoing
+        self._insert((-outgoing, account_id))
+
+    def update(self, account_id: str, outgoing: int):
+        """Moves an account to its new outgoing total."""
+        old = self.outgoing[account_id]
+        if old == outgoing:
+            return
+        self._remove((-old, account_id))
+        self.outgoing[account_id] = outgoing
+        self._insert((-outgoing, account_id))
+
+    def top(self, n: int) -> List[Tuple[str, int]]:
+        """The first n (account_id, outgoing) pairs in ranking order."""
+        return [(account_id, -negated) for negated, account_id in islice(chain.from_iterable(self.buckets), max(n, 0))]
+
+
+def top_by_sorting(outgoing: Dict[str, int], n: int) -> List[Tuple[str, int]]:
+    """The sort-based ranking the banking implementations used before, kept as the reference."""
+    return sorted(outgoing.items(), key=lambda item: (-item[1], item[0]))[:n]
+
+
+def run_tests():
+    results = []
+
+    ranking = SpenderRanking()
+    for account_id in ("accB", "accA", "accC"):
+        ranking.add(account_id)
+    results.append(("new accounts rank by id", ranking.top(3) == [("accA", 0), ("accB", 0), ("accC", 0)]))
+
+    ranking.update("accC", 50)
+    ranking.update("accB", 200)
+    results.append(("ranked by outgoing", ranking.top(10) == [("accB", 200), ("accC", 50), ("accA", 0)]))
+    results.append(("n limits the result", ranking.top(1) == [("accB", 200)] and ranking.top(0) == []))
+
+    # Random updates against the sort-based reference, with a small load so buckets split and empty
+    rand = random.Random(7)
+    ranking = SpenderRanking(load=4)
+    reference = {}
+    for i in range(300):
+        ranking.add("u{}".format(i))
+        reference["u{}".format(i)] = 0
+    matches = True
+    for _ in range(5000):
+        account_id = "u{}".format(rand.randrange(300))
+        reference[account_id] += rand.choice((0, 1, 5, 100))
+        ranking.update(account_id, reference[account_id])
+        n = rand.randrange(12)
+        matches = matches and ranking.top(n) == top_by_sorting(reference, n)
+    results.append(("matches sorting after random updates", matches and ranking.top(300) == top_by_sorting(reference, 300)))
+
+    for name, passed in results:
+        print("{}: {}".format(name, "Pass" if passed else "Fail"))
+
+
+def benchmark(num_accounts=1000000, num_operations=200000, queries_every=100, n=10):
+    """Transfers between random accounts with a top-n query every `queries_every` operations."""
+    rand = random.Random(1)
+    account_ids = ["u{}".format(i) for i in range(num_accounts)]
+    updates = [(rand.randrange(num_accounts), rand.randrange(1, 1000)) for _ in range(num_operations)]
+    num_queries = num_operations // queries_every
+
+    ranking = SpenderRanking()
+    start = time.perf_counter()
+    for account_id in account_ids:
+        ranking.add(account_id)
+    print("{:,} accounts added in {:.2f}s".format(num_accounts, time.perf_counter() - start))
+
+    start = time.perf_counter()
+    for i, (index, amount) in enumerate(updates):
+        account_id = account_ids[index]
+        ranking.update(account_id, ranking.outgoing[account_id] + amount)
+        if i % queries_every == 0:
+            ranking.top(n)
+    ranked = time.perf_counter() - start
+    print("ranking: {:,} updates + {:,} top({}) in {:.2f}s".format(num_operations, num_queries, n, ranked))
+
+    # Sorting every query is far slower, so time a sample of queries and extrapolate
+    outgoing = dict(ranking.outgoing)
+    sample = 5
+    start = time.perf_counter()
+    for _ in range(sample):
+        top_by_sorting(outgoing, n)
+    per_query = (time.perf_counter() - start) / sample
+    print("sorting: {:.3f}s per top({}), ~{:.0f}s for {:,} queries ({:.0f}x slower)".format(
+        per_query, n, per_query * num_queries, num_queries, per_query * num_queries / ranked))
+    print("same answer: {}".format(ranking.top(n) == top_by_sorting(outgoing, n)))
+
+
+if __name__ == "__main__":
+    run_tests()
+    benchmark()
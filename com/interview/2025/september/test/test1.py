@@ -1,4 +1,5 @@
 from banking_system import BankingSystem
+from spender_ranking import SpenderRanking
 
 # 🟢 GREEN BUTTON: expiry window (24h in ms). Change only if spec changes.
 MS_IN_DAY = 24 * 60 * 60 * 1000  # 86,400,000 ms
@@ -8,6 +9,8 @@ class BankingSystemImpl(BankingSystem):
     def __init__(self):
         self._balances: dict[str, int] = {}
         self._activity: dict[str, int] = {}
+        # Accounts in (activity desc, id asc) order, kept up to date as activity grows
+        self._ranking = SpenderRanking()
 
         # 🟢 GREEN BUTTON: transfer storage (id -> record)
         self._transfers: dict[str, dict] = {}
@@ -32,6 +35,7 @@ class BankingSystemImpl(BankingSystem):
             return False
         self._balances[account_id] = 0
         self._activity[account_id] = 0
+        self._ranking.add(account_id)
         return True
 
     def deposit(self, timestamp: int, account_id: str, amount: int) -> int | None:
@@ -41,6 +45,7 @@ class BankingSystemImpl(BankingSystem):
         new_bal = self._balances[account_id] + amount
         self._balances[account_id] = new_bal
         self._activity[account_id] += amount
+        self._ranking.update(account_id, self._activity[account_id])
         return new_bal
 
     def pay(self, timestamp: int, account_id: str, amount: int) -> int | None:
@@ -53,17 +58,15 @@ class BankingSystemImpl(BankingSystem):
         new_bal = bal - amount
         self._balances[account_id] = new_bal
         self._activity[account_id] += amount
+        self._ranking.update(account_id, self._activity[account_id])
         return new_bal
 
     # ---------- level 2 ----------
     def top_activity(self, timestamp: int, n: int) -> list[str]:
         self._expire_transfers_until(timestamp)
-        items = [(acc, self._activity.get(acc, 0)) for acc in self._balances.keys()]
-        # 🟢 GREEN BUTTON: sort rule (value desc, id asc)
-        items.sort(key=lambda x: (-x[1], x[0]))
-        k = min(n, len(items))
+        # 🟢 GREEN BUTTON: sort rule (value desc, id asc), maintained by the ranking
         # 🟢 GREEN BUTTON: exact output format (no space before '(')
-        return [f"{acc}({val})" for acc, val in items[:k]]
+        return [f"{acc}({val})" for acc, val in self._ranking.top(n)]
 
     # ---------- level 3 ----------
     def transfer(
@@ -119,5 +122,7 @@ class BankingSystemImpl(BankingSystem):
         # 🟢 GREEN BUTTON: transfers count toward activity only when accepted
         self._activity[t["src"]] += t["amount"]
         self._activity[t["tgt"]] += t["amount"]
+        self._ranking.update(t["src"], self._activity[t["src"]])
+        self._ranking.update(t["tgt"], self._activity[t["tgt"]])
         t["status"] = "accepted"
         return True
\ No newline at end of file
@@ -1,4 +1,5 @@
 from banking_system import BankingSystem
+from spender_ranking import SpenderRanking
 
 
 class BankingSystemImpl(BankingSystem):
@@ -7,12 +8,15 @@ class BankingSystemImpl(BankingSystem):
         self._balances: dict[str, int] = {}
         # account_id -> cumulative transaction value (deposits + successful withdrawals)
         self._activity: dict[str, int] = {}
+        # Accounts in (activity desc, id asc) order, kept up to date as activity grows
+        self._ranking = SpenderRanking()
 
     def create_account(self, timestamp: int, account_id: str) -> bool:
         if account_id in self._balances:
             return False
         self._balances[account_id] = 0
         self._activity[account_id] = 0
+        self._ranking.add(account_id)
         return True
 
     def deposit(self, timestamp: int, account_id: str, amount: int) -> int | None:
@@ -21,6 +25,7 @@ class BankingSystemImpl(BankingSystem):
         new_bal = self._balances[account_id] + amount
         self._balances[account_id] = new_bal
         self._activity[account_id] += amount
+        self._ranking.update(account_id, self._activity[account_id])
         return new_bal
 
     def pay(self, timestamp: int, account_id: str, amount: int) -> int | None:
@@ -32,11 +37,9 @@ class BankingSystemImpl(BankingSystem):
         new_bal = bal - amount
         self._balances[account_id] = new_bal
         self._activity[account_id] += amount
+        self._ranking.update(account_id, self._activity[account_id])
         return new_bal
 
     def top_activity(self, timestamp: int, n: int) -> list[str]:
-        # Sort by total transaction value desc, then account_id asc
-        items = [(acc, self._activity.get(acc, 0)) for acc in self._balances]
-        items.sort(key=lambda x: (-x[1], x[0]))
-        take = min(n, len(items))
-        return [f"{acc}({val})" for acc, val in items[:take]]
\ No newline at end of file
+        # Total transaction value desc, then account_id asc, maintained incrementally by the ranking
+        return [f"{acc}({val})" for acc, val in self._ranking.top(n)]
\ No newline at end of file
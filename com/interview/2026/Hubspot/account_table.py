@@ -0,0 +1,196 @@
+import tracemalloc
+from array import array
+from typing import Dict, List, Optional
+
+
+class AccountTable:
+    """
+    Accounts stored column-wise. Each account id is interned to a dense
+    index, and balances and outgoing totals live in int64 arrays, so an
+    account costs its id string, one dict entry and 16 bytes, instead of an
+    object with a __dict__.
+    """
+
+    def __init__(self):
+        self.index: Dict[str, int] = {}
+        self.ids: List[str] = []
+        self.balances = array("q")
+        self.outgoing = array("q")
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, account_id: str) -> bool:
+        return account_id in self.index
+
+    def get(self, account_id: str) -> Optional[int]:
+        """Index of the account, or None if it does not exist."""
+        return self.index.get(account_id)
+
+    def add(self, account_id: str) -> Optional[int]:
+        """Creates the account and returns its index, or None if it already exists."""
+        if account_id in self.index:
+            return None
+        index = self.index[account_id] = len(self.ids)
+        self.ids.append(account_id)
+        self.balances.append(0)
+        self.outgoing.append(0)
+        return index
+
+
+def payment_number(payment_id: str) -> Optional[int]:
+    """The number in a "payment<number>" id, or None unless it is written exactly as payment_id() writes it."""
+    # ASCII digits without a leading zero
+    digits = payment_id[7:]
+    if not payment_id.startswith("payment") or not digits.isascii() or not digits.isdigit() or digits[0] == "0":
+        return None
+    return int(digits)
+
+
+class Payment:
+    """A payment whose cashback is still due; `account` is its AccountTable index."""
+    __slots__ = ("number", "account", "cashback")
+
+    def __init__(self, number: int, account: int, cashback: int):
+        self.number = number
+        self.account = account
+        self.cashback = cashback
+
+
+class PaymentBook:
+    """
+    Payments numbered from 1, with ids "payment<number>".
+
+    Every payment keeps only its owner's account index, in an int32 array.
+    A Payment object exists only while the cashback is in progress, and
+    settle() drops it, so settled payments cost 4 bytes each.
+    """
+
+    IN_PROGRESS = "IN_PROGRESS"
+    CASHBACK_RECEIVED = "CASHBACK_RECEIVED"
+
+    def __init__(self):
+        self.owners = array("i")
+        self.in_progress: Dict[int, Payment] = {}
+
+    def __len__(self):
+        return len(self.owners)
+
+    def add(self, account: int, cashback: int) -> Payment:
+        self.owners.append(account)
+        payment = Payment(len(self.owners), account, cashback)
+        self.in_progress[payment.number] = payment
+        return payment
+
+    def settle(self, payment: Payment):
+        del self.in_progress[payment.number]
+
+    @staticmethod
+    def payment_id(payment: Payment) -> str:
+        return f"payment{payment.number}"
+
+    def status(self, payment_id: str, account: int) -> Optional[str]:
+        """Status of the payment if it exists and belongs to `account`, else None."""
+        number = payment_number(payment_id)
+        if number is None or number > len(self.owners) or self.owners[number - 1] != account:
+            return None
+        return self.IN_PROGRESS if number in self.in_progress else self.CASHBACK_RECEIVED
+
+
+def measure(build) -> int:
+    """Bytes still allocated by what build() returns."""
+    tracemalloc.start()
+    kept = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return size
+
+
+def run_tests():
+    results = []
+
+    table = AccountTable()
+    results.append(("add returns dense indexes", [table.add(x) for x in ("a", "b", "a")] == [0, 1, None]))
+    table.balances[table.get("b")] += 70
+    results.append(("columns by index", "b" in table and "c" not in table and list(table.balances) == [0, 70]))
+
+    book = PaymentBook()
+    first = book.add(table.get("a"), 5)
+    second = book.add(table.get("b"), 2)
+    results.append(("payment ids", book.payment_id(first) == "payment1" and book.payment_id(second) == "payment2"))
+    book.settle(first)
+    results.append(("settled payment", book.status("payment1", 0) == "CASHBACK_RECEIVED" and book.status("payment2", 1) == "IN_PROGRESS"))
+    results.append(("wrong owner or unknown id", book.status("payment1", 1) is None and book.status("payment3", 0) is None and
+                    book.status("payment0", 0) is None and book.status("paymentx", 0) is None))
+    results.append(("only canonical ids", book.status("payment02", 1) is None and book.status("payment\u0662", 1) is None and
+                    book.status("payment+2", 1) is None and book.status("payment", 1) is None))
+
+    for name, passed in results:
+        print("{}: {}".format(name, "Pass" if passed else "Fail"))
+
+
+def benchmark(num_accounts=1000000, num_payments=1000000, in_progress_share=0.05):
+    """Accounts as objects in a dict vs AccountTable, and payments as objects kept forever vs PaymentBook."""
+
+    class ObjectAccount:  # The Account class of the banking modules
+        def __init__(self, account_id: str):
+            self.account_id = account_id
+            self.balance = 0
+            self.outgoing = 0
+
+    class ObjectPayment:  # The Payment class of the banking modules
+        def __init__(self, payment_id: str, account_id: str, cashback_amount: int, due_time: int):
+            self.payment_id = payment_id
+            self.account_id = account_id
+            self.cashback_amount = cashback_amount
+            self.due_time = due_time
+            self.status = "IN_PROGRESS"
+
+    account_ids = ["account{}".format(i) for i in range(num_accounts)]
+    id_bytes = measure(lambda: ["account{}".format(i) for i in range(num_accounts)])
+
+    def objects():
+        accounts = {}
+        for i, account_id in enumerate(account_ids):
+            accounts[account_id] = ObjectAccount(account_id)
+            accounts[account_id].balance = 1000 + i  # Distinct int objects, as real balances would be
+        return accounts
+
+    def table():
+        accounts = AccountTable()
+        for i, account_id in enumerate(account_ids):
+            accounts.balances[accounts.add(account_id)] = 1000 + i
+        return accounts
+
+    print("{:,} accounts (ids themselves {:,.0f} MB, not counted):".format(num_accounts, id_bytes / 1e6))
+    for name, build in (("dict of Account objects", objects), ("AccountTable", table)):
+        print("  {:<28} {:8,.1f} MB".format(name, measure(build) / 1e6))
+
+    settled = int(num_payments * (1 - in_progress_share))
+
+    def payment_objects():
+        payments = {}
+        for number in range(1, num_payments + 1):
+            payment_id = "payment{}".format(number)
+            payments[payment_id] = ObjectPayment(payment_id, account_ids[number % num_accounts], 1000 + number, 86400000 + number)
+            if number <= settled:
+                payments[payment_id].status = "CASHBACK_RECEIVED"
+        return payments
+
+    def payment_book():
+        book = PaymentBook()
+        for number in range(1, num_payments + 1):
+            payment = book.add(number % num_accounts, 1000 + number)
+            if number <= settled:
+                book.settle(payment)
+        return book
+
+    print("{:,} payments, {:.0%} still in progress:".format(num_payments, in_progress_share))
+    for name, build in (("Payment objects kept forever", payment_objects), ("PaymentBook", payment_book)):
+        print("  {:<28} {:8,.1f} MB".format(name, measure(build) / 1e6))
+
+
+if __name__ == "__main__":
+    run_tests()
+    benchmark()
@@ -0,0 +1,405 @@
+import heapq
+import importlib.util
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import zlib
+from array import array
+from itertools import islice
+from typing import Dict, List, Optional
+
+from account_table import PaymentBook, payment_number
+from replay import OP_CODES, ReplayEngine, format_result, generate_commands, read_batches
+
+# The level-3 system, with payments and cashbacks, is test3/test1.py. It is loaded by path because
+# test1 in this directory is the level-1 system.
+_spec = importlib.util.spec_from_file_location(
+    "level3_banking", os.path.join(os.path.dirname(os.path.abspath(__file__)), "test3", "test1.py"))
+level3 = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(level3)
+BankingSystemImpl = level3.BankingSystemImpl
+
+CREATE_ACCOUNT = OP_CODES["CREATE_ACCOUNT"]
+DEPOSIT = OP_CODES["DEPOSIT"]
+TRANSFER = OP_CODES["TRANSFER"]
+TOP_SPENDERS = OP_CODES["TOP_SPENDERS"]
+PAY = OP_CODES["PAY"]
+GET_PAYMENT_STATUS = OP_CODES["GET_PAYMENT_STATUS"]
+CASHBACK_DELAY = 86400000  # Cashback of a payment arrives 24 hours later
+
+# Shard-level steps besides the BankingSystem methods: the two halves of a cross-shard
+# transfer, and a shard's share of a TOP_SPENDERS query
+DEBIT, CREDIT, TOP = -1, -2, -3
+
+
+class Shard:
+    """
+    The accounts of one partition, held in an ordinary level-3 BankingSystemImpl.
+
+    A batch arrives as (index, timestamp, step, args) in timestamp order. A
+    CREDIT whose DEBIT is still undecided is set aside as pending. The shard
+    keeps going until a step needs the balance of an account with a pending
+    credit, and then waits for the coordinator to resume it with the
+    decisions of the other shards. Credits only add to a balance, so a
+    credit applied late gives the same result as long as nothing read the
+    balance in between. Every command therefore sees exactly what the
+    single-threaded ledger would show it.
+    """
+
+    def __init__(self):
+        self.system = BankingSystemImpl()
+        self.handlers = {CREATE_ACCOUNT: self.system.create_account, DEPOSIT: self.system.deposit,
+                         TRANSFER: self.system.transfer, PAY: self.system.pay}
+        self.steps = []
+        self.position = 0
+        self.decisions: Dict[int, bool] = {}  # Decisions for credits not reached yet
+        self.pending: Dict[int, tuple] = {}  # Undecided credits: command index -> (account_id, amount)
+        self.pending_accounts: Dict[str, int] = {}  # Number of undecided credits per account
+
+    def handle(self, message):
+        """Returns (results, DEBIT decisions, finished, busy seconds)."""
+        started = time.process_time()
+        kind, payload = message
+        if kind == "batch":
+            self.steps = payload
+            self.position = 0
+        else:
+            self.decide(payload)
+
+        accounts = self.system.accounts
+        balances, outgoing = accounts.balances, accounts.outgoing
+        pending, pending_accounts = self.pending, self.pending_accounts
+        results = []
+        debits = []
+        while self.position < len(self.steps):
+            index, timestamp, step, args = self.steps[self.position]
+            # Steps that read the balance of their first account wait for its pending credits
+            if pending_accounts and step != CREDIT and step != TOP and step != CREATE_ACCOUNT and \
+                    args[0] in pending_accounts:
+                break
+            if step == CREDIT:
+                approved = self.decisions.pop(index, None)
+                if approved is None:
+                    pending[index] = args
+                    pending_accounts[args[0]] = pending_accounts.get(args[0], 0) + 1
+                elif approved:
+                    balances[accounts.get(args[0])] += args[1]
+            elif step == DEBIT:
+                # Both accounts are known to exist; only the balance can refuse it
+                self.system.advance_to(timestamp)  # Cashbacks due by now count towards the balance
+                account_id, amount = args
+                account = accounts.get(account_id)
+                if balances[account] < amount:
+                    results.append((index, None))
+                    debits.append((index, False))
+                else:
+                    balances[account] -= amount
+                    outgoing[account] += amount
+                    self.system.ranking.update(account_id, outgoing[account])
+                    results.append((index, balances[account]))
+                    debits.append((index, True))
+            elif step == TOP:
+                results.append((index, self.system.ranking.top(args[0])))
+            else:
+                results.append((index, self.handlers[step](timestamp, *args)))
+            self.position += 1
+        finished = self.position == len(self.steps) and not pending
+        return results, debits, finished, time.process_time() - started
+
+    def decide(self, decisions):
+        for index, approved in decisions.items():
+            credit = self.pending.pop(index, None)
+            if credit is None:
+                self.decisions[index] = approved
+                continue
+            account_id, amount = credit
+            if approved:
+                accounts = self.system.accounts
+                accounts.balances[accounts.get(account_id)] += amount
+            if self.pending_accounts[account_id] == 1:
+                del self.pending_accounts[account_id]
+            else:
+                self.pending_accounts[account_id] -= 1
+
+
+class LocalShard:
+    """Runs a Shard in the calling process; same submit/result protocol as ShardProcess."""
+
+    def __init__(self):
+        self.shard = Shard()
+        self.reply = None
+
+    def submit(self, message):
+        self.reply = self.shard.handle(message)
+
+    def result(self):
+        return self.reply
+
+    def close(self):
+        pass
+
+
+def serve(connection):
+    shard = Shard()
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        connection.send(shard.handle(message))
+
+
+class ShardProcess:
+    """A Shard in its own process, driven over a pipe so all shards work at the same time."""
+
+    def __init__(self, context):
+        self.connection, child = context.Pipe()
+        self.process = context.Process(target=serve, args=(child,), daemon=True)
+        self.process.start()
+
+    def submit(self, message):
+        self.connection.send(message)
+
+    def result(self):
+        return self.connection.recv()
+
+    def close(self):
+        self.connection.send(None)
+        self.process.join()
+
+
+class PartitionedLedger:
+    """
+    The level-3 BankingSystemImpl split over `num_shards` shards by a
+    stable hash of the account id, giving the same results as replaying on
+    one instance.
+
+    The coordinator walks each batch in timestamp order once. It tracks
+    which accounts exist, so a transfer naming a missing account is
+    answered on the spot. CREATE_ACCOUNT, DEPOSIT, PAY and transfers inside
+    one shard go to that shard untouched, and a shard applies the cashbacks
+    of its own payments.
+
+    A transfer across shards is a two-phase step. The source shard runs a
+    DEBIT in its own order and decides. The target shard holds a CREDIT at
+    the same position, and it gets the decision in the next round (see
+    Shard). A shard only waits on credits older than the step it is at.
+    The source of the earliest undecided transfer therefore never waits,
+    so every round decides at least that transfer and a batch always
+    finishes. TOP_SPENDERS asks every shard for its local top n at that
+    position and merges them.
+
+    Payment ids are numbered across all shards in command order, so the
+    coordinator renames each successful PAY once the batch is done. A
+    payment's status only depends on its owner and on whether its cashback
+    is due, so the coordinator answers GET_PAYMENT_STATUS itself, from one
+    owner and one due time per payment.
+
+    With transfer-light workloads a batch takes a handful of rounds, and
+    the shards spend them running their own commands in parallel.
+    """
+
+    def __init__(self, num_shards: int = 4, processes: bool = True):
+        context = multiprocessing.get_context()
+        self.shards = [ShardProcess(context) if processes else LocalShard() for _ in range(num_shards)]
+        self.placement: Dict[str, int] = {}  # Shard of every account created so far
+        self.payment_owners: List[str] = []  # Owner of payment number i + 1
+        self.payment_due = array("q")  # Cashback due time of payment number i + 1
+        self.rounds = 0
+        self.coordinator_seconds = 0.0
+        self.critical_seconds = 0.0  # Sum over rounds of the busiest shard's time
+
+    def shard_of(self, account_id: str) -> int:
+        return zlib.crc32(account_id.encode()) % len(self.shards)
+
+    def run_batch(self, batch) -> List[Optional[object]]:
+        """Returns what BankingSystemImpl would return for each command of the batch."""
+        started = time.process_time()
+        results: List[Optional[object]] = [None] * len(batch)
+        steps = [[] for _ in self.shards]
+        credit_shard = {}  # Command index -> shard holding its CREDIT
+        tops = {}  # Command index -> (n, partial results)
+        payments = []  # PAY, and GET_PAYMENT_STATUS of existing accounts, by command index
+        placement = self.placement
+
+        for index, (timestamp, op, args) in enumerate(zip(batch.timestamps, batch.ops, batch.args)):
+            if op == TRANSFER:
+                source, target, amount = args
+                source_shard, target_shard = placement.get(source), placement.get(target)
+                if source_shard is None or target_shard is None or source == target:
+                    continue  # None, without asking any shard
+                if source_shard == target_shard:
+                    steps[source_shard].append((index, timestamp, op, args))
+                else:
+                    steps[source_shard].append((index, timestamp, DEBIT, (source, amount)))
+                    steps[target_shard].append((index, timestamp, CREDIT, (target, amount)))
+                    credit_shard[index] = target_shard
+            elif op == TOP_SPENDERS:
+                tops[index] = (args[0], [])
+                for shard_steps in steps:
+                    shard_steps.append((index, timestamp, TOP, args))
+            elif op == GET_PAYMENT_STATUS:
+                if args[0] in placement:
+                    payments.append(index)
+            else:
+                if op == PAY:
+                    payments.append(index)
+                shard = placement.get(args[0])
+                if shard is None:
+                    shard = self.shard_of(args[0])
+                    if op == CREATE_ACCOUNT:
+                        placement[args[0]] = shard
+                steps[shard].append((index, timestamp, op, args))
+
+        messages = [("batch", shard_steps) for shard_steps in steps]
+        self.coordinator_seconds += time.process_time() - started
+        while True:
+            self.rounds += 1
+            active = [(shard, message) for shard, message in zip(self.shards, messages) if message is not None]
+            for shard, message in active:
+                shard.submit(message)
+            replies = [shard.result() for shard, _ in active]
+
+            started = time.process_time()
+            self.critical_seconds += max(reply[3] for reply in replies)
+            decisions = [{} for _ in self.shards]
+            for shard_results, debits, _, _ in replies:
+                for index, value in shard_results:
+                    if index in tops:
+                        tops[index][1].append(value)
+                    else:
+                        results[index] = value
+                for index, approved in debits:
+                    decisions[credit_shard[index]][index] = approved
+            self.coordinator_seconds += time.process_time() - started
+            if not any(decisions):
+                if all(reply[2] for reply in replies):
+                    break
+                raise RuntimeError("shards are waiting but no transfer was decided")
+            # Only decisions can unblock a shard, so resume just the shards that receive some
+            messages = [("resume", decided) if decided else None for decided in decisions]
+
+        for index, (n, parts) in tops.items():
+            merged = heapq.merge(*parts, key=lambda item: (-item[1], item[0]))
+            results[index] = ["{}({})".format(account_id, outgoing) for account_id, outgoing in islice(merged, n)]
+        self.number_payments(batch, payments, results)
+        return results
+
+    def number_payments(self, batch, payments: List[int], results: List[Optional[object]]):
+        """Gives successful PAYs their global ids and answers GET_PAYMENT_STATUS, in command order."""
+        owners, due = self.payment_owners, self.payment_due
+        for index in payments:
+            timestamp, args = batch.timestamps[index], batch.args[index]
+            if batch.ops[index] == PAY:
+                if results[index] is not None:
+                    owners.append(args[0])
+                    due.append(timestamp + CASHBACK_DELAY)
+                    results[index] = "payment{}".format(len(owners))
+                continue
+            number = payment_number(args[1])
+            if number is not None and number <= len(owners) and owners[number - 1] == args[0]:
+                results[index] = PaymentBook.CASHBACK_RECEIVED if due[number - 1] <= timestamp else PaymentBook.IN_PROGRESS
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+
+def run_tests():
+    results = []
+
+    # Hand-picked: transfers both ways between shards, the second one depending on the first
+    commands = """
+        1 CREATE_ACCOUNT acc1
+        2 CREATE_ACCOUNT acc2
+        3 DEPOSIT acc1 1000
+        4 TRANSFER acc1 acc2 600
+        5 TRANSFER acc2 acc1 500
+        6 TRANSFER acc2 acc1 500
+        7 TRANSFER acc1 missing 1
+        8 DEPOSIT acc2 0
+        9 TOP_SPENDERS 2
+    """.splitlines()
+    ledger = PartitionedLedger(num_shards=2, processes=False)
+    ledger.shard_of = lambda account_id: int(account_id[-1]) % 2
+    batch = next(read_batches(commands))
+    results.append(("cross-shard transfers in order",
+                    ledger.run_batch(batch) == [True, True, 1000, 400, 100, None, None, 100,
+                                                ["acc1(600)", "acc2(500)"]]))
+
+    # Payments on both shards, numbered in command order, with their cashbacks a day later
+    commands = """
+        1 CREATE_ACCOUNT acc1
+        2 CREATE_ACCOUNT acc2
+        3 DEPOSIT acc1 1000
+        4 PAY acc1 500
+        5 GET_PAYMENT_STATUS acc1 payment1
+        6 GET_PAYMENT_STATUS acc2 payment1
+        7 TRANSFER acc1 acc2 300
+        8 PAY acc2 100
+        9 PAY acc2 1000
+        10 GET_PAYMENT_STATUS acc2 payment3
+        86400004 GET_PAYMENT_STATUS acc1 payment1
+        86400005 DEPOSIT acc1 0
+        86400006 GET_PAYMENT_STATUS acc2 payment2
+        86400008 DEPOSIT acc2 0
+        86400009 TOP_SPENDERS 2
+    """.splitlines()
+    ledger = PartitionedLedger(num_shards=2, processes=False)
+    ledger.shard_of = lambda account_id: int(account_id[-1]) % 2
+    batch = next(read_batches(commands))
+    results.append(("payments numbered across shards",
+                    ledger.run_batch(batch) == [True, True, 1000, "payment1", "IN_PROGRESS", None, 200, "payment2", None,
+                                                None, "CASHBACK_RECEIVED", 210, "IN_PROGRESS", 202,
+                                                ["acc1(800)", "acc2(100)"]]))
+
+    # Random workloads against one BankingSystemImpl: many accounts, and a few accounts paying a lot
+    for num_accounts, payment_share in ((300, 0.15), (20, 0.3)):
+        path = os.path.join(tempfile.mkdtemp(), "commands.txt")
+        generate_commands(path, 30000, num_accounts=num_accounts, seed=4, payment_share=payment_share, max_step=10000)
+        engine = ReplayEngine(BankingSystemImpl(), timed=False)
+        with open(path) as file:
+            expected = [line for batch in read_batches(file, 5000) for line in engine.run_batch(batch)]
+        for num_shards, processes in ((1, False), (3, False), (4, True)):
+            ledger = PartitionedLedger(num_shards, processes)
+            with open(path) as file:
+                lines = [format_result(result) for batch in read_batches(file, 5000) for result in ledger.run_batch(batch)]
+            ledger.close()
+            results.append(("matches single instance, {} accounts, {} shards{}".format(
+                num_accounts, num_shards, " in processes" if processes else ""), lines == expected))
+
+    for name, passed in results:
+        print("{}: {}".format(name, "Pass" if passed else "Fail"))
+
+
+def benchmark(num_commands=1000000, num_accounts=100000, transfer_share=0.02):
+    path = os.path.join(tempfile.mkdtemp(), "commands.txt")
+    generate_commands(path, num_commands, num_accounts=num_accounts, seed=1, transfer_share=transfer_share)
+    print("{:,} commands, {:.0%} transfers, {} cores".format(num_commands, transfer_share, os.cpu_count()))
+
+    engine = ReplayEngine(BankingSystemImpl(), timed=False)
+    start = time.perf_counter()
+    with open(path) as file:
+        for batch in read_batches(file):
+            engine.run_batch(batch)
+    print("  single instance:  {:6.2f}s".format(time.perf_counter() - start))
+
+    for num_shards in (1, 2, 4, 8):
+        ledger = PartitionedLedger(num_shards)
+        start = time.perf_counter()
+        with open(path) as file:
+            for batch in read_batches(file):
+                ledger.run_batch(batch)
+        elapsed = time.perf_counter() - start
+        ledger.close()
+        # Projected wall time with a core per shard: coordinator work plus the busiest shard of each round
+        print("  {} shards: {:6.2f}s wall, {:3} rounds; coordinator {:.2f}s + busiest shards {:.2f}s "
+              "= {:.2f}s projected with {} cores".format(
+                  num_shards, elapsed, ledger.rounds, ledger.coordinator_seconds, ledger.critical_seconds,
+                  ledger.coordinator_seconds + ledger.critical_seconds, num_shards))
+
+
+if __name__ == "__main__":
+    run_tests()
+    benchmark(transfer_share=float(sys.argv[1]) if len(sys.argv) > 1 else 0.02)
@@ -0,0 +1,319 @@
+import os
+import random
+import sys
+import tempfile
+import time
+from array import array
+from typing import Dict, Iterator, List, Optional
+
+# Command name -> (BankingSystem method, converters for its arguments after the timestamp)
+OPERATIONS = {
+    "CREATE_ACCOUNT": ("create_account", (str,)),
+    "DEPOSIT": ("deposit", (str, int)),
+    "TRANSFER": ("transfer", (str, str, int)),
+    "TOP_SPENDERS": ("top_spenders", (int,)),
+    "PAY": ("pay", (str, int)),
+    "GET_PAYMENT_STATUS": ("get_payment_status", (str, str)),
+}
+OP_NAMES = list(OPERATIONS)
+OP_CODES = {name: code for code, name in enumerate(OP_NAMES)}
+
+
+class CommandBatch:
+    """
+    Commands stored column by column: timestamps and op codes in typed
+    arrays, and the arguments already converted to the types the methods take.
+    """
+
+    def __init__(self):
+        self.timestamps = array("q")
+        self.ops = array("B")
+        self.args: List[tuple] = []
+
+    def __len__(self):
+        return len(self.ops)
+
+    def append(self, timestamp: int, op: str, args: tuple):
+        self.timestamps.append(timestamp)
+        self.ops.append(OP_CODES[op])
+        self.args.append(args)
+
+
+def parse_line(line: str, line_number: int = 0):
+    """'timestamp OP arg ...' -> (timestamp, OP, converted args)."""
+    fields = line.split()
+    try:
+        _, converters = OPERATIONS[fields[1]]
+        if len(fields) - 2 != len(converters):
+            raise ValueError("{} takes {} arguments".format(fields[1], len(converters)))
+        return int(fields[0]), fields[1], tuple(convert(value) for convert, value in zip(converters, fields[2:]))
+    except (IndexError, KeyError, ValueError) as error:
+        raise ValueError("line {}: cannot parse {!r} ({})".format(line_number, line.strip(), error)) from None
+
+
+# Command name -> (op code, argument count, positions of the int arguments), for the batch reader
+LAYOUTS = {name: (OP_CODES[name], len(converters), [i for i, convert in enumerate(converters) if convert is int])
+           for name, (_, converters) in OPERATIONS.items()}
+
+
+def read_batches(lines, batch_size: int = 65536) -> Iterator[CommandBatch]:
+    """Reads commands into batches of `batch_size`, so a file of any length streams through bounded memory."""
+    lines = iter(lines)
+    line_number = 0
+    exhausted = False
+    while not exhausted:
+        batch = CommandBatch()
+        timestamps, ops, arguments = batch.timestamps, batch.ops, batch.args
+        # Fill the batch with commands; blank and comment lines do not count towards it
+        while len(ops) < batch_size:
+            line = next(lines, None)
+            if line is None:
+                exhausted = True
+                break
+            line_number += 1
+            fields = line.split()
+            if not fields or fields[0].startswith("#"):
+                continue
+            layout = LAYOUTS.get(fields[1]) if len(fields) > 1 else None
+            try:
+                code, arity, int_positions = layout
+                args = fields[2:]
+                if len(args) != arity:
+                    raise ValueError
+                for i in int_positions:
+                    args[i] = int(args[i])
+                timestamps.append(int(fields[0]))
+            except (TypeError, ValueError):
+                parse_line(line, line_number)  # Raises with a precise message
+                raise
+            ops.append(code)
+            arguments.append(tuple(args))
+        if batch:
+            yield batch
+
+
+def format_result(result) -> str:
+    """Compact output: '-' for None, 1/0 for booleans, comma-separated lists."""
+    if result is None:
+        return "-"
+    if result is True or result is False:
+        return "1" if result else "0"
+    if isinstance(result, list):
+        return ",".join(result)
+    return str(result)
+
+
+class LatencyHistogram:
+    """Counts of latencies in power-of-two nanosecond buckets; bucket b holds [2**(b-1), 2**b)."""
+
+    def __init__(self):
+        self.buckets = array("Q", bytes(8 * 64))
+        self.count = 0
+        self.total_ns = 0
+
+    def record(self, nanoseconds: int):
+        self.buckets[nanoseconds.bit_length()] += 1
+        self.count += 1
+        self.total_ns += nanoseconds
+
+    def percentile(self, p: float) -> int:
+        """Upper bound, in nanoseconds, of the bucket holding the p-th percentile."""
+        rank = p / 100 * self.count
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return 1 << bucket
+        return 0
+
+    def summary(self) -> str:
+        mean = self.total_ns / self.count if self.count else 0
+        return "n {:>10,}  mean {:>8,.0f}ns  p50 <{:>8,}ns  p99 <{:>9,}ns  p99.9 <{:>9,}ns".format(
+            self.count, mean, self.percentile(50), self.percentile(99), self.percentile(99.9))
+
+
+class ReplayEngine:
+    """
+    Replays command batches through a BankingSystem and writes one result
+    line per command.
+
+    Each op code maps to its bound method, looked up once, so the hot loop is
+    an index into a list and a call. With `timed`, every call is also timed
+    into a per-operation LatencyHistogram; leave it off for raw throughput.
+    """
+
+    def __init__(self, system, output=None, timed: bool = True):
+        self.system = system
+        self.output = output
+        self.timed = timed
+        self.handlers = [getattr(system, OPERATIONS[name][0], None) for name in OP_NAMES]
+        self.histograms: Dict[str, LatencyHistogram] = {name: LatencyHistogram() for name in OP_NAMES}
+        self.commands = 0
+        self.seconds = 0.0
+
+    def run_batch(self, batch: CommandBatch) -> List[str]:
+        missing = {OP_NAMES[op] for op in set(batch.ops) if self.handlers[op] is None}
+        if missing:
+            raise ValueError("{} does not implement {}".format(type(self.system).__name__, ", ".join(sorted(missing))))
+
+        handlers = self.handlers
+        results = []
+        append = results.append
+        start = time.perf_counter()
+        if self.timed:
+            histograms = [self.histograms[name] for name in OP_NAMES]
+            clock = time.perf_counter_ns
+            for timestamp, op, args in zip(batch.timestamps, batch.ops, batch.args):
+                before = clock()
+                append(handlers[op](timestamp, *args))
+                histograms[op].record(clock() - before)
+        else:
+            for timestamp, op, args in zip(batch.timestamps, batch.ops, batch.args):
+                append(handlers[op](timestamp, *args))
+        self.seconds += time.perf_counter() - start
+        self.commands += len(batch)
+
+        lines = [format_result(result) for result in results]
+        if self.output is not None:
+            self.output.write("\n".join(lines))
+            self.output.write("\n")
+        return lines
+
+    def run(self, batches) -> "ReplayEngine":
+        for batch in batches:
+            self.run_batch(batch)
+        return self
+
+    def report(self) -> str:
+        rate = self.commands / self.seconds if self.seconds else 0.0
+        lines = ["{:,} commands in {:.2f}s: {:,.0f} ops/s".format(self.commands, self.seconds, rate)]
+        for name, histogram in self.histograms.items():
+            if histogram.count:
+                lines.append("  {:<20} {}".format(name, histogram.summary()))
+        return "\n".join(lines)
+
+
+def replay_file(system, input_path: str, output_path: Optional[str] = None, batch_size: int = 65536,
+                timed: bool = True) -> ReplayEngine:
+    with open(input_path) as commands, open(output_path or os.devnull, "w", buffering=1 << 20) as output:
+        return ReplayEngine(system, output, timed).run(read_batches(commands, batch_size))
+
+
+def generate_commands(path: str, num_commands: int, num_accounts: int = 10000, seed: int = 0,
+                      transfer_share: float = 0.54, payment_share: float = 0.0, max_step: int = 1):
+    """
+    A random workload: accounts first, then deposits, `transfer_share` transfers, `payment_share` PAY and
+    GET_PAYMENT_STATUS (two to one) and 1% TOP_SPENDERS. Timestamps advance by 1 to `max_step` per command.
+    """
+    rand = random.Random(seed)
+    payers = []  # Account of every PAY written so far, to ask mostly about real payments
+    with open(path, "w", buffering=1 << 20) as file:
+        timestamp = 0
+        for i in range(num_accounts):
+            timestamp += 1
+            file.write("{} CREATE_ACCOUNT acc{}\n".format(timestamp, i))
+        for _ in range(num_commands - num_accounts):
+            timestamp += 1 if max_step == 1 else rand.randrange(1, max_step + 1)
+            kind = rand.random()
+            if kind < 0.99 - transfer_share - payment_share:
+                file.write("{} DEPOSIT acc{} {}\n".format(timestamp, rand.randrange(num_accounts), rand.randrange(1, 1000)))
+            elif kind < 0.99 - payment_share:
+                file.write("{} TRANSFER acc{} acc{} {}\n".format(
+                    timestamp, rand.randrange(num_accounts), rand.randrange(num_accounts), rand.randrange(1, 500)))
+            elif kind < 0.99 - payment_share / 3:
+                payers.append(rand.randrange(num_accounts))
+                file.write("{} PAY acc{} {}\n".format(timestamp, payers[-1], rand.randrange(1, 200)))
+            elif kind < 0.99:
+                # Failed payments take no number, so this is often another account's payment or none at all
+                number = rand.randrange(1, len(payers) + 2)
+                account = payers[number - 1] if number <= len(payers) else rand.randrange(num_accounts)
+                file.write("{} GET_PAYMENT_STATUS acc{} payment{}\n".format(timestamp, account, number))
+            else:
+                file.write("{} TOP_SPENDERS {}\n".format(timestamp, rand.randrange(1, 10)))
+
+
+def run_tests():
+    from test5 import BankingSystemImpl
+
+    results = []
+    commands = """
+        1 CREATE_ACCOUNT acc1
+        2 CREATE_ACCOUNT acc2
+        3 CREATE_ACCOUNT acc1
+        4 DEPOSIT acc1 1000
+        5 DEPOSIT missing 10
+        6 TRANSFER acc1 acc2 300
+        7 TRANSFER acc1 acc2 5000
+        8 TOP_SPENDERS 2
+    """.splitlines()
+    engine = ReplayEngine(BankingSystemImpl())
+    lines = [line for batch in read_batches(commands, batch_size=3) for line in engine.run_batch(batch)]
+    results.append(("compact results across batches", lines == ["1", "1", "0", "1000", "-", "700", "-", "acc1(300),acc2(0)"]))
+    results.append(("histograms per operation", engine.histograms["TRANSFER"].count == 2 and engine.commands == 8))
+
+    # Same results as calling the methods one by one
+    path = os.path.join(tempfile.mkdtemp(), "commands.txt")
+    generate_commands(path, 20000, num_accounts=500, seed=3)
+    direct = BankingSystemImpl()
+    expected = []
+    with open(path) as file:
+        for line in file:
+            timestamp, op, args = parse_line(line)
+            expected.append(format_result(getattr(direct, OPERATIONS[op][0])(timestamp, *args)))
+    output_path = path + ".out"
+    replay_file(BankingSystemImpl(), path, output_path, batch_size=4096)
+    with open(output_path) as file:
+        results.append(("matches direct calls", file.read().split("\n")[:-1] == expected))
+
+    commented = ["# header"] * 4 + ["1 CREATE_ACCOUNT a", "", "2 DEPOSIT a 5"]
+    results.append(("comment runs do not end the stream",
+                    [[len(batch) for batch in read_batches(commented, size)] for size in (1, 3, 4)] == [[1, 1], [2], [2]]))
+
+    try:
+        list(read_batches(["1 WITHDRAW acc1 5"]))
+        results.append(("unknown operation rejected", False))
+    except ValueError as error:
+        results.append(("unknown operation rejected", "line 1" in str(error)))
+
+    for name, passed in results:
+        print("{}: {}".format(name, "Pass" if passed else "Fail"))
+
+
+def benchmark(num_commands=2000000):
+    from test5 import BankingSystemImpl
+
+    path = os.path.join(tempfile.mkdtemp(), "commands.txt")
+    generate_commands(path, num_commands, num_accounts=100000)
+
+    start = time.perf_counter()
+    with open(path) as file:
+        for _ in read_batches(file):
+            pass
+    print("read_batches only: {:,.0f} lines/s".format(num_commands / (time.perf_counter() - start)))
+
+    # Baseline: parse and dispatch by name, one call at a time
+    system = BankingSystemImpl()
+    start = time.perf_counter()
+    with open(path) as file, open(os.devnull, "w") as output:
+        for line in file:
+            timestamp, op, args = parse_line(line)
+            output.write(format_result(getattr(system, OPERATIONS[op][0])(timestamp, *args)) + "\n")
+    print("one call at a time: {:,.0f} ops/s end to end".format(num_commands / (time.perf_counter() - start)))
+
+    start = time.perf_counter()
+    engine = replay_file(BankingSystemImpl(), path, timed=False)
+    print("engine untimed: {:,.0f} ops/s end to end, {}".format(
+        num_commands / (time.perf_counter() - start), engine.report().splitlines()[0]))
+
+    print(replay_file(BankingSystemImpl(), path).report())
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        # python replay.py commands.txt [results.txt]
+        from test5 import BankingSystemImpl
+
+        print(replay_file(BankingSystemImpl(), sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None).report())
+    else:
+        run_tests()
+        benchmark()
@@ -1,6 +1,9 @@
 from typing import Optional, Dict, List, Tuple
 import heapq
-from banking_system import BankingSystem
+try:
+    from banking_system import BankingSystem
+except ImportError:  # Outside the assessment platform, use the copy of the interface
+    from BankingSystem import BankingSystem
 
 
 class Account:
@@ -1,152 +1,201 @@
-import heapq
-from typing import Optional, Dict, List, Tuple
-from banking_system import BankingSystem
+import os
+import random
+import sys
+from typing import Callable, Optional, List
 
+# account_table, spender_ranking and the BankingSystem interface live in the parent directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-class Account:
-    def __init__(self, account_id: str):
-        self.account_id = account_id
-        self.balance = 0
-        self.outgoing = 0  # Tracks total outgoing (transfers + payments)
-
-
-class Payment:
-    def __init__(self, payment_id: str, account_id: str, cashback_amount: int, due_time: int):
-        self.payment_id = payment_id
-        self.account_id = account_id
-        self.cashback_amount = cashback_amount
-        self.due_time = due_time
-        self.status = "IN_PROGRESS"
+try:
+    from banking_system import BankingSystem
+except ImportError:  # Outside the assessment platform, use the copy of the interface
+    from BankingSystem import BankingSystem
+from account_table import AccountTable, Payment, PaymentBook
+from spender_ranking import SpenderRanking
+from timing_wheel import TimingWheel
 
 
 class BankingSystemImpl(BankingSystem):
     def __init__(self):
-        self.accounts: Dict[str, Account] = {}
+        # Account ids interned to indexes; balances and outgoing totals (transfers + payments) in int64 arrays
+        self.accounts = AccountTable()
+        # Accounts in (outgoing desc, account_id asc) order, updated by transfer and pay
+        self.ranking = SpenderRanking()
 
-        # Level 3: Payment tracking
-        self.payment_counter = 0
-        self.payments: Dict[str, Payment] = {}
+        # Level 3: Payment tracking; settled payments shrink to their owner's index
+        self.payments = PaymentBook()
 
-        # Priority Queue for scheduled cashbacks: stores tuples (due_time, payment_id)
-        # Using a heap allows efficient retrieval of the "next due" cashback
-        self.scheduled_cashbacks: List[Tuple[int, str]] = []
+        # Timing wheel of delayed ledger events, keyed by due time: cashbacks (Payment objects) and the
+        # (due_time, action) pairs of schedule_event(). Scheduling and cancelling are O(1)
+        self.scheduled_events = TimingWheel()
 
-    def _process_pending_cashbacks(self, current_timestamp: int):
+    def advance_to(self, timestamp: int):
         """
-        Internal helper: Process all cashbacks scheduled for <= current_timestamp.
-        Must be called at the start of EVERY public method.
+        Applies every cashback and runs every scheduled action due by `timestamp`, earliest first.
+        Called at the start of EVERY public method, and directly when replaying up to a point in time.
         """
-        while self.scheduled_cashbacks and self.scheduled_cashbacks[0][0] <= current_timestamp:
-            # Pop the earliest scheduled cashback
-            due_time, payment_id = heapq.heappop(self.scheduled_cashbacks)
-
-            payment = self.payments[payment_id]
-
-            # Apply cashback if account still exists (Edge case, though delete isn't in spec)
-            if payment.account_id in self.accounts:
-                self.accounts[payment.account_id].balance += payment.cashback_amount
+        wheel = self.scheduled_events
+        if timestamp < wheel.next_due:
+            return  # Nothing due: a single comparison
+        balances = self.accounts.balances
+        for event in wheel.advance_to(timestamp):  # Everything due, drained in one batch
+            if event.__class__ is Payment:
+                balances[event.account] += event.cashback
+                self.payments.settle(event)  # Status becomes CASHBACK_RECEIVED
+            else:
+                due_time, action = event
+                action(due_time)
+
+    def schedule_event(self, due_time: int, action: Callable[[int], None]) -> list:
+        """
+        Schedules a delayed ledger event: action(due_time) runs once the ledger reaches `due_time`,
+        in due order with the cashbacks. Returns the handle to pass to cancel_event().
+        """
+        return self.scheduled_events.schedule(due_time, (due_time, action))
 
-            # Update status
-            payment.status = "CASHBACK_RECEIVED"
+    def cancel_event(self, handle: list) -> bool:
+        """Cancels a scheduled event in O(1). False if it already ran or was cancelled."""
+        return self.scheduled_events.cancel(handle)
 
     def create_account(self, timestamp: int, account_id: str) -> bool:
-        self._process_pending_cashbacks(timestamp)  # Level 3 Check
+        self.advance_to(timestamp)  # Level 3 Check
 
-        if account_id in self.accounts:
+        if self.accounts.add(account_id) is None:
             return False
-        self.accounts[account_id] = Account(account_id)
+        self.ranking.add(account_id)
         return True
 
     def deposit(self, timestamp: int, account_id: str, amount: int) -> Optional[int]:
-        self._process_pending_cashbacks(timestamp)  # Level 3 Check
+        self.advance_to(timestamp)  # Level 3 Check
 
-        if account_id not in self.accounts:
+        account = self.accounts.get(account_id)
+        if account is None:
             return None
 
-        account = self.accounts[account_id]
-        account.balance += amount
-        return account.balance
+        self.accounts.balances[account] += amount
+        return self.accounts.balances[account]
 
     def transfer(self, timestamp: int, source_account_id: str, target_account_id: str, amount: int) -> Optional[int]:
-        self._process_pending_cashbacks(timestamp)  # Level 3 Check
+        self.advance_to(timestamp)  # Level 3 Check
 
-        if source_account_id not in self.accounts or target_account_id not in self.accounts:
+        source = self.accounts.get(source_account_id)
+        target = self.accounts.get(target_account_id)
+        if source is None or target is None:
             return None
 
-        if source_account_id == target_account_id:
+        if source == target:
             return None
 
-        source_acc = self.accounts[source_account_id]
-        target_acc = self.accounts[target_account_id]
-
-        if source_acc.balance < amount:
+        balances = self.accounts.balances
+        if balances[source] < amount:
             return None
 
         # Execute Transfer
-        source_acc.balance -= amount
-        target_acc.balance += amount
-        source_acc.outgoing += amount
+        balances[source] -= amount
+        balances[target] += amount
+        self.accounts.outgoing[source] += amount
+        self.ranking.update(source_account_id, self.accounts.outgoing[source])
 
-        return source_acc.balance
+        return balances[source]
 
     def top_spenders(self, timestamp: int, n: int) -> List[str]:
-        self._process_pending_cashbacks(timestamp)  # Level 3 Check
+        self.advance_to(timestamp)  # Level 3 Check
 
-        all_accounts = list(self.accounts.values())
-        # Sort: Outgoing (Desc), Account ID (Asc)
-        sorted_accounts = sorted(all_accounts, key=lambda acc: (-acc.outgoing, acc.account_id))
-        top_n = sorted_accounts[:n]
-        return [f"{acc.account_id}({acc.outgoing})" for acc in top_n]
+        # Outgoing (Desc), Account ID (Asc), maintained incrementally by SpenderRanking
+        return [f"{account_id}({outgoing})" for account_id, outgoing in self.ranking.top(n)]
 
     # --- LEVEL 3 NEW METHODS ---
 
     def pay(self, timestamp: int, account_id: str, amount: int) -> Optional[str]:
-        self._process_pending_cashbacks(timestamp)  # Ensure any due cashbacks happen first
+        self.advance_to(timestamp)  # Ensure any due cashbacks happen first
 
-        if account_id not in self.accounts:
+        account = self.accounts.get(account_id)
+        if account is None:
             return None
 
-        account = self.accounts[account_id]
-
-        if account.balance < amount:
+        if self.accounts.balances[account] < amount:
             return None
 
         # 1. Process Withdrawal
-        account.balance -= amount
-        account.outgoing += amount  # Payments count towards "outgoing"
-
-        # 2. Generate Payment ID
-        self.payment_counter += 1
-        payment_id = f"payment{self.payment_counter}"
+        self.accounts.balances[account] -= amount
+        self.accounts.outgoing[account] += amount  # Payments count towards "outgoing"
+        self.ranking.update(account_id, self.accounts.outgoing[account])
 
-        # 3. Calculate Cashback (2% rounded down)
+        # 2. Calculate Cashback (2% rounded down)
         cashback_amt = int(amount * 0.02)
 
-        # 4. Schedule Cashback (Current Time + 24 hours in ms)
-        wait_period = 86400000  # 24 * 60 * 60 * 1000
-        due_time = timestamp + wait_period
-
-        # 5. Store Payment Info
-        new_payment = Payment(payment_id, account_id, cashback_amt, due_time)
-        self.payments[payment_id] = new_payment
+        # 3. Record the payment; its id is "payment<number>"
+        new_payment = self.payments.add(account, cashback_amt)
 
-        # 6. Add to Priority Queue
-        heapq.heappush(self.scheduled_cashbacks, (due_time, payment_id))
+        # 4. Schedule Cashback on the timing wheel (Current Time + 24 hours in ms)
+        wait_period = 86400000  # 24 * 60 * 60 * 1000
+        self.scheduled_events.schedule(timestamp + wait_period, new_payment)
 
-        return payment_id
+        return self.payments.payment_id(new_payment)
 
     def get_payment_status(self, timestamp: int, account_id: str, payment: str) -> Optional[str]:
-        self._process_pending_cashbacks(timestamp)  # Ensure status is up-to-date
-
-        if account_id not in self.accounts:
-            return None
-
-        if payment not in self.payments:
-            return None
-
-        payment_obj = self.payments[payment]
+        self.advance_to(timestamp)  # Ensure status is up-to-date
 
-        if payment_obj.account_id != account_id:
+        account = self.accounts.get(account_id)
+        if account is None:
             return None
 
-        return payment_obj.status
\ No newline at end of file
+        # None for unknown payments and for payments of another account
+        return self.payments.status(payment, account)
+
+
+def run_tests():
+    """Random calls against Test2.py, the dict-and-heap version this one replaced, then scheduled events."""
+    from Test2 import BankingSystemImpl as ReferenceImpl
+
+    rand = random.Random(9)
+    system, reference = BankingSystemImpl(), ReferenceImpl()
+    account_ids = ["acc{}".format(i) for i in range(40)]
+    timestamp = 0
+    mismatches = 0
+    for _ in range(50000):
+        timestamp += rand.choice((1, 1000, 3600000, 20000000))
+        account_id = rand.choice(account_ids)
+        action = rand.random()
+        if action < 0.05:
+            call = ("create_account", account_id)
+        elif action < 0.35:
+            call = ("deposit", account_id, rand.randrange(1, 5000))
+        elif action < 0.55:
+            call = ("transfer", account_id, rand.choice(account_ids), rand.randrange(1, 3000))
+        elif action < 0.75:
+            call = ("pay", account_id, rand.randrange(1, 3000))
+        elif action < 0.8:
+            call = ("top_spenders", rand.randrange(0, 8))
+        else:
+            # Mostly recent payments asked for by their owner, some by other accounts or with malformed ids
+            number = rand.randrange(max(0, len(reference.payments) - 30), len(reference.payments) + 3)
+            owner = reference.payments.get("payment{}".format(number))
+            if owner is not None and rand.random() < 0.7:
+                account_id = owner.account_id
+            payment = rand.choice(("payment{}", "payment0{}", "payment{}x", "payment\u0661{}")) if rand.random() < 0.1 \
+                else "payment{}"
+            call = ("get_payment_status", account_id, payment.format(number))
+        if getattr(system, call[0])(timestamp, *call[1:]) != getattr(reference, call[0])(timestamp, *call[1:]):
+            mismatches += 1
+    print("matches the previous version on random calls: {}".format("Pass" if mismatches == 0 else "Fail"))
+
+    # A standing order and a cancelled one, sharing their due time with a cashback
+    system = BankingSystemImpl()
+    system.create_account(1, "acc1")
+    system.create_account(2, "acc2")
+    system.deposit(3, "acc1", 1000)
+    system.pay(4, "acc1", 500)  # Cashback of 10 at 86400004
+    seen = []
+    system.schedule_event(86400004, lambda due: seen.append(system.transfer(due, "acc1", "acc2", 510)))
+    dropped = system.schedule_event(86400004, lambda due: system.deposit(due, "acc2", 1))
+    cancelled = system.cancel_event(dropped) and not system.cancel_event(dropped)
+    before = system.deposit(86400003, "acc2", 0)
+    system.advance_to(86400004)
+    print("scheduled events run in due order after the cashback: {}".format(
+        "Pass" if cancelled and before == 0 and seen == [0] and system.deposit(86400005, "acc2", 0) == 510 and
+        system.get_payment_status(86400005, "acc1", "payment1") == "CASHBACK_RECEIVED" else "Fail"))
+
+
+if __name__ == "__main__":
+    run_tests()
@@ -2,6 +2,8 @@ import sys
 from abc import ABC, abstractmethod
 from typing import Optional, Dict, List
 
+from spender_ranking import SpenderRanking
+
 
 # ==========================================
 # 1. THE INTERFACE (BankingSystem)
@@ -37,11 +39,14 @@ class Account:
 class BankingSystemImpl(BankingSystem):
     def __init__(self):
         self.accounts: Dict[str, Account] = {}
+        # Kept in (outgoing desc, account_id asc) order as transfers happen
+        self.ranking = SpenderRanking()
 
     def create_account(self, timestamp: int, account_id: str) -> bool:
         if account_id in self.accounts:
             return False
         self.accounts[account_id] = Account(account_id)
+        self.ranking.add(account_id)
         return True
 
     def deposit(self, timestamp: int, account_id: str, amount: int) -> Optional[int]:
@@ -71,6 +76,7 @@ class BankingSystemImpl(BankingSystem):
 
         # <--- CRITICAL FIX: Increment outgoing tracker
         source_acc.outgoing += amount
+        self.ranking.update(source_account_id, source_acc.outgoing)
 
         return source_acc.balance
 
@@ -79,19 +85,8 @@ class BankingSystemImpl(BankingSystem):
         Returns top 'n' accounts by outgoing transactions.
         Sort: Descending by outgoing amount, then Ascending by account_id.
         """
-        # 1. Get all accounts
-        all_accounts = list(self.accounts.values())
-
-        # 2. Sort by Outgoing (Desc) and Account ID (Asc)
-        # We use -acc.outgoing to sort descending (highest first)
-        # We use acc.account_id to break ties alphabetically (A before B)
-        sorted_accounts = sorted(all_accounts, key=lambda acc: (-acc.outgoing, acc.account_id))
-
-        # 3. Take top n
-        top_n = sorted_accounts[:n]
-
-        # 4. Format as strings ["id(amount)", ...]
-        return [f"{acc.account_id}({acc.outgoing})" for acc in top_n]
+        # The ranking is maintained on every transfer, so this only reads the first n entries
+        return [f"{account_id}({outgoing})" for account_id, outgoing in self.ranking.top(n)]
 
 
 # ==========================================
@@ -0,0 +1,217 @@
+import heapq
+import math
+import random
+import time
+from bisect import insort
+from operator import itemgetter
+from typing import Any, List
+
+# A timer is a [due, event, state] list; lists are much cheaper to create than objects
+DUE, EVENT, STATE = 0, 1, 2
+PENDING, CANCELLED, FIRED = 0, 1, 2
+due_of = itemgetter(DUE)
+
+
+class TimingWheel:
+    """
+    Timing wheel over integer timestamps (e.g. milliseconds) with slots of
+    2 ** `bits` ticks.
+
+    schedule() appends a timer to the unsorted bucket of its slot, so the
+    cost is one dict lookup and one append. The occupied slot numbers are
+    kept in a small heap, pushed once per slot rather than once per timer,
+    so the wheel can jump over any stretch of empty slots. When time
+    reaches a slot, its bucket is sorted once (a C sort that is close to
+    linear on nearly-ordered dues) and becomes the current slot. Every
+    advance_to() then fires a run of that bucket. A timer due in a slot
+    already reached goes straight into the current bucket in order.
+
+    The wheel keeps the due time of its earliest timer in `next_due`, so a
+    caller can skip the call entirely until something is due. cancel() is
+    O(1); cancelled timers are dropped when their slot is drained.
+    advance_to(t) returns every due event in due-time order in one batch,
+    with equal due times in scheduling order.
+    """
+
+    def __init__(self, now: int = 0, bits: int = 16):
+        self.now = now
+        self.bits = bits
+        self.slots = {}  # Slot number -> unsorted timers, for slots after the current one
+        self.occupied: List[int] = []  # Heap of the slot numbers in `slots`
+        self.current: List[list] = []  # Timers of the current slot, sorted by due time
+        self.position = 0  # Timers of `current` before this index have been drained
+        self.current_slot = now >> bits
+        self.next_due = math.inf  # No timer is due before this
+        self.pending = 0
+
+    def __len__(self):
+        return self.pending
+
+    def schedule(self, due: int, event: Any) -> list:
+        """
+        Schedules `event` for `due` and returns the timer to pass to cancel().
+        An event already due is returned by the next advance_to().
+        """
+        timer = [due, event, PENDING]
+        slot = due >> self.bits
+        bucket = self.slots.get(slot)
+        if bucket is not None:
+            bucket.append(timer)
+        elif slot > self.current_slot:
+            self.slots[slot] = [timer]
+            heapq.heappush(self.occupied, slot)
+        else:
+            # Everything still in the current bucket is due after the last advance_to(), so this keeps it sorted
+            insort(self.current, timer, self.position, key=due_of)
+        if due < self.next_due:
+            self.next_due = due
+        self.pending += 1
+        return timer
+
+    def cancel(self, timer: list) -> bool:
+        if timer[STATE] != PENDING:
+            return False
+        timer[STATE] = CANCELLED
+        self.pending -= 1
+        return True
+
+    def advance_to(self, timestamp: int) -> List[Any]:
+        """Moves the wheel to `timestamp` and returns the events due by then, earliest first."""
+        if timestamp > self.now:
+            self.now = timestamp
+        if timestamp < self.next_due:
+            return []
+
+        due = []
+        while True:
+            current, position = self.current, self.position
+            size = len(current)
+            while position < size:
+                timer = current[position]
+                if timer[DUE] > timestamp:
+                    break
+                if timer[STATE] == PENDING:
+                    timer[STATE] = FIRED
+                    due.append(timer[EVENT])
+                position += 1
+            self.position = position
+            if position < size:
+                self.next_due = current[position][DUE]
+                break
+            # The current slot is drained; move on to the next occupied slot if time has reached it
+            self.current, self.position = [], 0
+            occupied = self.occupied
+            if not occupied:
+                self.next_due = math.inf
+                break
+            if occupied[0] << self.bits > timestamp:
+                self.next_due = occupied[0] << self.bits
+                break
+            self.current_slot = heapq.heappop(occupied)
+            bucket = self.slots.pop(self.current_slot)
+            bucket.sort(key=due_of)  # Stable, so equal due times stay in scheduling order
+            self.current = bucket
+        self.pending -= len(due)
+        return due
+
+
+def run_tests():
+    results = []
+
+    wheel = TimingWheel()
+    for due in (300, 5, 70000, 5, 256, 1 << 30):
+        wheel.schedule(due, due)
+    results.append(("nothing due early", wheel.advance_to(4) == []))
+    results.append(("same tick together", wheel.advance_to(5) == [5, 5]))
+    results.append(("crosses slots in order", wheel.advance_to(100000) == [256, 300, 70000]))
+    results.append(("far timers wait", len(wheel) == 1 and wheel.advance_to((1 << 30) - 1) == []))
+    results.append(("far timers fire", wheel.advance_to(1 << 31) == [1 << 30] and len(wheel) == 0))
+
+    wheel = TimingWheel(now=1000)
+    keep = wheel.schedule(5000, "keep")
+    drop = wheel.schedule(5000, "drop")
+    results.append(("cancel once", wheel.cancel(drop) and not wheel.cancel(drop)))
+    wheel.schedule(10, "late")
+    results.append(("cancelled skipped, past due fires now", wheel.advance_to(6000) == ["late", "keep"]))
+    results.append(("cannot cancel fired timer", not wheel.cancel(keep)))
+
+    # Random schedules, cancels and advances against a heap
+    rand = random.Random(5)
+    wheel = TimingWheel()
+    heap = []
+    timers = []
+    now = 0
+    matches = True
+    for i in range(20000):
+        action = rand.random()
+        if action < 0.5:
+            due = now + rand.choice((0, -rand.randrange(300), rand.randrange(300), rand.randrange(100000),
+                                     rand.randrange(1 << 28)))
+            timers.append(wheel.schedule(due, i))
+            heapq.heappush(heap, (due, i))
+        elif action < 0.6 and timers:
+            timer = timers.pop(rand.randrange(len(timers)))
+            if wheel.cancel(timer):
+                heap.remove((timer[0], timer[1]))
+                heapq.heapify(heap)
+        else:
+            now += rand.choice((1, rand.randrange(1000), rand.randrange(1 << 20)))
+            expected = []
+            while heap and heap[0][0] <= now:
+                expected.append(heapq.heappop(heap))
+            # Earliest first, and equal due times in scheduling order, exactly as the heap pops them
+            matches = matches and wheel.advance_to(now) == [i for _, i in expected]
+    results.append(("matches a heap", matches and len(wheel) == len(heap)))
+
+    for name, passed in results:
+        print("{}: {}".format(name, "Pass" if passed else "Fail"))
+
+
+def drain_heap(heap, timestamp):
+    """The heap drain BankingSystemImpl used before the wheel, one heappop per due event."""
+    due = []
+    while heap and heap[0][0] <= timestamp:
+        due.append(heapq.heappop(heap)[1])
+    return due
+
+
+def benchmark(num_payments=1000000, delay=86400000, cancel_every=0):
+    """
+    Two days of payments, each scheduling a cashback one day later, replayed
+    with a drain before every call. With `cancel_every`, every k-th cashback
+    is cancelled again; the heap has to search for it and re-heapify.
+    """
+    rand = random.Random(2)
+    timestamps = sorted(rand.randrange(2 * delay) for _ in range(num_payments))
+
+    start = time.perf_counter()
+    heap = []
+    fired = 0
+    for i, timestamp in enumerate(timestamps):
+        fired += len(drain_heap(heap, timestamp))
+        heapq.heappush(heap, (timestamp + delay, i))
+        if cancel_every and i % cancel_every == 0:
+            heap.remove((timestamp + delay, i))
+            heapq.heapify(heap)
+    heap_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    wheel = TimingWheel()
+    wheel_fired = 0
+    for i, timestamp in enumerate(timestamps):
+        if timestamp >= wheel.next_due:
+            wheel_fired += len(wheel.advance_to(timestamp))
+        timer = wheel.schedule(timestamp + delay, i)
+        if cancel_every and i % cancel_every == 0:
+            wheel.cancel(timer)
+    wheel_seconds = time.perf_counter() - start
+
+    label = "{:,} payments{}".format(num_payments, ", every {}th cancelled".format(cancel_every) if cancel_every else "")
+    print("heap:  {}, {:,} cashbacks in {:.2f}s".format(label, fired, heap_seconds))
+    print("wheel: {}, {:,} cashbacks in {:.2f}s".format(label, wheel_fired, wheel_seconds))
+
+
+if __name__ == "__main__":
+    run_tests()
+    benchmark()
+    benchmark(200000, cancel_every=100)
@@ -0,0 +1,479 @@
+import bisect
+import heapq
+import json
+import mmap
+import os
+import random
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import tracemalloc
+from array import array
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from itertools import repeat
+from typing import List, Optional
+
+from test6 import ILogger, RobustLogger
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+# Segment file: timestamps (int64 us) | message offsets (uint64, count + 1) | level codes (uint8)
+#               | messages (UTF-8) | level names (JSON) | footer
+FOOTER = struct.Struct("<QqqQQ4s")  # count, min timestamp, max timestamp, blob size, names size, magic
+MAGIC = b"LGS1"
+CHUNK = 65536  # Entries per write when streaming a column out
+
+
+def first_field(record):
+    return record[0]
+
+
+def to_micros(timestamp: datetime) -> int:
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return (timestamp - EPOCH) // MICROSECOND
+
+
+def write_segment(path: str, records):
+    """Writes (micros, level, message) records, already sorted by time, as one immutable segment."""
+    names = sorted({level for _, level, _ in records})
+    codes = {name: code for code, name in enumerate(names)}
+    timestamps = array("q", (micros for micros, _, _ in records))
+    levels = array("B", (codes[level] for _, level, _ in records))
+    encoded = [message.encode() for _, _, message in records]
+    offsets = array("Q", [0])
+    total = 0
+    for message in encoded:
+        total += len(message)
+        offsets.append(total)
+    names_json = json.dumps(names).encode()
+
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as file:
+        file.write(timestamps.tobytes())
+        file.write(offsets.tobytes())
+        file.write(levels.tobytes())
+        file.write(b"".join(encoded))
+        file.write(names_json)
+        file.write(FOOTER.pack(len(records), timestamps[0], timestamps[-1], total, len(names_json), MAGIC))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+
+
+def merge_segments(path: str, segments: List["Segment"], maps: List["SegmentMap"]):
+    """
+    Writes the records of adjacent segments, in flush order, as one segment. Records stay sorted by
+    time, with equal timestamps in flush order and so in arrival order. The merge order is kept in two
+    small arrays, and each column is then streamed out in turn, so memory stays at a few bytes a record.
+    """
+    names = sorted({name for segment in segments for name in segment.codes})
+    codes = {name: code for code, name in enumerate(names)}
+    recode = [bytes(codes[name] for name in sorted(segment.codes, key=segment.codes.get)) for segment in segments]
+    count = sum(segment.count for segment in segments)
+
+    sources = array("H")
+    positions = array("I")
+    merged = heapq.merge(*(zip(mapping.timestamps, repeat(source), range(mapping.count))
+                           for source, mapping in enumerate(maps)), key=first_field)
+
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as file:
+        chunk = array("q")
+        for micros, source, position in merged:
+            chunk.append(micros)
+            sources.append(source)
+            positions.append(position)
+            if len(chunk) == CHUNK:
+                file.write(chunk.tobytes())
+                chunk = array("q")
+        file.write(chunk.tobytes())
+        min_ts, max_ts = maps[sources[0]].timestamps[positions[0]], maps[sources[-1]].timestamps[positions[-1]]
+
+        chunk = array("Q", [0])
+        total = 0
+        for source, position in zip(sources, positions):
+            offsets = maps[source].offsets
+            total += offsets[position + 1] - offsets[position]
+            chunk.append(total)
+            if len(chunk) == CHUNK:
+                file.write(chunk.tobytes())
+                chunk = array("Q")
+        file.write(chunk.tobytes())
+
+        chunk = bytearray()
+        for source, position in zip(sources, positions):
+            chunk.append(recode[source][maps[source].levels[position]])
+        file.write(chunk)
+
+        for source, position in zip(sources, positions):
+            mapping = maps[source]
+            file.write(mapping.blob[mapping.offsets[position]:mapping.offsets[position + 1]])
+
+        names_json = json.dumps(names).encode()
+        file.write(names_json)
+        file.write(FOOTER.pack(count, min_ts, max_ts, total, len(names_json), MAGIC))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+
+
+class Segment:
+    """
+    A segment file as its footer describes it: the flushes it covers, its
+    record count, time range and level names. This is all a segment keeps
+    in memory; queries read the columns through a SegmentMap.
+    """
+
+    def __init__(self, path: str, first: int, last: int):
+        self.path = path
+        self.first, self.last = first, last  # Range of flush numbers this segment covers
+        with open(path, "rb") as file:
+            size = file.seek(0, os.SEEK_END)
+            file.seek(size - FOOTER.size)
+            self.count, self.min_ts, self.max_ts, _, names_size, magic = FOOTER.unpack(file.read(FOOTER.size))
+            if magic != MAGIC:
+                raise ValueError("{} is not a log segment".format(path))
+            file.seek(size - FOOTER.size - names_size)
+            self.codes = {name: code for code, name in enumerate(json.loads(file.read(names_size)))}
+
+
+class SegmentMap:
+    """
+    A segment file mapped into memory. The columns are views into the
+    mapping, so the OS pages in just the parts a query touches.
+    """
+
+    def __init__(self, segment: Segment):
+        self.count = count = segment.count
+        with open(segment.path, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        blob_size = FOOTER.unpack_from(self.map, len(self.map) - FOOTER.size)[3]
+        view = memoryview(self.map)
+        self.timestamps = view[:8 * count].cast("q")
+        self.offsets = view[8 * count:16 * count + 8].cast("Q")
+        self.levels = view[16 * count + 8:17 * count + 8]
+        self.blob = view[17 * count + 8:17 * count + 8 + blob_size]
+        view.release()
+
+    def records(self, start: int, end: int, code: Optional[int] = None) -> list:
+        """(micros, message) for records in [start, end] with level `code` (any if None), in time order."""
+        timestamps, offsets, levels, blob = self.timestamps, self.offsets, self.levels, self.blob
+        low = bisect.bisect_left(timestamps, start)
+        high = bisect.bisect_right(timestamps, end)
+        return [(timestamps[i], str(blob[offsets[i]:offsets[i + 1]], "utf-8"))
+                for i in range(low, high) if code is None or levels[i] == code]
+
+    def close(self):
+        for view in (self.timestamps, self.offsets, self.levels, self.blob):
+            view.release()
+        self.map.close()
+
+
+class SegmentedLogger(ILogger):
+    """
+    Logs stored on disk in immutable, time-sorted segments, so memory holds
+    only the unflushed buffer, one footer per segment and at most
+    `max_mapped` mapped segments.
+
+    add_log() appends to a buffer of up to `segment_records` logs. A full
+    buffer is sorted and written as a segment file named after the range of
+    flushes it covers. get_logs() skips segments whose min/max timestamps
+    miss the range, or which never saw the level. It maps the rest through
+    a small LRU, binary-searches their timestamps and merges the matches in
+    time order. Logs with equal timestamps come back in arrival order, as in
+    RobustLogger. Out-of-order logs cost nothing extra: they only widen
+    their segment's range.
+
+    compact() merges adjacent segments of the same size tier. Runs of small
+    segments from explicit flushes are merged whenever there are two or
+    more. Runs of `fanout` full-sized segments become one segment of the
+    next tier, up to `max_segment_records` logs. The segment count then
+    grows with the log of the number of logs until that cap. A merged file
+    covers the flush range of its inputs, so after a crash mid-compaction
+    the leftover inputs are recognised and deleted on open. The buffer is
+    only on disk after flush() or close().
+    """
+
+    def __init__(self, directory: str, segment_records: int = 65536, fanout: int = 8,
+                 max_segment_records: Optional[int] = None, max_mapped: int = 16):
+        self.directory = directory
+        self.segment_records = segment_records
+        self.fanout = fanout
+        self.max_segment_records = segment_records * fanout ** 2 if max_segment_records is None else max_segment_records
+        self.max_mapped = max_mapped
+        self.mapped: "OrderedDict[str, SegmentMap]" = OrderedDict()  # Least recently used first
+        self.lock = threading.Lock()
+        self.buffer = []  # (micros, level, message)
+        self.buffer_sorted = True  # Sorted stably by time, so equal timestamps stay in arrival order
+        os.makedirs(directory, exist_ok=True)
+        self.segments: List[Segment] = []
+        ranges = []
+        for name in os.listdir(directory):
+            if name.endswith(".tmp"):
+                os.remove(os.path.join(directory, name))
+            elif name.endswith(".seg"):
+                first, last = map(int, name[:-4].split("-"))
+                ranges.append((first, -last, name))
+        covered = -1
+        for first, negative_last, name in sorted(ranges):
+            if -negative_last <= covered:
+                # Input of a compaction whose merged segment already exists
+                os.remove(os.path.join(directory, name))
+                continue
+            covered = -negative_last
+            self.segments.append(Segment(os.path.join(directory, name), first, covered))
+        self.next_flush = self.segments[-1].last + 1 if self.segments else 0
+
+    def segment_path(self, first: int, last: int) -> str:
+        return os.path.join(self.directory, "{:012d}-{:012d}.seg".format(first, last))
+
+    def add_log(self, timestamp: datetime, message: str, level: str = "INFO") -> None:
+        micros = to_micros(timestamp)
+        with self.lock:
+            if self.buffer and micros < self.buffer[-1][0]:
+                self.buffer_sorted = False
+            self.buffer.append((micros, level, message))
+            if len(self.buffer) >= self.segment_records:
+                self._flush()
+
+    def _flush(self):
+        if not self.buffer:
+            return
+        self._sort_buffer()
+        path = self.segment_path(self.next_flush, self.next_flush)
+        write_segment(path, self.buffer)
+        self.segments.append(Segment(path, self.next_flush, self.next_flush))
+        self.next_flush += 1
+        self.buffer = []
+
+    def _sort_buffer(self):
+        if not self.buffer_sorted:
+            self.buffer.sort(key=first_field)  # Stable, so equal timestamps keep arrival order
+            self.buffer_sorted = True
+
+    def _map(self, segment: Segment) -> SegmentMap:
+        mapping = self.mapped.get(segment.path)
+        if mapping is not None:
+            self.mapped.move_to_end(segment.path)
+            return mapping
+        mapping = self.mapped[segment.path] = SegmentMap(segment)
+        if len(self.mapped) > self.max_mapped:
+            self.mapped.popitem(last=False)[1].close()
+        return mapping
+
+    def _unmap(self, segment: Segment):
+        mapping = self.mapped.pop(segment.path, None)
+        if mapping is not None:
+            mapping.close()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def get_logs(self, start: datetime, end: datetime, level: Optional[str] = None) -> List[str]:
+        start, end = to_micros(start), to_micros(end)
+        with self.lock:
+            sources = []
+            for segment in self.segments:
+                if segment.min_ts > end or segment.max_ts < start:
+                    continue
+                code = segment.codes.get(level) if level is not None else None
+                if level is not None and code is None:
+                    continue
+                # Read out before mapping the next segment, which may evict this one
+                sources.append(self._map(segment).records(start, end, code))
+            self._sort_buffer()
+            low = bisect.bisect_left(self.buffer, start, key=first_field)
+            high = bisect.bisect_right(self.buffer, end, key=first_field)
+            sources.append([(micros, message) for micros, log_level, message in self.buffer[low:high]
+                            if level is None or log_level == level])
+            # heapq.merge is stable across its inputs, which are in arrival order
+            return [message for _, message in heapq.merge(*sources, key=first_field)]
+
+    def tier(self, count: int) -> int:
+        """0 for segments of at most half a flush, then k for at most segment_records * fanout ** (k - 1) logs."""
+        tier, limit = 0, self.segment_records // 2
+        while count > limit:
+            tier += 1
+            limit = self.segment_records * self.fanout ** (tier - 1)
+        return tier
+
+    def compact(self):
+        """Merges runs of adjacent segments of one tier into bigger segments, until no run qualifies."""
+        with self.lock:
+            merging = True
+            while merging:
+                merging = False
+                compacted = []
+                run = []
+                for segment in self.segments + [None]:
+                    if segment is not None and run and len(run) < self.fanout and \
+                            self.tier(segment.count) == self.tier(run[0].count) and \
+                            sum(s.count for s in run) + segment.count <= self.max_segment_records:
+                        run.append(segment)
+                        continue
+                    if len(run) == self.fanout or (len(run) > 1 and self.tier(run[0].count) == 0):
+                        compacted.append(self._merge(run))
+                        merging = True
+                    else:
+                        compacted.extend(run)
+                    run = [segment] if segment is not None else []
+                self.segments = compacted
+
+    def _merge(self, run: List[Segment]) -> Segment:
+        path = self.segment_path(run[0].first, run[-1].last)
+        for segment in run:
+            self._unmap(segment)
+        maps = [SegmentMap(segment) for segment in run]
+        try:
+            merge_segments(path, run, maps)
+        finally:
+            for mapping in maps:
+                mapping.close()
+        for segment in run:
+            os.remove(segment.path)
+        return Segment(path, run[0].first, run[-1].last)
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            for mapping in self.mapped.values():
+                mapping.close()
+            self.mapped.clear()
+            self.segments = []
+
+
+def run_tests():
+    results = []
+    directory = tempfile.mkdtemp()
+    try:
+        base = datetime(2026, 2, 1)
+        rand = random.Random(6)
+        logs = []
+        for i in range(5000):
+            # Mostly in order, some up to a minute late, many on the same second
+            seconds = i // 3 - (rand.randrange(60) if rand.random() < 0.1 else 0)
+            logs.append((base + timedelta(seconds=seconds), "message {}".format(i), rand.choice(("INFO", "WARN", "ERROR"))))
+
+        logger = SegmentedLogger(directory, segment_records=256)
+        reference = RobustLogger()
+        for timestamp, message, level in logs:
+            logger.add_log(timestamp, message, level)
+            reference.add_log(timestamp, message, level)
+
+        def same(logger_under_test):
+            for _ in range(200):
+                start = base + timedelta(seconds=rand.randrange(-100, 1800))
+                end = start + timedelta(seconds=rand.choice((0, 1, 30, 600, 5000)))
+                level = rand.choice((None, "INFO", "ERROR", "DEBUG"))
+                if logger_under_test.get_logs(start, end, level) != reference.get_logs(start, end, level):
+                    return False
+            return True
+
+        results.append(("matches RobustLogger, including the buffer", len(logger.buffer) > 0 and same(logger)))
+        logger.close()
+
+        logger = SegmentedLogger(directory, segment_records=256)
+        results.append(("reopens from segment files", len(logger.segments) == 20 and same(logger)))
+
+        # Small segments from frequent flushes, then compaction
+        for timestamp, message, level in logs[:300]:
+            logger.add_log(timestamp, message + " again", level)
+            reference.add_log(timestamp, message + " again", level)
+            if rand.random() < 0.05:
+                logger.flush()
+        logger.flush()
+        before = len(logger.segments)
+        logger.compact()
+        results.append(("compaction merges small segments", len(logger.segments) < before and same(logger)))
+
+        # A crash after a merged segment is written but before its inputs are removed
+        logger.close()
+        merged = next(name for name in sorted(os.listdir(directory)) if name[:12] != name[13:25])
+        leftover = os.path.join(directory, "{}-{}.seg".format(merged[:12], merged[:12]))
+        shutil.copy(os.path.join(directory, merged), leftover)
+        logger = SegmentedLogger(directory, segment_records=256)
+        results.append(("leftover compaction input dropped on open", not os.path.exists(leftover) and same(logger)))
+        logger.close()
+        shutil.rmtree(directory)
+
+        # Full segments merge into tiers, and only a few segments are mapped at a time
+        logger = SegmentedLogger(directory, segment_records=64, fanout=4, max_mapped=3)
+        reference = RobustLogger()
+        for timestamp, message, level in logs[:64 * 40]:
+            logger.add_log(timestamp, message, level)
+            reference.add_log(timestamp, message, level)
+        results.append(("at most max_mapped segments mapped", same(logger) and len(logger.mapped) == 3))
+        logger.compact()
+        # 40 segments of 64 logs -> 10 of 256 -> 2 of 1,024 (the cap) and 2 of 256
+        results.append(("compaction builds tiers up to the cap",
+                        [segment.count for segment in logger.segments] == [1024, 1024, 256, 256] and same(logger)))
+        logger.close()
+        logger = SegmentedLogger(directory, segment_records=64, fanout=4, max_mapped=3)
+        results.append(("tiered segments reopen", len(logger.segments) == 4 and same(logger)))
+        logger.close()
+    finally:
+        shutil.rmtree(directory)
+
+    for name, passed in results:
+        print("{}: {}".format(name, "Pass" if passed else "Fail"))
+
+
+def benchmark(num_logs=1000000, late_share=0.05):
+    base = datetime(2026, 2, 1)
+    rand = random.Random(1)
+    logs = [(base + timedelta(milliseconds=i - (rand.randrange(600000) if rand.random() < late_share else 0)),
+             "request {} served".format(i), rand.choice(("INFO", "INFO", "INFO", "WARN", "ERROR")))
+            for i in range(num_logs)]
+    queries = [base + timedelta(milliseconds=rand.randrange(num_logs)) for _ in range(1000)]
+    print("{:,} logs, {:.0%} up to 10 minutes late".format(num_logs, late_share))
+
+    directory = tempfile.mkdtemp()
+    try:
+        for name, make in (("RobustLogger", RobustLogger), ("SegmentedLogger", lambda: SegmentedLogger(directory))):
+            start = time.perf_counter()
+            logger = make()
+            for timestamp, message, level in logs:
+                logger.add_log(timestamp, message, level)
+            added = time.perf_counter() - start
+
+            start = time.perf_counter()
+            found = sum(len(logger.get_logs(query, query + timedelta(seconds=1), "ERROR")) for query in queries)
+            queried = time.perf_counter() - start
+            if isinstance(logger, SegmentedLogger):
+                segments = len(logger.segments)
+                start = time.perf_counter()
+                logger.compact()
+                compacted = time.perf_counter() - start
+                start = time.perf_counter()
+                for query in queries:
+                    logger.get_logs(query, query + timedelta(seconds=1), "ERROR")
+                print("  compact {} segments into {} in {:.2f}s; queries then {:.3f}s".format(
+                    segments, len(logger.segments), compacted, time.perf_counter() - start))
+                logger.close()
+                for file_name in os.listdir(directory):
+                    os.remove(os.path.join(directory, file_name))
+
+            # Memory in a second run, since tracing slows every allocation down
+            tracemalloc.start()
+            logger = make()
+            for timestamp, message, level in logs:
+                logger.add_log(timestamp, message, level)
+            memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            if isinstance(logger, SegmentedLogger):
+                logger.close()
+            print("  {:<16} add {:5.2f}s  memory {:7.1f} MB  1,000 one-second ERROR queries {:.3f}s ({:,} logs)".format(
+                name, added, memory / 1e6, queried, found))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    run_tests()
+    benchmark()
@@ -0,0 +1,107 @@
+""" Times FindMatches single-process against --workers N on a generated csv shaped like input2.csv/input3.csv.
+
+    python benchmark.py --rows 10000000 --workers 8
+"""
+
+import argparse
+import csv
+import filecmp
+import os
+import random
+import re
+import tempfile
+import time
+from itertools import islice
+
+from find_matches import FindMatches, chunk_keys, read_chunks
+
+FIRST_NAMES = ['John', 'Jane', 'Jack', 'Josh', 'Jill', 'Vera', 'Palmer', 'Reese', 'Akeem', 'Nola']
+LAST_NAMES = ['Doe', 'Smith', 'Sandoval', 'Short', 'Franklin', 'Moody', 'Burks', 'Wynn']
+DOMAINS = ['home.com', 'morbi.co.uk', 'Donec.ca', 'elitpharetra.net', 'Ut.ca']
+
+
+def phone(rand, number):
+    """ Formats a phone number the ways the sample inputs do. """
+
+    area, prefix, line = number // 10000000, number // 10000 % 1000, number % 10000
+    style = rand.randrange(3)
+    if style == 0:
+        return '({:03d}) {:03d}-{:04d}'.format(area, prefix, line)
+    if style == 1:
+        return '1-{:03d}-{:03d}-{:04d}'.format(area, prefix, line)
+    return '{:03d}.{:03d}.{:04d}'.format(area, prefix, line)
+
+
+def generate_csv(path, rows, seed=1):
+    """ Writes rows people records where roughly a third reuse the email or phone of an earlier person. """
+
+    rand = random.Random(seed)
+    people = max(1, rows * 2 // 3)
+    with open(path, 'w') as csv_file:
+        csv_file.write('FirstName,LastName,Phone1,Phone2,Email1,Email2,Zip\n')
+        for _ in range(rows):
+            person = rand.randrange(people)
+            other = rand.randrange(people)
+            email = 'user{}@{}'.format(person, DOMAINS[person % len(DOMAINS)])
+            email2 = 'user{}@{}'.format(other, DOMAINS[other % len(DOMAINS)]) if rand.random() < 0.2 else ''
+            phone2 = phone(rand, 2000000000 + other * 7) if rand.random() < 0.5 else ''
+            csv_file.write('{},{},{},{},{},{},{:05d}\n'.format(
+                FIRST_NAMES[person % len(FIRST_NAMES)], LAST_NAMES[person % len(LAST_NAMES)],
+                phone(rand, 2000000000 + person * 7), phone2, email, email2, person % 100000))
+
+
+def time_normalization(input_file, match_columns, chunk_size=10000, max_chunks=100):
+    """ Times per-cell regex normalization against the column-oriented chunk_keys on the same (first 1M) rows. """
+
+    def per_cell(chunk):
+        keys = []
+        for row in chunk:
+            row_keys = []
+            for col, is_phone in match_columns:
+                if is_phone:
+                    row_keys.append(re.sub(r'\D+', '', row[col])[-10:])
+                else:
+                    row_keys.append(row[col].lower().strip())
+            keys.append(row_keys)
+        return keys
+
+    for name, normalize in (('per-cell', per_cell), ('columnar', lambda chunk: chunk_keys(chunk, match_columns))):
+        with open(input_file, newline='') as csv_file:
+            reader = csv.reader(csv_file)
+            next(reader)
+            chunks = list(islice(read_chunks(reader, chunk_size), max_chunks))
+        start = time.perf_counter()
+        for chunk in chunks:
+            normalize(chunk)
+        print('normalize {:<8} {:.2f}s'.format(name, time.perf_counter() - start))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=10000000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--matching-type', default='email_phone')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        input_file = os.path.join(tmp, 'input.csv')
+        start = time.perf_counter()
+        generate_csv(input_file, args.rows)
+        print('generated {} rows in {:.1f}s'.format(args.rows, time.perf_counter() - start))
+
+        time_normalization(input_file, [(4, False), (5, False), (2, True), (3, True)])
+
+        outputs = []
+        for workers in sorted({1, args.workers}):
+            output_file = os.path.join(tmp, 'output{}.csv'.format(workers))
+            start = time.perf_counter()
+            FindMatches(input_file, args.matching_type, output_file=output_file, workers=workers)
+            elapsed = time.perf_counter() - start
+            print('workers={:<3} {:.1f}s  {:,.0f} rows/s'.format(workers, elapsed, args.rows / elapsed))
+            outputs.append(output_file)
+
+        print('identical output: {}'.format(all(filecmp.cmp(outputs[0], out, shallow=False) for out in outputs)))
+
+
+if __name__ == '__main__':
+    main()
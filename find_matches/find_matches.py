@@ -1,269 +1,438 @@
+import argparse
 import csv
-import re
-import sys
+import os
+import shutil
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 
+from key_index import KeyIndex
 
-class FindMatches(object):
-    """ Takes a .csv input file and a matching type and returns a copy of the original csv with the unique identifier of the person each row represents prepended to the row.
-
-    Matching types:
-    > email
-    > phone
-    > email_phone
-    """
 
-    def __init__(self, input_file, matching_type):
-        """ Opens the csv file and declares the phone and email columns. """
+class DisjointSet(object):
+    """ Union-find over interned match keys.
 
-        # Check if matching_type input is valid
-        self.matching_type = matching_type.lower()
-        if self.matching_type not in ['email', 'phone', 'email_phone']:
-            print
-            "Please use a valid matching type: 'email', 'phone', or 'email_phone'."
+    Every distinct key gets an integer slot, so memory grows with the number of distinct keys rather than the number
+    of rows. The root of each set remembers the first row any of its keys was seen on, which becomes the cluster id.
+    """
 
-        # Initialize variables for later assignment
-        self.input_file = input_file
-        self.rownum = 0
-        self.header = None
-        self.email_col_2 = None
-        self.email_col = None
-        self.phone_col_2 = None
-        self.phone_col = None
+    def __init__(self):
+        self.slots = {}
+        self.parent = array('q')
+        self.first_row = array('q')
 
-        # Keep track of entry duplicates/key assignments via ids dictionary
-        self.ids = {}
-        self.id = 1
+    def __len__(self):
+        return len(self.parent)
 
-        # Open the file with a csv reader
-        csv_file_in = open(self.input_file, 'rU')
-        reader = csv.reader(csv_file_in)
+    def add(self, key, rownum):
+        """ Returns the slot for a key, creating a singleton set for it if the key is new. """
 
-        # Declare the header for the file
-        for row in reader:
-            if self.rownum == 0:
-                self.header = row
-                self.rownum += 1
-                break
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = len(self.parent)
+            self.slots[key] = slot
+            self.parent.append(slot)
+            self.first_row.append(rownum)
+        return slot
 
-        # Get the column number(s) for email
-        for col in range(len(self.header)):
-            if 'email2' in self.header[col].lower():
-                self.email_col_2 = col
-            if 'email1' in self.header[col].lower() or 'email' == self.header[col].lower():
-                self.email_col = col
+    def find(self, slot):
+        """ Returns the root slot of a set, halving the path on the way up. """
 
-        # Get the column number(s) for phone
-        for col in range(len(self.header)):
-            if 'phone2' in self.header[col].lower():
-                self.phone_col_2 = col
-            if 'phone1' in self.header[col].lower() or 'phone' == self.header[col].lower():
-                self.phone_col = col
+        parent = self.parent
+        while parent[slot] != slot:
+            parent[slot] = parent[parent[slot]]
+            slot = parent[slot]
+        return slot
 
-        # Write to csv after all ids are assigned
-        self.write_csv(reader, self.header)
+    def union(self, a, b):
+        """ Merges two sets and returns the surviving root. """
 
-    def email_match(self, row, min_id):
-        """ Creates email tuples and insert unique tuples into the ids dictionary. """
+        a = self.find(a)
+        b = self.find(b)
+        if a == b:
+            return a
 
-        row_id = None
+        # The root seen on the earlier row survives, so the cluster id is always its first row
+        if self.first_row[b] < self.first_row[a]:
+            a, b = b, a
+        self.parent[b] = a
+        return a
 
-        # Assigns the id value to min_id if it exists, otherwise assigns it the next id value available
-        if min_id:
-            iden = min_id
-        else:
-            iden = self.id
+    def merge(self, other, row_offset):
+        """ Folds in the sets of a shard whose row numbers start after row_offset. Returns the shard's keys in slot order. """
 
-        # Checks if a second email column exists
-        if self.email_col_2:
-            # Checks if value exists in second email column/row, and assigns it as the key
-            if row[self.email_col_2]:
-                email2 = row[self.email_col_2]
-                self.add_key_to_dict(email2, iden)
+        keys = list(other.slots)
+        slots = [self.add(key, row_offset + other.first_row[slot]) for slot, key in enumerate(keys)]
+        for slot in range(len(keys)):
+            root = other.find(slot)
+            if root != slot:
+                self.union(slots[slot], slots[root])
+        return keys
 
-                # If key exists in dictionary, assign it the row_id
-                if self.ids.get(email2):
-                    row_id = self.ids.get(email2)
+    def cluster_id(self, key):
+        """ Returns the id of the cluster a key belongs to, or None for an unseen key. """
 
-        # Checks if value exists in first email column/row, and assigns it as the key
-        if row[self.email_col]:
-            email1 = row[self.email_col]
-            # Sets the row_id to the minimum common value if it exists, otherwise sets it to the next available identifier value
-            self.add_key_to_dict(email1, iden)
-            row_id = self.ids.get(email1, self.id)
+        slot = self.slots.get(key)
+        if slot is None:
+            return None
+        return self.first_row[self.find(slot)]
 
-        # If no value in the field, sets the row_id to the next available identifier value
-        if row_id is None:
-            row_id = self.id
 
-        return row_id
+# Every byte except the ten digits and the newline used to join a column
+NON_DIGITS = bytes(b for b in range(256) if not (ord('0') <= b <= ord('9') or b == ord('\n')))
 
-    def format_phone(self, row, column):
-        """ Removes formatting of phone numbers for direct comparison. """
 
-        format_phone_col = re.sub('\D+', '', row[column])
+def format_phones(column):
+    """ Removes formatting of a whole column of phone numbers for direct comparison.
 
-        if len(format_phone_col) > 10:
-            format_phone_col[1:]
+    The column is joined and stripped of non-digits with one bytes.translate call, then split back apart. Returns
+    integer keys (None for blanks); the last 10 digits are kept to drop a leading country code, and a leading 1 is
+    prepended so numbers starting with 0 stay distinct.
+    """
 
-        return format_phone_col
+    digits = '\n'.join(column).encode('ascii', 'ignore').translate(None, NON_DIGITS).split(b'\n')
+    if len(digits) != len(column):
+        # A quoted field with a line break in it; fall back to one cell at a time
+        digits = [cell.encode('ascii', 'ignore').translate(None, NON_DIGITS + b'\n') for cell in column]
 
-    def phone_match(self, row, min_id):
-        """ Creates phone tuples and insert unique tuples into the ids dictionary. """
+    return [int(b'1' + number[-10:]) if number else None for number in digits]
 
-        row_id = None
 
-        # Assigns the id value to min_id if it exists, otherwise assigns it the next id value available
-        if min_id:
-            iden = min_id
-        else:
-            iden = self.id
+def format_emails(column):
+    """ Lowercases and trims a whole column of emails. Returns string keys (None for blanks). """
 
-        # Checks if a second phone column exists
-        if self.phone_col_2:
-            # Checks if value exists in second phone column/row, and assigns it as the key
-            if row[self.phone_col_2]:
-                ids_key = self.format_phone(row, self.phone_col_2)
-                self.add_key_to_dict(ids_key, iden)
+    emails = '\n'.join(column).lower().split('\n')
+    if len(emails) != len(column):
+        emails = [cell.lower() for cell in column]
 
-                # If key exists in dictionary, assign it the row_id
-                if self.ids.get(ids_key):
-                    row_id = self.ids.get(ids_key)
+    return [email.strip() or None for email in emails]
 
-        if row[self.phone_col]:
-            ids_key = self.format_phone(row, self.phone_col)
-            # Sets the row_id to the minimum common value if it exists, otherwise sets it to the next available identifier value
-            self.add_key_to_dict(ids_key, iden)
-            row_id = self.ids.get(ids_key, self.id)
 
-        # If no value in the field, sets the row_id to the next available identifier value
-        if row_id is None:
-            row_id = self.id
+def chunk_keys(chunk, match_columns):
+    """ Normalizes the matching columns of a chunk column by column. Returns one tuple of keys per row.
 
-        return row_id
+    Phones become ints and emails stay strings, so the two kinds of key never collide. Missing keys are None.
+    """
 
-    def add_key_to_dict(self, ids_key, iden):
-        """ Places keys into a dictionary. If the key exists the key-value pair does not change. Otherwise, place it in the dictionary and assign it a new id. """
+    columns = []
+    for col, is_phone in match_columns:
+        try:
+            column = [row[col] for row in chunk]
+        except IndexError:
+            column = [row[col] if col < len(row) else '' for row in chunk]
+        columns.append(format_phones(column) if is_phone else format_emails(column))
+
+    if not columns:
+        return [()] * len(chunk)
+    return list(zip(*columns))
+
+
+def line_start(csv_file, offset):
+    """ Returns the offset of the first line starting at or after offset. Handles \\n, \\r and \\r\\n endings. """
+
+    if offset == 0:
+        return 0
+
+    # Look one byte back so an offset that already sits on a line start stays put
+    csv_file.seek(offset - 1)
+    while True:
+        block = csv_file.read(1 << 16)
+        if not block:
+            return csv_file.tell()
+        ends = [pos for pos in (block.find(b'\n'), block.find(b'\r')) if pos != -1]
+        if ends:
+            pos = min(ends)
+            end = offset + pos
+            if block[pos:pos + 2] == b'\r\n':
+                end += 1
+            elif pos == len(block) - 1 and block[pos:] == b'\r':
+                # A \r at the block edge may be the first half of \r\n
+                csv_file.seek(end)
+                if csv_file.read(1) == b'\n':
+                    end += 1
+            return end
+        offset += len(block)
+
+
+def split_shards(input_file, workers):
+    """ Splits the data rows of a csv into byte ranges that start and end on line boundaries. """
+
+    size = os.path.getsize(input_file)
+    with open(input_file, 'rb') as csv_file:
+        data_start = line_start(csv_file, 1)
+        bounds = [data_start]
+        for i in range(1, workers):
+            bounds.append(max(bounds[-1], line_start(csv_file, data_start + (size - data_start) * i // workers)))
+        bounds.append(size)
+    return [(bounds[i], bounds[i + 1]) for i in range(workers) if bounds[i] < bounds[i + 1]]
+
+
+def shard_lines(input_file, start, end, block_size=1 << 20):
+    """ Yields the decoded lines of the byte range [start, end) without reading the range into memory at once. """
+
+    with open(input_file, 'rb') as csv_file:
+        csv_file.seek(start)
+        remaining = end - start
+        carry = b''
+        while remaining > 0:
+            block = csv_file.read(min(block_size, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            lines = (carry + block).splitlines(True)
+
+            # Hold back the last line in case it (or its \r\n) continues in the next block
+            carry = lines.pop()
+            for line in lines:
+                yield line.decode('utf-8')
+        if carry:
+            yield carry.decode('utf-8')
+
+
+def read_chunks(reader, chunk_size):
+    """ Yields lists of up to chunk_size rows so no pass holds the whole file. """
+
+    while True:
+        chunk = list(islice(reader, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def cluster_shard(input_file, start, end, match_columns, chunk_size, row_offset=0):
+    """ Unions all keys that appear on the same row of a shard. Row numbers start after row_offset. """
+
+    keys = DisjointSet()
+    rownum = row_offset
+    for chunk in read_chunks(csv.reader(shard_lines(input_file, start, end)), chunk_size):
+        for row_keys in chunk_keys(chunk, match_columns):
+            rownum += 1
+            first = None
+            for key in row_keys:
+                if key is None:
+                    continue
+                slot = keys.add(key, rownum)
+                if first is None:
+                    first = slot
+                else:
+                    keys.union(first, slot)
+    return rownum - row_offset, keys
 
-        self.ids[ids_key] = self.ids.get(ids_key, iden)
 
-    def write_csv(self, reader, header, row_is_header=True):
-        """ Using a csv writer, creates a copy of the file with unique ids prepended to each row. """
+def write_shard(input_file, start, end, match_columns, chunk_size, row_offset, cluster_id, csv_file_out):
+    """ Writes the rows of a shard with their cluster id prepended. cluster_id maps a key to its final id. """
 
-        csv_file_out = open('output_file.csv', 'w')
-        writer = csv.writer(csv_file_out)
+    writer = csv.writer(csv_file_out)
+    rownum = row_offset
+    for chunk in read_chunks(csv.reader(shard_lines(input_file, start, end)), chunk_size):
+        new_rows = []
+        for row, row_keys in zip(chunk, chunk_keys(chunk, match_columns)):
+            rownum += 1
+            key = next((key for key in row_keys if key is not None), None)
 
-        while row_is_header:
-            # Add 'id' column to header
-            header = ['id'] + self.header
+            # Rows without any key are a person of their own
+            row_id = rownum if key is None else cluster_id(key)
+            new_rows.append([row_id] + row)
 
-            # Write header row to new file
-            writer.writerow(header)
+        writer.writerows(new_rows)
 
-            row_is_header = False
 
-        # Runs matching type tests based on match type given
-        for row in reader:
-            row_id = None
-            email_row_id = None
-            phone_row_id = None
+def _cluster_shard_task(args):
+    return cluster_shard(*args)
 
-            # If the matching type is 'email'
-            if self.matching_type == 'email':
-                email2 = None
-                email1 = None
-                min_id = None
 
-                # Check if email columns exist
-                if self.email_col_2:
-                    email2 = row[self.email_col_2]
-                if self.email_col:
-                    email1 = row[self.email_col]
+def _write_shard_task(args):
+    input_file, start, end, match_columns, chunk_size, row_offset, ids, part_file = args
+    with open(part_file, 'w', newline='') as csv_file_out:
+        write_shard(input_file, start, end, match_columns, chunk_size, row_offset, ids.get, csv_file_out)
+    return part_file
 
-                # Check if either email is in ids dictionary, get the value
-                if email2 in self.ids or email1 in self.ids:
-                    email2_exists = self.ids.get(email2)
-                    email_exists = self.ids.get(email1)
 
-                    # If multiple values exist, find the lowest and set that to min_id (row_id)
-                    id_values = [email2_exists, email_exists]
-                    min_id = min(iden for iden in id_values if iden is not None)
+class FindMatches(object):
+    """ Takes a .csv input file and a matching type and returns a copy of the original csv with the unique identifier of the person each row represents prepended to the row.
 
-                # See if a second email column exists
-                row_id = self.email_match(row, min_id)
+    Rows sharing any matching key end up in the same cluster, including transitive matches (a row whose email matches
+    one person and whose phone matches another merges both). The id of a cluster is the number of its first row.
 
+    With workers > 1 the data rows are split into byte ranges that are clustered in a process pool. The per-shard key
+    tables are merged in shard order, so the output is identical to a single-process run. Byte-range splitting assumes
+    quoted fields do not contain line breaks.
 
+    With an index_file the key clusters are kept in a KeyIndex between runs. Each run is then a delta: its rows are
+    numbered after all previously processed rows, and rows matching stored keys get the stored cluster ids.
 
-            # If the matching type is 'phone'
-            elif self.matching_type == 'phone':
+    Matching types:
+    > email
+    > phone
+    > email_phone
+    """
 
-                phone2 = None
-                phone1 = None
-                min_id = None
+    MATCHING_TYPES = ('email', 'phone', 'email_phone')
 
-                # Check if phone columns exist
-                if self.phone_col_2:
-                    phone2 = self.format_phone(row, self.phone_col_2)
-                if self.phone_col:
-                    phone1 = self.format_phone(row, self.phone_col)
+    def __init__(self, input_file, matching_type, output_file='output_file.csv', chunk_size=10000, workers=1,
+                 index_file=None):
+        """ Reads the header, clusters every row by its keys, then writes the csv with the final ids. """
 
-                # Check if either email is in ids dictionary, get the value
-                if phone2 in self.ids or phone1 in self.ids:
-                    phone2_exists = self.ids.get(phone2)
-                    phone_exists = self.ids.get(phone1)
-
-                    # If multiple values exist, find the lowest and set that to min_id (row_id)
-                    id_values = [phone2_exists, phone_exists]
-                    min_id = min(iden for iden in id_values if iden is not None)
-
-                # See if a second phone column exists
-                row_id = self.phone_match(row, min_id)
+        # Check if matching_type input is valid
+        self.matching_type = matching_type.lower()
+        if self.matching_type not in self.MATCHING_TYPES:
+            raise ValueError("Please use a valid matching type: 'email', 'phone', or 'email_phone'.")
 
+        # Initialize variables for later assignment
+        self.input_file = input_file
+        self.output_file = output_file
+        self.chunk_size = chunk_size
+        self.workers = max(1, workers)
+        self.header = None
+        self.email_col_2 = None
+        self.email_col = None
+        self.phone_col_2 = None
+        self.phone_col = None
+        self.match_columns = []
 
-            # If the matching type is email OR phone
-            elif self.matching_type == 'email_phone':
-
-                email2 = None
-                email1 = None
-                phone2 = None
-                phone1 = None
-                min_id = None
+        # Keep track of key clusters, bounded by the number of distinct keys
+        self.keys = DisjointSet()
 
-                # Check if email and phone columns exist
-                if self.email_col_2:
-                    email2 = row[self.email_col_2]
-                if self.email_col:
-                    email1 = row[self.email_col]
-                if self.phone_col_2:
-                    phone2 = self.format_phone(row, self.phone_col_2)
-                if self.phone_col:
-                    phone1 = self.format_phone(row, self.phone_col)
+        # Rows of a delta are numbered after the rows of earlier runs
+        self.index = KeyIndex(index_file, self.matching_type) if index_file else None
+        self.row_offset = self.index.rows if self.index else 0
 
-                # Check if either email or phone is in ids dictionary, get the value
-                if email2 in self.ids or email1 in self.ids or phone2 in self.ids or phone1 in self.ids:
-                    email2_exists = self.ids.get(email2)
-                    email_exists = self.ids.get(email1)
-                    phone2_exists = self.ids.get(phone2)
-                    phone_exists = self.ids.get(phone1)
+        with open(self.input_file, newline='') as csv_file_in:
+            self.header = next(csv.reader(csv_file_in), [])
+        self.find_columns()
 
-                    # If multiple values exist, find the lowest and set that to min_id (row_id)
-                    id_values = [email2_exists, email_exists, phone2_exists, phone_exists]
-                    min_id = min(iden for iden in id_values if iden is not None)
-                    row_id = min_id
-
-                email_row_id = self.email_match(row, min_id)
-                phone_row_id = self.phone_match(row, min_id)
-
-                if email_row_id < phone_row_id:
-                    row_id = email_row_id
-                else:
-                    row_id = phone_row_id
+        shards = split_shards(self.input_file, self.workers)
+        try:
+            if self.workers == 1:
+                rows = self.run(shards)
+            else:
+                rows = self.run_sharded(shards)
+            self.save_index(rows)
+        finally:
+            if self.index:
+                self.index.close()
 
-            # Writes a new row with the id appended
-            new_row = [row_id] + row
-            writer.writerow(new_row)
+    def find_columns(self):
+        """ Declares the phone and email columns used by the matching type. """
 
-            # Increments id in ids dictionary for unique row ids
-            self.id += 1
+        # Get the column number(s) for email
+        for col in range(len(self.header)):
+            if 'email2' in self.header[col].lower():
+                self.email_col_2 = col
+            if 'email1' in self.header[col].lower() or 'email' == self.header[col].lower():
+                self.email_col = col
 
+        # Get the column number(s) for phone
+        for col in range(len(self.header)):
+            if 'phone2' in self.header[col].lower():
+                self.phone_col_2 = col
+            if 'phone1' in self.header[col].lower() or 'phone' == self.header[col].lower():
+                self.phone_col = col
 
-FindMatches(input_file=sys.argv[1], matching_type=sys.argv[2])
+        if self.matching_type in ('email', 'email_phone'):
+            self.match_columns += [(col, False) for col in (self.email_col, self.email_col_2) if col is not None]
+        if self.matching_type in ('phone', 'email_phone'):
+            self.match_columns += [(col, True) for col in (self.phone_col, self.phone_col_2) if col is not None]
+
+    def write_header(self, csv_file_out):
+        """ Writes the header with an 'id' column added. """
+
+        csv.writer(csv_file_out).writerow(['id'] + self.header)
+
+    def link_index(self):
+        """ Joins clusters to the stored clusters their keys already belong to.
+
+        A stored cluster enters the DisjointSet as a ('cluster', id) pseudo-key whose first row is its id. Stored ids
+        are always lower than the row numbers of this run, so a cluster touching stored keys takes the lowest stored id.
+        """
+
+        if self.index is None:
+            return
+
+        for key, cluster in self.index.lookup(list(self.keys.slots)):
+            self.keys.union(self.keys.slots[key], self.keys.add(('cluster', cluster), cluster))
+
+    def save_index(self, rows):
+        """ Stores this run's keys and any stored clusters it merged. """
+
+        if self.index is None:
+            return
+
+        keys = []
+        merged = []
+        for key in self.keys.slots:
+            cluster_id = self.keys.cluster_id(key)
+            if type(key) is not tuple:
+                keys.append((key, cluster_id))
+            elif cluster_id != key[1]:
+                merged.append((key[1], cluster_id))
+        self.index.save(keys, merged, rows)
+
+    def run(self, shards):
+        """ Clusters and writes the whole file in this process. Returns the number of data rows. """
+
+        rows = 0
+        with open(self.output_file, 'w', newline='') as csv_file_out:
+            self.write_header(csv_file_out)
+            if not shards:
+                return rows
+
+            start, end = shards[0]
+            rows, self.keys = cluster_shard(self.input_file, start, end, self.match_columns, self.chunk_size,
+                                            self.row_offset)
+            self.link_index()
+            write_shard(self.input_file, start, end, self.match_columns, self.chunk_size, self.row_offset,
+                        self.keys.cluster_id, csv_file_out)
+        return rows
+
+    def run_sharded(self, shards):
+        """ Clusters and writes shards in a process pool, merging the key tables in between. Returns the number of data rows. """
+
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            # First pass: cluster each shard locally, then merge the tables in shard order
+            offsets = []
+            shard_keys = []
+            row_offset = self.row_offset
+            tasks = [(self.input_file, start, end, self.match_columns, self.chunk_size) for start, end in shards]
+            for rows, keys in pool.map(_cluster_shard_task, tasks):
+                offsets.append(row_offset)
+                shard_keys.append(self.keys.merge(keys, row_offset))
+                row_offset += rows
+            self.link_index()
+
+            # Second pass: each shard only needs the final ids of its own keys
+            tasks = []
+            for i, (start, end) in enumerate(shards):
+                ids = {key: self.keys.cluster_id(key) for key in shard_keys[i]}
+                shard_keys[i] = None
+                part_file = '{}.part{}'.format(self.output_file, i)
+                tasks.append((self.input_file, start, end, self.match_columns, self.chunk_size, offsets[i], ids,
+                              part_file))
+            part_files = list(pool.map(_write_shard_task, tasks))
+
+        with open(self.output_file, 'w', newline='') as csv_file_out:
+            self.write_header(csv_file_out)
+            for part_file in part_files:
+                with open(part_file, newline='') as part:
+                    shutil.copyfileobj(part, csv_file_out)
+                os.remove(part_file)
+
+        return row_offset - self.row_offset
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prepends a person id to every row of a csv file.')
+    parser.add_argument('input_file')
+    parser.add_argument('matching_type', choices=FindMatches.MATCHING_TYPES)
+    parser.add_argument('--output', default='output_file.csv')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    parser.add_argument('--index', help='key index file to resolve this file as a delta of earlier runs')
+    args = parser.parse_args()
+
+    FindMatches(input_file=args.input_file, matching_type=args.matching_type, output_file=args.output,
+                chunk_size=args.chunk_size, workers=args.workers, index_file=args.index)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import sqlite3
+
+
+class KeyIndex(object):
+    """ SQLite-backed key -> cluster index shared by successive FindMatches runs.
+
+    keys maps every normalized key ever seen to the cluster id it was first stored with. When a later delta links two
+    stored clusters, the newer one gets a parent pointer in clusters instead of rewriting its keys, so a run only
+    touches the rows of its own keys. meta holds the number of rows processed so far, which is where the row numbers
+    (and so the new cluster ids) of the next delta start.
+    """
+
+    BATCH = 500
+
+    def __init__(self, path, matching_type):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS keys (key PRIMARY KEY, cluster INTEGER NOT NULL) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS clusters (id INTEGER PRIMARY KEY, parent INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value);
+        ''')
+        self.roots = {}
+
+        stored_type = self.get_meta('matching_type')
+        if stored_type is None:
+            with self.connection:
+                self.set_meta('matching_type', matching_type)
+        elif stored_type != matching_type:
+            self.connection.close()
+            raise ValueError("Index {} was built for matching type '{}', not '{}'.".format(path, stored_type,
+                                                                                          matching_type))
+
+    @property
+    def rows(self):
+        """ Number of rows processed by all previous runs. """
+
+        return self.get_meta('rows') or 0
+
+    def get_meta(self, name):
+        row = self.connection.execute('SELECT value FROM meta WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, name, value):
+        self.connection.execute('INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)', (name, value))
+
+    def root(self, cluster):
+        """ Follows parent pointers to the cluster id a stored cluster was merged into. """
+
+        path = []
+        while cluster not in self.roots:
+            row = self.connection.execute('SELECT parent FROM clusters WHERE id = ?', (cluster,)).fetchone()
+            if row is None:
+                self.roots[cluster] = cluster
+                break
+            path.append(cluster)
+            cluster = row[0]
+
+        root = self.roots[cluster]
+        for cluster in path:
+            self.roots[cluster] = root
+        return root
+
+    def lookup(self, keys):
+        """ Yields (key, root cluster id) for every given key that is already in the index. """
+
+        keys = list(keys)
+        for i in range(0, len(keys), self.BATCH):
+            batch = keys[i:i + self.BATCH]
+            query = 'SELECT key, cluster FROM keys WHERE key IN ({})'.format(','.join('?' * len(batch)))
+            for key, cluster in self.connection.execute(query, batch):
+                yield key, self.root(cluster)
+
+    def save(self, key_clusters, merged_clusters, rows):
+        """ Stores new keys, records merged clusters and advances the row count, all in one transaction.
+
+        key_clusters is an iterable of (key, cluster id); keys already in the index keep their stored cluster.
+        merged_clusters is an iterable of (stored cluster id, cluster id it now belongs to).
+        """
+
+        with self.connection:
+            self.connection.executemany('INSERT OR IGNORE INTO keys (key, cluster) VALUES (?, ?)', key_clusters)
+            self.connection.executemany('INSERT OR REPLACE INTO clusters (id, parent) VALUES (?, ?)',
+                                        merged_clusters)
+            self.set_meta('rows', self.rows + rows)
+        self.roots.clear()
+
+    def close(self):
+        self.connection.close()
@@ -1,7 +1,111 @@
+import argparse
+import asyncio
 import json
+import random
+import threading
+import time
+import unittest
+from collections import Counter
+from io import StringIO
+
+
+STOP_WORDS = frozenset(['and', 'or', 'not', 'but', 'to', 'in'])
+
+
+class RetryImmediatelyError(Exception):
+    """ Raised by a DocumentService when the request should simply be sent again. """
+
+
+def tokenize(text):
+    """ Lowercases and splits document data, dropping stop words in one linear pass. """
+
+    return [word for word in text.lower().split(' ') if word not in STOP_WORDS]
+
+
+class DocumentStore(object):
+    """
+    ETL sink holding the documents and an inverted index over their words.
+
+    postings maps a term to {doc id: occurrences}. add/update/delete touch
+    only the terms of the documents involved, so each event costs O(doc
+    length). If `changes` is a text stream, every add/update/delete is
+    also written to it as one JSON line the moment it is applied.
+    """
+
+    def __init__(self, changes=None):
+        self.docs = {}
+        self.postings = {}
+        self.error_count = 0
+        self.changes = changes
+
+    def _index(self, doc_id, words):
+        for word, count in Counter(words).items():
+            self.postings.setdefault(word, {})[doc_id] = count
+
+    def _unindex(self, doc_id, words):
+        for word in set(words):
+            postings = self.postings[word]
+            del postings[doc_id]
+            if not postings:
+                del self.postings[word]
+
+    def put(self, doc_id, words, operation='add'):
+        """ Adds a document, or replaces the words of an existing one. """
+
+        old_words = self.docs.get(doc_id)
+        if old_words is not None:
+            self._unindex(doc_id, old_words)
+        self.docs[doc_id] = words
+        self._index(doc_id, words)
+        self._emit({'op': operation, 'id': doc_id, 'words': words})
+
+    def delete(self, doc_id):
+        """ Removes a document and its postings. """
+
+        words = self.docs.pop(doc_id, None)
+        if words is not None:
+            self._unindex(doc_id, words)
+        self._emit({'op': 'delete', 'id': doc_id})
+
+    def search(self, *terms):
+        """ Returns the ids of the documents containing every term. """
+
+        postings = sorted((self.postings.get(term.lower(), {}) for term in terms), key=len)
+        if not postings:
+            return set()
+        found = set(postings[0])
+        for other in postings[1:]:
+            found.intersection_update(other)
+        return found
+
+    def _emit(self, change):
+        if self.changes is not None:
+            self.changes.write(json.dumps(change))
+            self.changes.write('\n')
+
+    def as_dict(self):
+        return {
+            'doc-count': len(self.docs),
+            'error-count': self.error_count,
+            'docs': self.docs
+        }
+
+    def write_json(self, stream):
+        """ Writes the same text as json.dumps(self.as_dict()) one document at a time. """
+
+        stream.write('{{"doc-count": {}, "error-count": {}, "docs": {{'.format(len(self.docs), self.error_count))
+        separator = ''
+        for doc_id, words in self.docs.items():
+            stream.write('{}{}: {}'.format(separator, json.dumps(doc_id), json.dumps(words)))
+            separator = ', '
+        stream.write('}}')
 
 
 class ETLClient:
+    def __init__(self, changes=None):
+        self.changes = changes
+        self.store = None
+
     def run(self, service, max_requests):
         """
         Handle max_requests calls to the given DocumentService.
@@ -57,13 +161,7 @@ class ETLClient:
         Delete the document that matches that ID.
         See test_req_7
         """
-        documents = []
-
-        documents.append({
-            'doc-count': 0,
-            'error-count': 0,
-            'docs': {}
-        })
+        self.store = DocumentStore(self.changes)
 
         for i in range(0, max_requests):
 
@@ -71,62 +169,271 @@ class ETLClient:
 
                 try:
                     event = service.handle_request()
+                    self.apply_event(self.store, event)
 
-                    if event['operation'] == 'add':
-                        # 'add': service sends us:
-                        # {'operation':'add','document':{'data':'<words>','id':'<doc-id>'}}
-                        doc_id = event['document']['id']
-                        doc_data = self.remove_words(event['document']['data'])
+                except RetryImmediatelyError:
+                    # counts number of retry errors
+                    self.store.error_count += 1
+                    continue
 
-                        # adds new doc_id and data
-                        documents[0]['docs'][doc_id] = doc_data
+                break
 
-                        # counts number of documents
-                        documents[0]['doc-count'] = documents[0].get('doc-count') + 1
+        return json.dumps(self.store.as_dict())
 
-                    if event['operation'] == 'update':
-                        doc_id = event['document']['id']
-                        doc_data = self.remove_words(event['document']['data'])
+    def apply_event(self, store, event):
+        """ Applies one add/update/delete event to the document store. """
 
-                        # updates doc data by on doc id
-                        documents[0]['docs'][doc_id] = doc_data
+        if event['operation'] in ('add', 'update'):
+            # 'add': service sends us:
+            # {'operation':'add','document':{'data':'<words>','id':'<doc-id>'}}
+            doc_id = event['document']['id']
+            store.put(doc_id, self.remove_words(event['document']['data']), event['operation'])
 
-                    if event['operation'] == 'delete':
-                        # removes document
-                        doc_id = event['document-id']
-                        docs = documents[0]['docs']
-                        for docid, data in docs.items():
-                            if docid == doc_id:
-                                del docs[docid]
+        if event['operation'] == 'delete':
+            store.delete(event['document-id'])
 
-                        # subtracts 1 from number of documents
-                        documents[0]['doc-count'] = documents[0].get('doc-count') - 1
+    def remove_words(self, string):
+        # sanitizes string data in documents
 
-                except RetryImmediatelyError:
-                    # counts number of retry errors
-                    documents[0]['error-count'] = documents[0].get('error-count') + 1
-                    continue
+        return tokenize(string)
 
-                break
 
-        return json.dumps(documents[0])
+class AsyncETLClient(ETLClient):
+    """
+    ETL client that keeps up to `concurrency` requests in flight.
 
-    def remove_words(self, string):
-        # sanitizes string data in documents
+    Fetchers issue requests concurrently and push each event onto a queue
+    as it arrives; a single sequencing stage applies the events in that
+    arrival order, so adds, updates and deletes never race each other.
+    RetryImmediatelyError is retried after a jittered exponential backoff
+    (base * 2 ** attempt, capped, with `jitter` of it randomized) and still
+    does not count as a request.
 
-        remove_words = set(['and', 'or', 'not', 'but', 'to', 'in'])
-        words = string.lower().split(' ')
+    A service may provide a coroutine handle_request_async(); otherwise its
+    blocking handle_request() is run in a worker thread. Those calls are
+    serialized with a lock unless the service sets `thread_safe = True`.
+    """
 
-        for word in words:
-            if word in remove_words:
-                words.remove(word)
+    def __init__(self, concurrency=8, backoff_base=0.001, backoff_cap=0.1, jitter=1.0, seed=None, changes=None):
+        super().__init__(changes)
+        self.concurrency = concurrency
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.sync_lock = None
 
-        return words
+    def run(self, service, max_requests):
+        """ Same contract as ETLClient.run, returning the JSON string. """
+
+        return asyncio.run(self.run_async(service, max_requests))
+
+    def backoff(self, attempt):
+        """ Seconds to wait before retry number `attempt` (0-based). """
+
+        delay = min(self.backoff_cap, self.backoff_base * 2 ** attempt)
+        return delay * (1 - self.jitter * self.random.random())
+
+    async def request(self, service, store):
+        """ Sends one request, retrying with backoff until the service returns an event. """
+
+        attempt = 0
+        while True:
+            try:
+                if hasattr(service, 'handle_request_async'):
+                    return await service.handle_request_async()
+                if getattr(service, 'thread_safe', False):
+                    return await asyncio.to_thread(service.handle_request)
+                async with self.sync_lock:
+                    return await asyncio.to_thread(service.handle_request)
+            except RetryImmediatelyError:
+                store.error_count += 1
+                await asyncio.sleep(self.backoff(attempt))
+                attempt += 1
+
+    async def run_async(self, service, max_requests):
+        self.store = DocumentStore(self.changes)
+        self.sync_lock = asyncio.Lock()
+        events = asyncio.Queue()
+        issued = 0
+
+        async def fetch():
+            nonlocal issued
+            while issued < max_requests:
+                issued += 1
+                await events.put(await self.request(service, self.store))
+
+        async def sequence():
+            for _ in range(max_requests):
+                self.apply_event(self.store, await events.get())
+
+        fetchers = [asyncio.ensure_future(fetch()) for _ in range(min(self.concurrency, max_requests))]
+        await asyncio.gather(sequence(), *fetchers)
+
+        return json.dumps(self.store.as_dict())
+
+
+class FakeDocumentService(object):
+    """
+    Local document service for tests and benchmarks.
+
+    Each call waits `latency` seconds (plus up to `latency_jitter`), then
+    fails with RetryImmediatelyError with probability `error_rate` or hands
+    out the next event of a seeded add/update/delete stream. Events are
+    handed out when a call completes, so the stream, and therefore the
+    final documents, are the same for sync and async clients. Only the
+    wait runs outside the lock, so handle_request() is thread-safe.
+    """
+
+    thread_safe = True
+
+    WORDS = ('lorem ipsum dolor sit amet and consectetur adipiscing elit or sed do eiusmod tempor not incididunt '
+             'ut labore but et dolore magna to aliqua in').split()
+
+    def __init__(self, seed=0, latency=0.0, latency_jitter=0.0, error_rate=0.0, doc_words=12):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.doc_words = doc_words
+        self.events = random.Random(seed)
+        self.errors = random.Random(seed + 1)
+        self.delays = random.Random(seed + 2)
+        self.live = []
+        self.next_id = 0
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def delay(self):
+        with self.lock:
+            return self.latency + self.latency_jitter * self.delays.random()
+
+    def handle_request(self):
+        time.sleep(self.delay())
+        with self.lock:
+            return self.respond()
+
+    async def handle_request_async(self):
+        await asyncio.sleep(self.delay())
+        return self.respond()
+
+    def respond(self):
+        self.calls += 1
+        if self.errors.random() < self.error_rate:
+            raise RetryImmediatelyError()
+        return self.next_event()
+
+    def next_event(self):
+        roll = self.events.random()
+        if not self.live or roll < 0.6:
+            doc_id = '{:032x}'.format(self.next_id)
+            self.next_id += 1
+            self.live.append(doc_id)
+            return {'operation': 'add', 'document': {'id': doc_id, 'data': self.text()}}
+        index = self.events.randrange(len(self.live))
+        if roll < 0.85:
+            return {'operation': 'update', 'document': {'id': self.live[index], 'data': self.text()}}
+        doc_id = self.live[index]
+        self.live[index] = self.live[-1]
+        self.live.pop()
+        return {'operation': 'delete', 'document-id': doc_id}
+
+    def text(self):
+        return ' '.join(self.events.choice(self.WORDS) for _ in range(self.doc_words))
+
+
+def benchmark(requests=2000, latency=0.002, error_rate=0.05, concurrencies=(1, 4, 16, 64)):
+    """ Prints requests/sec of the sync client and the async client at each concurrency. """
+
+    expected = json.loads(ETLClient().run(FakeDocumentService(latency=0, error_rate=error_rate), requests))
+    start = time.perf_counter()
+    ETLClient().run(FakeDocumentService(latency=latency, error_rate=error_rate), requests)
+    print('sync            {:8.0f} req/s'.format(requests / (time.perf_counter() - start)))
+
+    for concurrency in concurrencies:
+        service = FakeDocumentService(latency=latency, error_rate=error_rate)
+        start = time.perf_counter()
+        result = json.loads(AsyncETLClient(concurrency, backoff_base=latency, seed=0).run(service, requests))
+        elapsed = time.perf_counter() - start
+        print('async K={:<4}    {:8.0f} req/s  same docs: {}'.format(concurrency, requests / elapsed,
+                                                                    result == expected))
+
+
+class FakeServiceTest(unittest.TestCase):
+    def test_async_matches_sync(self):
+        expected = ETLClient().run(FakeDocumentService(seed=3, error_rate=0.2), 300)
+        for concurrency in (1, 7, 50):
+            service = FakeDocumentService(seed=3, latency=0.001, latency_jitter=0.002, error_rate=0.2)
+            client = AsyncETLClient(concurrency, backoff_base=0.0001, backoff_cap=0.001, seed=1)
+            self.assertEqual(json.loads(client.run(service, 300)), json.loads(expected))
+
+    def test_concurrency_overlaps_latency(self):
+        start = time.perf_counter()
+        AsyncETLClient(50).run(FakeDocumentService(latency=0.02), 100)
+        self.assertLess(time.perf_counter() - start, 0.02 * 100 / 5)
+
+    def test_sync_services_are_serialized_unless_thread_safe(self):
+        class SyncService(object):
+            def __init__(self):
+                self.service = FakeDocumentService(seed=3, latency=0.002)
+                self.active = self.most_active = 0
+
+            def handle_request(self):
+                self.active += 1
+                self.most_active = max(self.most_active, self.active)
+                try:
+                    return self.service.handle_request()
+                finally:
+                    self.active -= 1
+
+        expected = json.loads(ETLClient().run(FakeDocumentService(seed=3), 40))
+        service = SyncService()
+        self.assertEqual(json.loads(AsyncETLClient(8).run(service, 40)), expected)
+        self.assertEqual(service.most_active, 1)
+
+        service.thread_safe = True
+        start = time.perf_counter()
+        AsyncETLClient(8).run(service, 40)
+        self.assertLess(time.perf_counter() - start, 0.002 * 40 / 2)
+
+    def test_backoff_is_capped_and_jittered(self):
+        client = AsyncETLClient(backoff_base=0.01, backoff_cap=0.05, jitter=0.5, seed=0)
+        delays = [client.backoff(attempt) for attempt in range(10)]
+        self.assertTrue(all(0.005 <= delay <= 0.01 for delay in delays[:1]))
+        self.assertTrue(all(0.025 <= delay <= 0.05 for delay in delays[3:]))
+
+
+class DocumentStoreTest(unittest.TestCase):
+    def test_tokenize_drops_adjacent_stop_words(self):
+        self.assertEqual(tokenize('Salt AND or Pepper to In taste'), ['salt', 'pepper', 'taste'])
+
+    def test_index_follows_updates_and_deletes(self):
+        changes = StringIO()
+        store = DocumentStore(changes)
+        store.put('a', tokenize('red green red'))
+        store.put('b', tokenize('green blue'))
+        self.assertEqual(store.search('green'), {'a', 'b'})
+        self.assertEqual(store.postings['red'], {'a': 2})
+
+        store.put('a', tokenize('blue'), 'update')
+        self.assertNotIn('red', store.postings)
+        self.assertEqual(store.search('blue', 'green'), {'b'})
+
+        store.delete('b')
+        self.assertEqual(store.postings, {'blue': {'a': 1}})
+        self.assertEqual([json.loads(line)['op'] for line in changes.getvalue().splitlines()],
+                         ['add', 'add', 'update', 'delete'])
+
+    def test_write_json_matches_dumps(self):
+        client = ETLClient()
+        client.run(FakeDocumentService(seed=5, error_rate=0.1), 200)
+        out = StringIO()
+        client.store.write_json(out)
+        self.assertEqual(out.getvalue(), json.dumps(client.store.as_dict()))
 
 
 class Test(unittest.TestCase):
     def test_req_1(self):
-        self.assertIsInstance(ETLClient().run(DocumentService(2), 1), basestring)
+        self.assertIsInstance(ETLClient().run(DocumentService(2), 1), str)
 
     def test_req_2(self):
         r = ETLClient().run(DocumentService(2), 2)
@@ -237,3 +544,12 @@ class Test(unittest.TestCase):
             }
         })
         self.assertIn(self._ordered(r), self._ordered(expect))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks the sync and async ETL clients against a fake service.')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.002)
+    parser.add_argument('--error-rate', type=float, default=0.05)
+    args = parser.parse_args()
+    benchmark(args.requests, args.latency, args.error_rate)
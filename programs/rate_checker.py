@@ -1,35 +1,160 @@
-""" Create a rate checker which takes actions, for number of occurrences, and seconds, for time in which those actions have occurred. Using a check method return True if it is called at least N times (actions) in up to Q seconds. Otherwise, return False. """
+""" Create a rate checker which takes actions, for number of occurrences, and seconds, for time in which those actions have occurred. Using a check method return True while it has been called fewer than N times (actions) in the last Q seconds. Otherwise, return False.
 
-import datetime
+Two window policies are available:
+> SlidingLog keeps the times of the last N accepted calls in a ring buffer and is exact.
+> SlidingWindowCounter keeps two counters per key, the current and previous fixed windows, weighting the previous one by how much of it still overlaps the sliding window. It is approximate but uses O(1) memory per key.
 
+KeyedRateChecker tracks many clients in one instance and evicts keys that have been idle long enough to carry no state.
+"""
 
-class RateChecker(object):
+import time
+from collections import OrderedDict, deque
+
+
+class SlidingLog(object):
+    """ Exact sliding window over the last `actions` accepted calls. """
 
     def __init__(self, actions, seconds):
         self.actions = actions
         self.seconds = seconds
-        self.times = []  # Queue needed to keep track of how many times it's being checked
+
+    def new_state(self):
+        return deque(maxlen=self.actions)  # Ring buffer: appending to a full deque drops the oldest time
+
+    def allow(self, times, now):
+        # Only the oldest of the last N accepted calls can still make the window full
+        if len(times) == self.actions and now - times[0] < self.seconds:
+            return False
+        times.append(now)
+        return True
+
+
+class SlidingWindowCounter(object):
+    """ Approximate sliding window from the counts of the current and previous fixed windows. """
+
+    def __init__(self, actions, seconds):
+        self.actions = actions
+        self.seconds = seconds
+
+    def new_state(self):
+        return [0, 0, 0]  # Window number, previous window count, current window count
+
+    def allow(self, state, now):
+        window = int(now // self.seconds)
+        if window != state[0]:
+            state[1] = state[2] if window == state[0] + 1 else 0
+            state[2] = 0
+            state[0] = window
+
+        overlap = 1 - (now - window * self.seconds) / self.seconds
+        if state[1] * overlap + state[2] >= self.actions:
+            return False
+        state[2] += 1
+        return True
+
+
+POLICIES = {'log': SlidingLog, 'counter': SlidingWindowCounter}
+
+
+class RateChecker(object):
+
+    def __init__(self, actions, seconds, policy='log', clock=time.monotonic):
+        if actions < 1 or seconds <= 0:
+            raise ValueError('actions must be at least 1 and seconds positive')
+
+        self.actions = actions
+        self.seconds = seconds
+        self.clock = clock  # Monotonic, so wall-clock adjustments never open or close the window
+        self.policy = POLICIES[policy](actions, seconds)
+        self.times = self.policy.new_state()
 
     def check(self):
         """
         >>> clicks = RateChecker(3, 14)
         >>> clicks.check()
+        True
         >>> clicks.check()
+        True
         >>> clicks.check()
+        True
         >>> clicks.check()
         False
 
+        >>> now = [0]
+        >>> clicks = RateChecker(2, 10, clock=lambda: now[0])
+        >>> [clicks.check(), clicks.check(), clicks.check()]
+        [True, True, False]
+        >>> now[0] = 10
+        >>> clicks.check()
+        True
         """
-        current_time = datetime.datetime.now().time()
-        self.times.append(current_time)  # Append each check time to the queue
 
-        if len(self.times) > self.actions:  # First check if the queue is greater than the number of actions
-            return False  # Returning false here gives a quick win
+        return self.policy.allow(self.times, self.clock())
+
+
+class KeyedRateChecker(object):
+    """ One rate check per key, e.g. per client of an API gateway.
+
+    Keys are kept in least-recently-checked order, so each check evicts the keys idle for longer than idle_seconds
+    in amortized O(1). The default of twice the window is lossless: by then neither policy has any state left that
+    could reject a call.
+
+    >>> now = [0]
+    >>> gateway = KeyedRateChecker(2, 10, clock=lambda: now[0])
+    >>> [gateway.check('a'), gateway.check('a'), gateway.check('a'), gateway.check('b')]
+    [True, True, False, True]
+    >>> now[0] = 15
+    >>> gateway.check('b'), len(gateway)
+    (True, 2)
+    >>> now[0] = 21
+    >>> gateway.check('c'), len(gateway)
+    (True, 2)
+    >>> gateway.check_many(['a', 'a', 'a'])
+    [True, True, False]
+    """
+
+    def __init__(self, actions, seconds, policy='log', idle_seconds=None, clock=time.monotonic):
+        if actions < 1 or seconds <= 0:
+            raise ValueError('actions must be at least 1 and seconds positive')
+
+        self.actions = actions
+        self.seconds = seconds
+        self.idle_seconds = 2 * seconds if idle_seconds is None else idle_seconds
+        self.clock = clock
+        self.policy = POLICIES[policy](actions, seconds)
+        self.keys = OrderedDict()  # key -> [last checked, window state]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def evict(self, now):
+        """ Drops keys that have not been checked for idle_seconds. """
+
+        keys = self.keys
+        while keys:
+            oldest = next(iter(keys.values()))
+            if now - oldest[0] < self.idle_seconds:
+                break
+            keys.popitem(last=False)
+
+    def check(self, key, now=None):
+        if now is None:
+            now = self.clock()
+        self.evict(now)
+
+        entry = self.keys.get(key)
+        if entry is None:
+            entry = self.keys[key] = [now, self.policy.new_state()]
+        else:
+            entry[0] = now
+            self.keys.move_to_end(key)
+        return self.policy.allow(entry[1], now)
+
+    def check_many(self, keys):
+        """ Checks a batch of keys against a single clock reading. """
 
-        return datetime.datetime.strptime(str(current_time), "%H:%M:%S.%f") - datetime.datetime.strptime(
-            str(self.times.pop()), "%H:%M:%S.%f") <= datetime.timedelta(
-            seconds=self.seconds)  # Check times in the queue
-        # (Slower approach if the queue is really huge, hence why queue length vs. actions should be checked first.)
+        now = self.clock()
+        return [self.check(key, now) for key in keys]
 
 
 if __name__ == "__main__":
@@ -38,5 +163,4 @@ if __name__ == "__main__":
     results = doctest.testmod()
 
     if not results.failed:
-        print
-        "All tests passed!"
+        print("All tests passed!")
@@ -1,2 +1 @@
-SHIP
-DOCKING
+SHIP DOCKING
@@ -1,2 +1 @@
-UNLOADING
-VESSEL
+UNLOADING VESSEL
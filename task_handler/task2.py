@@ -1,3 +1 @@
-TRUCK
-LOADING
-CONTAINER
+TRUCK LOADING CONTAINER
@@ -1,2 +1 @@
-CUSTOMS
-CHECK
+CUSTOMS CHECK
@@ -1,2 +1 @@
-RE - FUELING
-SHIP
+RE-FUELING SHIP
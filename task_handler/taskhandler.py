@@ -1,99 +1,305 @@
+import os
 import sys
+import tempfile
+import time
 import unittest
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from io import StringIO
+from itertools import islice
 
-from StringIO import StringIO
+TASK_DIR = os.path.dirname(os.path.abspath(__file__))
 
 
-class TaskHandler(object):
+def complete_task(task):
+    """ Default task action. Real work is plugged in through TaskHandler(action=...). """
+
+    return task
+
+
+def _timed_task(action, batch_action, task, count):
+    """ Runs count instances of a task in a pool worker and returns how long they took. """
+
+    start = time.perf_counter()
+    if batch_action is not None:
+        batch_action(task, count)
+    else:
+        for _ in range(count):
+            action(task)
+    return time.perf_counter() - start
+
+
+def read_manifests(task_files):
+    """ Counts the task names in a batch of manifest files, using raw os-level reads instead of text file objects. """
+
+    counts = Counter()
+    for task_file in task_files:
+        fd = os.open(task_file, os.O_RDONLY)
+        try:
+            data = b''
+            while True:
+                block = os.read(fd, 4096)
+                if not block:
+                    break
+                data += block
+        finally:
+            os.close(fd)
+        counts[data.decode().strip()] += 1
+    return counts
+
+
+class ExecutionReport(object):
+    """ Per-task latencies and the critical path of one execute_tasks run. """
 
     def __init__(self):
+        self.latencies = {}
+        self.completed = {}
+        self.task_spans = {}
+        self.critical_path = []
+        self.critical_path_time = 0.0
+        self.total_time = 0.0
+
+    def mean_latency(self, task):
+        """ Mean time a single instance of a task type took. In batch mode each latency covers a whole batch. """
+
+        completed = self.completed.get(task)
+        return sum(self.latencies[task]) / completed if completed else 0.0
+
+    def __repr__(self):
+        return '<critical path {} ({:.4f}s of {:.4f}s)>'.format(' -> '.join(self.critical_path),
+                                                                 self.critical_path_time, self.total_time)
+
+
+class TaskHandler(object):
+
+    def __init__(self, task_order=None, max_workers=1, executor='thread', action=complete_task, batch_action=None):
 
         """
         Ships must dock first, then vessel can be unloaded, then a truck can
         load a container, and lastly it needs to go through a customs check.
         The refueling process can happen anytime after a ship docks.
+
+        task_order maps a task type to the task types it depends on; every
+        instance of a dependency completes before any instance of the task
+        starts. Task types without dependencies may be added freely.
+        Instances of ready task types run on a pool of max_workers threads
+        (or processes with executor='process', in which case action must be
+        picklable), so independent branches run side by side.
+
+        batch_action(task, count), if given, completes count identical
+        instances at once when executing in batches; otherwise a batch
+        calls action once per instance inside a single pool job.
         """
 
-        self._task_order = {'RE-FUELING SHIP': ['SHIP DOCKING'],
-                            'UNLOADING VESSEL': ['SHIP DOCKING'],
-                            'TRUCK LOADING CONTAINER': ['UNLOADING VESSEL'],
-                            'CUSTOMS CHECK': ['TRUCK LOADING CONTAINER']
-                            }
-
-        self.task_list = {'SHIP DOCKING': 0,
-                          'RE-FUELING SHIP': 0,
-                          'UNLOADING VESSEL': 0,
-                          'TRUCK LOADING CONTAINER': 0,
-                          'CUSTOMS CHECK': 0
+        if task_order is None:
+            task_order = {'RE-FUELING SHIP': ['SHIP DOCKING'],
+                          'UNLOADING VESSEL': ['SHIP DOCKING'],
+                          'TRUCK LOADING CONTAINER': ['UNLOADING VESSEL'],
+                          'CUSTOMS CHECK': ['TRUCK LOADING CONTAINER']
                           }
+        if executor not in ('thread', 'process'):
+            raise ValueError("executor must be 'thread' or 'process'")
 
-    def tasks_remaining(self):
-        """ Gets total number of tasks remaining. """
+        self._task_order = {task: list(dependencies) for task, dependencies in task_order.items()}
+        self.max_workers = max_workers
+        self.executor = executor
+        self.action = action
+        self.batch_action = batch_action
 
-        return sum(self.task_list.values())
+        self.task_list = {}
+        for task, dependencies in self._task_order.items():
+            for dependency in dependencies:
+                self.task_list.setdefault(dependency, 0)
+            self.task_list.setdefault(task, 0)
 
-    def add_task(self, tasks_array):
-        """ Adds an array of tasks to existing task list. """
+        self._dependents = self._build_dependents()
 
-        for task_file in tasks_array:
-            task = open(task_file).read().rstrip()
-            self.task_list[task] = self.task_list.get(task) + 1
+    def _build_dependents(self):
+        """ Inverts task_order and rejects dependency cycles. """
 
-    def execute_tasks(self):
-        """ Executes tasks in sensible order. """
+        dependents = {task: [] for task in self.task_list}
+        for task, dependencies in self._task_order.items():
+            for dependency in dependencies:
+                dependents[dependency].append(task)
 
-        for task in self.task_list.keys():
+        if len(self.topological_order(dependents)) != len(dependents):
+            raise ValueError('Task dependencies contain a cycle')
+        return dependents
 
-            if task not in self._task_order:
-                while self.task_list[task] > 0:
-                    print
-                    task + ' COMPLETED'
-                    self.remove_task(task)
+    def topological_order(self, dependents=None):
+        """ Returns the task types in an order that respects every dependency. """
 
-            else:
-                while self.task_list[task] > 0:
-                    self.check_dependencies(task)
-                    print
-                    task + ' COMPLETED'
-                    self.remove_task(task)
+        dependents = dependents or self._dependents
+        waiting = {task: len(self._task_order.get(task, ())) for task in dependents}
+        order = [task for task, count in waiting.items() if count == 0]
+        for task in order:
+            for dependent in dependents[task]:
+                waiting[dependent] -= 1
+                if waiting[dependent] == 0:
+                    order.append(dependent)
+        return order
 
-    def check_dependencies(self, task):
-        """ Checks for any task dependencies. """
+    def tasks_remaining(self):
+        """ Gets total number of tasks remaining. """
 
-        dependencies_remaining = []
+        return sum(self.task_list.values())
 
-        if task in self._task_order:
-            dependencies = self._task_order[task]
+    def add_task(self, tasks_array):
+        """ Adds an array of tasks to existing task list. """
 
-            for dependency in dependencies:
-                dependencies_remaining.append(dependency)
+        self._add_counts(read_manifests(tasks_array))
 
-        if dependencies_remaining == []:
-            return
-        else:
-            for dependency in dependencies_remaining:
-                self.check_dependencies(dependency)
+    def add_tasks_from_dir(self, directory, suffix='', batch_size=10000):
+        """ Adds every manifest file in a directory whose name ends with suffix.
+
+        File names are listed lazily with os.scandir and read in batches on max_workers threads, so ingesting many
+        files overlaps their I/O and only touches the task list once per batch.
+        """
+
+        def batches():
+            with os.scandir(directory) as entries:
+                task_files = (entry.path for entry in entries if entry.name.endswith(suffix) and entry.is_file())
+                while True:
+                    batch = list(islice(task_files, batch_size))
+                    if not batch:
+                        return
+                    yield batch
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            for counts in pool.map(read_manifests, batches()):
+                self._add_counts(counts)
+
+    def add_tasks_from_stream(self, stream, batch_size=100000):
+        """ Adds one task per non-blank line of a text stream, counting a batch of lines at a time. """
+
+        while True:
+            lines = list(islice(stream, batch_size))
+            if not lines:
+                return
+            self._add_counts(Counter(task for task in map(str.strip, lines) if task))
+
+    def _add_counts(self, counts):
+        """ Merges task counts into the task list. Unknown task types have no dependencies. """
+
+        for task, count in counts.items():
+            if task not in self.task_list:
+                self.task_list[task] = 0
+                self._dependents[task] = []
+            self.task_list[task] += count
+
+    def execute_tasks(self, batch_size=None):
+        """ Executes tasks in dependency order, running independent task types concurrently. Returns an ExecutionReport.
+
+        With a batch_size, ready instances of a task type are completed up to batch_size at a time in one pool job,
+        and each batch prints a single aggregated 'TASK COMPLETED xN' line.
+        """
 
-    def remove_task(self, task):
+        report = ExecutionReport()
+        waiting = {task: len(self._task_order.get(task, ())) for task in self.task_list}
+        running = {}
+        task_start = {}
+        run_start = time.perf_counter()
+
+        pool_class = ProcessPoolExecutor if self.executor == 'process' else ThreadPoolExecutor
+        with pool_class(max_workers=self.max_workers) as pool:
+            pending = {}
+            sequence = 0
+
+            def release(task):
+                """ Submits every instance of a ready task type. A type with no instances completes at once. """
+
+                nonlocal sequence
+                task_start[task] = time.perf_counter()
+                running[task] = self.task_list[task]
+                report.latencies[task] = []
+                report.completed[task] = 0
+                remaining = self.task_list[task]
+                while remaining:
+                    count = min(batch_size, remaining) if batch_size else 1
+                    future = pool.submit(_timed_task, self.action, self.batch_action, task, count)
+                    pending[future] = (sequence, task, count)
+                    sequence += 1
+                    remaining -= count
+                if running[task] == 0:
+                    finish(task)
+
+            def finish(task):
+                report.task_spans[task] = (task_start[task] - run_start, time.perf_counter() - run_start)
+                for dependent in self._dependents[task]:
+                    waiting[dependent] -= 1
+                    if waiting[dependent] == 0:
+                        release(dependent)
+
+            for task in [task for task, count in waiting.items() if count == 0]:
+                release(task)
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in sorted(done, key=lambda f: pending[f][0]):
+                    _, task, count = pending.pop(future)
+                    report.latencies[task].append(future.result())
+                    report.completed[task] += count
+                    if batch_size:
+                        print('{} COMPLETED x{}'.format(task, count))
+                    else:
+                        print(task + ' COMPLETED')
+                    self.remove_task(task, count)
+                    running[task] -= count
+                    if running[task] == 0:
+                        finish(task)
+
+        report.total_time = time.perf_counter() - run_start
+        self._critical_path(report)
+        return report
+
+    def _critical_path(self, report):
+        """ Finds the dependency chain with the longest summed task span. """
+
+        longest = {}
+        previous = {}
+        for task in self.topological_order():
+            start, end = report.task_spans.get(task, (0.0, 0.0))
+            best = max(self._task_order.get(task, ()), key=lambda dependency: longest[dependency], default=None)
+            longest[task] = (end - start) + (longest[best] if best else 0.0)
+            previous[task] = best
+
+        if not longest:
+            return
+        task = max(longest, key=longest.get)
+        report.critical_path_time = longest[task]
+        while task:
+            report.critical_path.append(task)
+            task = previous[task]
+        report.critical_path.reverse()
+
+    def remove_task(self, task, count=1):
         """ Removes a task from the task list once it has been completed. """
 
-        self.task_list[task] -= 1
+        self.task_list[task] -= count
 
     def __repr__(self):
 
         return '<{} tasks remaining>'.format(self.tasks_remaining())
 
 
+def _slow_task(task):
+    time.sleep(0.05 if task == 'UNLOADING VESSEL' else 0.01)
+
+
 class TestingTaskHandler(unittest.TestCase):
 
     def setUp(self):
         self.job = TaskHandler()
         self.job.add_task(
-            ['task0.py', 'task1.py', 'task4.py', 'task2.py', 'task3.py', 'task3.py', 'task4.py', 'task2.py',
-             'task1.py'])
+            [os.path.join(TASK_DIR, task_file) for task_file in
+             ['task0.py', 'task1.py', 'task4.py', 'task2.py', 'task3.py', 'task3.py', 'task4.py', 'task2.py',
+              'task1.py']])
         self.held = sys.stdout
         sys.stdout = StringIO()
 
+    def tearDown(self):
+        sys.stdout = self.held
+
     def test_add_tasks(self):
         self.assertEqual(self.job.tasks_remaining(), 9)
         self.assertEqual(self.job.task_list,
@@ -111,7 +317,55 @@ class TestingTaskHandler(unittest.TestCase):
         self.job.execute_tasks()
         self.assertEqual(self.job.tasks_remaining(), 0)
         self.assertEqual(sys.stdout.getvalue(),
-                         'SHIP DOCKING COMPLETED\nUNLOADING VESSEL COMPLETED\nUNLOADING VESSEL COMPLETED\nCUSTOMS CHECK COMPLETED\nCUSTOMS CHECK COMPLETED\nTRUCK LOADING CONTAINER COMPLETED\nTRUCK LOADING CONTAINER COMPLETED\nRE-FUELING SHIP COMPLETED\nRE-FUELING SHIP COMPLETED\n')
+                         'SHIP DOCKING COMPLETED\nRE-FUELING SHIP COMPLETED\nRE-FUELING SHIP COMPLETED\nUNLOADING VESSEL COMPLETED\nUNLOADING VESSEL COMPLETED\nTRUCK LOADING CONTAINER COMPLETED\nTRUCK LOADING CONTAINER COMPLETED\nCUSTOMS CHECK COMPLETED\nCUSTOMS CHECK COMPLETED\n')
+
+    def test_parallel_branches(self):
+        job = TaskHandler(max_workers=4, action=_slow_task)
+        job.task_list.update({'SHIP DOCKING': 1, 'RE-FUELING SHIP': 3, 'UNLOADING VESSEL': 3,
+                              'TRUCK LOADING CONTAINER': 1, 'CUSTOMS CHECK': 1})
+        report = job.execute_tasks()
+
+        # Every line is printed after all of the task's dependencies
+        lines = sys.stdout.getvalue().splitlines()
+        self.assertEqual(job.tasks_remaining(), 0)
+        self.assertLess(lines.index('SHIP DOCKING COMPLETED'), lines.index('RE-FUELING SHIP COMPLETED'))
+        self.assertLess(lines.index('TRUCK LOADING CONTAINER COMPLETED'), lines.index('CUSTOMS CHECK COMPLETED'))
+
+        # Re-fueling overlaps unloading instead of waiting for it
+        self.assertLess(report.task_spans['RE-FUELING SHIP'][0], report.task_spans['UNLOADING VESSEL'][1])
+        self.assertEqual(report.critical_path,
+                         ['SHIP DOCKING', 'UNLOADING VESSEL', 'TRUCK LOADING CONTAINER', 'CUSTOMS CHECK'])
+        self.assertEqual(len(report.latencies['UNLOADING VESSEL']), 3)
+
+    def test_custom_graph_and_cycles(self):
+        job = TaskHandler({'B': ['A'], 'C': ['A'], 'D': ['B', 'C']}, max_workers=2)
+        job.task_list.update({'A': 1, 'B': 2, 'C': 2, 'D': 1})
+        job.execute_tasks()
+        self.assertEqual(sys.stdout.getvalue().splitlines()[-1], 'D COMPLETED')
+        self.assertRaises(ValueError, TaskHandler, {'A': ['B'], 'B': ['A']})
+
+    def test_bulk_ingestion(self):
+        job = TaskHandler(max_workers=2)
+        with tempfile.TemporaryDirectory() as manifests:
+            for i in range(25):
+                with open(os.path.join(manifests, '{}.task'.format(i)), 'w') as manifest:
+                    manifest.write('SHIP DOCKING\n' if i % 5 == 0 else 'CUSTOMS CHECK\n')
+            open(os.path.join(manifests, 'notes.txt'), 'w').close()
+            job.add_tasks_from_dir(manifests, suffix='.task', batch_size=4)
+        job.add_tasks_from_stream(StringIO('UNLOADING VESSEL\n\nUNLOADING VESSEL\nLASHING\n'), batch_size=3)
+        self.assertEqual(job.task_list, {'SHIP DOCKING': 5, 'RE-FUELING SHIP': 0, 'UNLOADING VESSEL': 2,
+                                         'TRUCK LOADING CONTAINER': 0, 'CUSTOMS CHECK': 20, 'LASHING': 1})
+
+    def test_batch_execution(self):
+        completed = Counter()
+        job = TaskHandler(batch_action=lambda task, count: completed.update({task: count}))
+        job.task_list.update({'SHIP DOCKING': 5, 'CUSTOMS CHECK': 2})
+        report = job.execute_tasks(batch_size=3)
+        self.assertEqual(job.tasks_remaining(), 0)
+        self.assertEqual(completed, {'SHIP DOCKING': 5, 'CUSTOMS CHECK': 2})
+        self.assertEqual(sys.stdout.getvalue(),
+                         'SHIP DOCKING COMPLETED x3\nSHIP DOCKING COMPLETED x2\nCUSTOMS CHECK COMPLETED x2\n')
+        self.assertEqual(report.completed['SHIP DOCKING'], 5)
 
 
 if __name__ == '__main__':